@@ -1,13 +1,12 @@
-import robin_stocks.robinhood as r
+from etf_holdings_store import EtfHoldingsStore
 
-# Login to Robinhood
-r.login('joncrissey@gmail.com')
-
-# Get the holdings of an ETF
-holdings = r.account.get_holdings('QQQ')
+# Get the holdings of the ETFs (from the issuer holdings files, see etf_holdings_store.py),
+# refreshing only those older than the cache TTL
+store = EtfHoldingsStore(['QQQ'])
+store.refresh()
 
 # Check if NVDA is in the holdings
-if 'NVDA' in holdings:
+if store.etfs_holding('NVDA'):
     print('NVDA is in the holdings of this ETF.')
 else:
-    print('NVDA is not in the holdings of this ETF.')
\ No newline at end of file
+    print('NVDA is not in the holdings of this ETF.')
@@ -0,0 +1,60 @@
+"""
+Robinhood accounts of the scripts.
+
+The accounts are configured once instead of being hardcoded in the scripts, with the
+RH_ACCOUNTS environment variable:
+
+    RH_ACCOUNTS="main=jane@example.com,ira=jane.ira@example.com"
+
+or with ../output/accounts.json:
+
+    [{"name": "main", "username": "jane@example.com"}, {"name": "ira", "username": "jane.ira@example.com"}]
+
+Every account keeps its own stored session (robin_stocks pickle_name), so logging in to
+one account does not log out of another. RH_ACCOUNT selects the account of the single
+account scripts (the first configured account by default); without any configuration
+they log in with the stored default session, as before.
+"""
+
+import json
+import os
+
+ACCOUNTS_PATH = '../output/accounts.json'
+
+
+def load_accounts(spec=None, path=ACCOUNTS_PATH):
+    """Return the configured accounts as [{'name', 'username'}], from spec, RH_ACCOUNTS or the file."""
+    spec = spec or os.environ.get('RH_ACCOUNTS')
+    if spec:
+        accounts = []
+        for entry in spec.split(','):
+            name, _, username = entry.strip().partition('=')
+            accounts.append({'name': name, 'username': username or name})
+        return accounts
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return []
+
+
+def get_account(name=None, accounts=None):
+    """Return the account called name (RH_ACCOUNT by default, else the first), or None if none is configured."""
+    accounts = load_accounts() if accounts is None else accounts
+    name = name or os.environ.get('RH_ACCOUNT')
+    if name:
+        for account in accounts:
+            if name in (account['name'], account['username']):
+                return account
+        raise ValueError(f"Unknown account '{name}', configured: {', '.join(a['name'] for a in accounts) or 'none'}")
+    return accounts[0] if accounts else None
+
+
+def login(account=None):
+    """Log in to an account (a dict of load_accounts, or a name) with its own stored session."""
+    import robin_stocks.robinhood as r
+
+    if account is None or isinstance(account, str):
+        account = get_account(account)
+    if account is None:
+        return r.login()
+    return r.login(account['username'], pickle_name=account['name'])
@@ -0,0 +1,246 @@
+"""
+Record and replay Robinhood API responses.
+
+robin_stocks sends every request through one shared requests.Session. This module
+mounts a transport adapter on that session:
+
+- record mode forwards requests to the real API and appends every JSON response
+  (chains, market data, orders, events, positions, transfers, ...) to a cassette file.
+  The responses of the login endpoints (tokens, MFA challenges) are never written, and
+  credentials and personal fields (SECRET_FIELDS) are redacted from the others
+- replay mode never touches the network and serves the recorded responses instead,
+  with optional latency and error injection, so the scanners and order scripts can be
+  run and profiled deterministically on an offline machine
+
+The cassette is a JSON lines file with one recorded response per line. Requests are
+matched on method, URL and sorted query parameters. When the same request was recorded
+several times (for example while polling quotes), the responses are replayed in the
+recorded order and the last one is repeated.
+
+The mode is selected with environment variables, read by install_from_env():
+    RH_RECORD=cassette.jsonl         record responses from the live API
+    RH_REPLAY=cassette.jsonl         replay responses from the cassette
+    RH_REPLAY_LATENCY=0.05           seconds added to every replayed response
+    RH_REPLAY_JITTER=0.02            random extra latency, up to this many seconds
+    RH_REPLAY_ERROR_RATE=0.01        fraction of replayed requests that fail
+    RH_REPLAY_ERROR_STATUS=429       HTTP status of the injected failures
+    RH_REPLAY_SEED=0                 random seed for the latency jitter and errors
+
+Usage:
+    RH_RECORD=../output/cassette.jsonl python get_high_prob_bull_put_spreads.py
+    RH_REPLAY=../output/cassette.jsonl python get_high_prob_bull_put_spreads.py
+    python api_replay.py ../output/cassette.jsonl     # list the recorded endpoints
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+_installed = None
+
+# Login endpoints, whose responses are not recorded (replay mode needs no login)
+AUTH_PATHS = ('/oauth2/', '/challenge/', '/pathfinder/', '/push/')
+# Fields whose values are replaced by REDACTED in the recorded bodies
+SECRET_FIELDS = {'access_token', 'refresh_token', 'id_token', 'token', 'device_token', 'backup_code', 'mfa_code',
+                 'password', 'username', 'email', 'phone_number', 'first_name', 'last_name', 'tax_id', 'ssn',
+                 'tax_id_ssn', 'date_of_birth', 'address', 'zipcode', 'bank_account_number', 'bank_routing_number',
+                 'routing_number'}
+REDACTED = 'REDACTED'
+
+
+def request_key(method, url):
+    """Return the cassette key of a request: method and URL with sorted query parameters."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+
+
+def load_cassette(path):
+    """Load a cassette into a {request key: [recorded responses]} dict."""
+    recordings = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings.setdefault(entry['key'], []).append(entry)
+    return recordings
+
+
+def is_auth_request(url):
+    """Whether a request goes to a login endpoint."""
+    return any(part in urlsplit(url).path for part in AUTH_PATHS)
+
+
+def redact(data):
+    """Return a JSON value with the values of SECRET_FIELDS replaced, at any depth."""
+    if isinstance(data, dict):
+        return {key: REDACTED if key in SECRET_FIELDS and value is not None else redact(value)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+
+def _build_response(request, status, body, headers=None):
+    response = Response()
+    response.status_code = status
+    response._content = body.encode('utf-8') if isinstance(body, str) else body
+    response.headers = CaseInsensitiveDict(headers or {'Content-Type': 'application/json'})
+    response.url = request.url
+    response.request = request
+    response.encoding = 'utf-8'
+    return response
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter that forwards requests and appends redacted JSON responses to a cassette."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if 'json' in response.headers.get('Content-Type', '') and not is_auth_request(request.url):
+            try:
+                body = json.dumps(redact(response.json()))
+            except ValueError:
+                return response
+            entry = {
+                'key': request_key(request.method, request.url),
+                'status': response.status_code,
+                'body': body,
+                'recorded_at': time.time(),
+            }
+            with self.lock, open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Transport adapter that serves recorded responses with optional latency and errors."""
+
+    def __init__(self, path, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.recordings = load_cassette(path)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.positions = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url)
+        with self.lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            inject_error = self.random.random() < self.error_rate
+            entries = self.recordings.get(key)
+            if entries:
+                entry = entries[min(self.positions[key], len(entries) - 1)]
+                self.positions[key] += 1
+            else:
+                self.misses[key] += 1
+
+        if delay:
+            time.sleep(delay)
+        if inject_error:
+            return _build_response(request, self.error_status, json.dumps({'detail': 'injected error'}),
+                                   {'Content-Type': 'application/json', 'Retry-After': '0'})
+        if not entries:
+            return _build_response(request, 404, json.dumps({'detail': f'not recorded: {key}'}))
+        return _build_response(request, entry['status'], entry['body'])
+
+
+def _session():
+    from robin_stocks.robinhood import helper
+
+    return helper.SESSION
+
+
+def install_recorder(path):
+    """Record every API response made through robin_stocks to the cassette at path."""
+    adapter = RecordingAdapter(path)
+    _session().mount('https://', adapter)
+    return adapter
+
+
+def install_replay(path, **options):
+    """Serve every API request made through robin_stocks from the cassette at path.
+
+    Logging in is replaced by a no-op, so no credentials are needed.
+    """
+    import robin_stocks.robinhood as r
+    from robin_stocks.robinhood import authentication, helper
+
+    adapter = ReplayAdapter(path, **options)
+    _session().mount('https://', adapter)
+
+    def offline_login(*args, **kwargs):
+        helper.set_login_state(True)
+        return {'detail': 'replay'}
+
+    r.login = offline_login
+    authentication.login = offline_login
+    helper.set_login_state(True)
+    return adapter
+
+
+def install_from_env():
+    """Install the recorder or the replay transport according to RH_RECORD / RH_REPLAY.
+
+    Returns the installed adapter, or None when neither variable is set. Calling it more
+    than once installs the adapter only the first time.
+    """
+    global _installed
+    if _installed is not None:
+        return _installed
+
+    if os.environ.get('RH_REPLAY'):
+        seed = os.environ.get('RH_REPLAY_SEED')
+        _installed = install_replay(
+            os.environ['RH_REPLAY'],
+            latency=float(os.environ.get('RH_REPLAY_LATENCY', 0)),
+            jitter=float(os.environ.get('RH_REPLAY_JITTER', 0)),
+            error_rate=float(os.environ.get('RH_REPLAY_ERROR_RATE', 0)),
+            error_status=int(os.environ.get('RH_REPLAY_ERROR_STATUS', 429)),
+            seed=int(seed) if seed is not None else None,
+        )
+    elif os.environ.get('RH_RECORD'):
+        _installed = install_recorder(os.environ['RH_RECORD'])
+    return _installed
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python api_replay.py <cassette.jsonl>")
+        return
+
+    recordings = load_cassette(sys.argv[1])
+    endpoints = Counter()
+    for key, entries in recordings.items():
+        method, url = key.split(' ', 1)
+        endpoints[f"{method} {urlsplit(url).path}"] += len(entries)
+
+    for endpoint, count in endpoints.most_common():
+        print(f"{count:6d}  {endpoint}")
+    print(f"{sum(endpoints.values())} responses for {len(recordings)} distinct requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Historical backtest of the bull put spread selection rules.
+
+Replays the daily chain snapshots (see chain_snapshots.py), the last snapshot of every
+contract of a scan date when it was snapshotted more than once, and applies the rules of
+get_high_prob_bull_put_spreads.py to every scan date:
+- both legs have a 'PoP sell' inside [pop_floor, pop_ceiling] and traded (volume >= min_volume)
+- the short leg has the higher strike and the width is one of the spread widths
+- the credit is the short mark minus the long mark
+
+Every day, up to max_new_per_day new spreads per symbol are opened (the highest credits
+first; a spread that was already opened is not opened again). Open spreads are marked
+on every later snapshot and closed at the first snapshot where
+- the debit to close is at most (1 - take_profit) * credit (take profit), or
+- the loss reaches stop_loss * credit (stop loss).
+Otherwise they expire and settle at their intrinsic value, using the last underlying price
+recorded on or before the expiration date. Spreads whose expiration is after the last
+snapshot stay open and are valued at their last debit.
+
+Selection and tracking are vectorized across dates and symbols: candidate spreads of all
+scan dates are found with one join of the legs per width, and the marks of all open
+spreads on all later dates with one join per leg. Only the choice of the spreads to open
+goes day by day, because it depends on the spreads opened before.
+
+The trades are written as CSV and the statistics as JSON to ../output/backtests/.
+
+Usage:
+    python backtest.py --symbols AMD,META --start 2023-01-01 --end 2024-04-19 \\
+        --pop-floor 0.65 --pop-ceiling 0.85 --widths 2.5,5,10 --take-profit 0.5 --stop-loss 2
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+BACKTEST_DIR = '../output/backtests'
+
+DEFAULT_RULES = {
+    'pop_floor': 0.65,
+    'pop_ceiling': 0.85,
+    'widths': [2.5, 5, 10],
+    'min_volume': 1,
+    'min_credit': 0.01,
+    'max_new_per_day': 1,
+    'take_profit': 0.5,
+    'stop_loss': 2.0,
+}
+SNAPSHOT_COLUMNS = ['symbol', 'expiration', 'type', 'strike', 'mark', 'volume', 'PoP sell', 'underlying']
+SPREAD_KEY = ['symbol', 'expiration', 'short_strike', 'long_strike']
+
+
+def prepare_snapshots(snapshots):
+    """Keep the put contracts and add integer strikes in cents, so strikes can be joined exactly."""
+    df = snapshots
+    if 'type' in df.columns:
+        df = df[df['type'] == 'put']
+    df = df.dropna(subset=['strike', 'mark']).copy()
+    df['strike_cents'] = (df['strike'] * 100).round().astype('int64')
+    return df
+
+
+def select_spreads(snapshots, pop_floor, pop_ceiling, widths, min_volume=1, min_credit=0.01):
+    """Return the candidate spreads of every scan date and symbol that pass the selection rules."""
+    legs = snapshots[snapshots['PoP sell'].between(pop_floor, pop_ceiling) & (snapshots['volume'] >= min_volume)]
+    legs = legs[['scan_date', 'symbol', 'expiration', 'strike_cents', 'strike', 'mark', 'PoP sell']]
+    keys = ['scan_date', 'symbol', 'expiration']
+
+    frames = []
+    for width in widths:
+        shorts = legs.assign(long_cents=legs['strike_cents'] - int(round(width * 100)))
+        pairs = shorts.merge(legs, left_on=keys + ['long_cents'], right_on=keys + ['strike_cents'],
+                             suffixes=('_short', '_long'))
+        pairs['width'] = width
+        frames.append(pairs)
+    spreads = pd.concat(frames, ignore_index=True)
+
+    spreads = spreads.rename(columns={'strike_short': 'short_strike', 'strike_long': 'long_strike'})
+    spreads['credit'] = (spreads['mark_short'] - spreads['mark_long']).round(2)
+    spreads['PoP sell'] = ((spreads['PoP sell_short'] + spreads['PoP sell_long']) / 2).round(4)
+    spreads = spreads[(spreads['credit'] >= min_credit) & (spreads['scan_date'] < spreads['expiration'])]
+    return spreads[keys + ['short_strike', 'long_strike', 'strike_cents_short', 'strike_cents_long',
+                           'width', 'credit', 'PoP sell']].reset_index(drop=True)
+
+
+def open_trades(candidates, max_new_per_day=1):
+    """Pick the spreads to open: at most max_new_per_day per symbol and day, the highest credits first.
+
+    A spread that was opened is not opened again; a spread that qualified but lost to the
+    daily cap can still be opened on a later day. Which spreads are open depends on the
+    earlier days, so this is the one step that goes day by day.
+    """
+    candidates = candidates.sort_values(['scan_date', 'credit'], ascending=[True, False])
+    opened = set()
+    days = []
+    for _, day in candidates.groupby('scan_date', sort=True):
+        keys = list(day[SPREAD_KEY].itertuples(index=False, name=None))
+        day = day[[key not in opened for key in keys]]
+        day = day[day.groupby('symbol').cumcount() < max_new_per_day]
+        opened.update(day[SPREAD_KEY].itertuples(index=False, name=None))
+        days.append(day)
+    trades = pd.concat(days) if days else candidates.iloc[:0]
+    trades = trades.rename(columns={'scan_date': 'entry_date'}).reset_index(drop=True)
+    trades['trade_id'] = np.arange(len(trades))
+    return trades
+
+
+def _leg_marks(trades, marks, leg):
+    """Return the marks of one leg of every trade on the snapshot dates after its entry."""
+    path = trades[['trade_id', 'symbol', 'expiration', 'entry_date', f'strike_cents_{leg}']].merge(
+        marks, left_on=['symbol', 'expiration', f'strike_cents_{leg}'], right_on=['symbol', 'expiration', 'strike_cents'])
+    path = path[(path['scan_date'] > path['entry_date']) & (path['scan_date'] <= path['expiration'])]
+    return path[['trade_id', 'scan_date', 'mark']].rename(columns={'mark': f'mark_{leg}'})
+
+
+def _settlement_prices(trades, snapshots):
+    """Return the last underlying price on or before each trade's expiration (NaN when unknown)."""
+    underlying = (snapshots.dropna(subset=['underlying'])
+                  .groupby(['symbol', 'scan_date'], as_index=False)['underlying'].first())
+    underlying['date'] = pd.to_datetime(underlying['scan_date'])
+    lookup = trades[['trade_id', 'symbol', 'expiration']].assign(date=pd.to_datetime(trades['expiration']))
+    settled = pd.merge_asof(lookup.sort_values('date'), underlying[['symbol', 'date', 'underlying']].sort_values('date'),
+                            on='date', by='symbol', direction='backward')
+    return settled.set_index('trade_id')['underlying'].reindex(trades['trade_id']).to_numpy()
+
+
+def track_trades(trades, snapshots, take_profit=0.5, stop_loss=2.0, last_date=None):
+    """Mark every trade on the later snapshots and close it on the exit rules or at expiration."""
+    trades = trades.copy()
+    if trades.empty:
+        return trades.assign(exit_date=[], exit_debit=[], exit_reason=[], pnl=[], days_held=[])
+    last_date = last_date or snapshots['scan_date'].max()
+
+    marks = snapshots[['scan_date', 'symbol', 'expiration', 'strike_cents', 'mark']]
+    path = _leg_marks(trades, marks, 'short').merge(_leg_marks(trades, marks, 'long'), on=['trade_id', 'scan_date'])
+    path = path.merge(trades[['trade_id', 'credit']], on='trade_id')
+    path['debit'] = path['mark_short'] - path['mark_long']
+    path = path.sort_values(['trade_id', 'scan_date'])
+
+    # First snapshot where an exit rule triggers
+    path['reason'] = np.select(
+        [path['debit'] <= path['credit'] * (1 - take_profit), path['debit'] - path['credit'] >= stop_loss * path['credit']],
+        ['take_profit', 'stop_loss'], default='')
+    exits = path[path['reason'] != ''].groupby('trade_id').first()
+    last_marks = path.groupby('trade_id').last()
+
+    ids = trades['trade_id']
+    trades['exit_date'] = ids.map(exits['scan_date'])
+    trades['exit_debit'] = ids.map(exits['debit'])
+    trades['exit_reason'] = ids.map(exits['reason'])
+
+    # Trades without an exit expire at their intrinsic value, or stay open after the last snapshot
+    remaining = trades['exit_reason'].isna()
+    expired = remaining & (trades['expiration'] <= last_date)
+    settlement = _settlement_prices(trades, snapshots)
+    intrinsic = np.clip(trades['short_strike'] - settlement, 0, trades['width'])
+    # Without an underlying price, the last recorded debit is used
+    intrinsic = intrinsic.fillna(ids.map(last_marks['debit']))
+    trades.loc[expired, 'exit_date'] = trades.loc[expired, 'expiration']
+    trades.loc[expired, 'exit_debit'] = intrinsic[expired]
+    trades.loc[expired, 'exit_reason'] = 'expired'
+
+    still_open = remaining & ~expired
+    trades.loc[still_open, 'exit_date'] = last_date
+    trades.loc[still_open, 'exit_debit'] = ids[still_open].map(last_marks['debit']).fillna(trades['credit'])
+    trades.loc[still_open, 'exit_reason'] = 'open'
+
+    trades['pnl'] = ((trades['credit'] - trades['exit_debit'].astype(float)) * 100).round(2)
+    trades['days_held'] = (pd.to_datetime(trades['exit_date']) - pd.to_datetime(trades['entry_date'])).dt.days
+    return trades
+
+
+def trade_statistics(trades):
+    """Return the P&L statistics of the closed trades."""
+    closed = trades[trades['exit_reason'] != 'open'].sort_values('exit_date')
+    if closed.empty:
+        return {'trades': 0, 'open_trades': int(len(trades))}
+
+    wins = closed[closed['pnl'] > 0]
+    losses = closed[closed['pnl'] <= 0]
+    equity = closed['pnl'].cumsum()
+    drawdown = equity - equity.cummax().clip(lower=0)
+
+    return {
+        'trades': int(len(closed)),
+        'open_trades': int(len(trades) - len(closed)),
+        'win_rate': round(len(wins) / len(closed), 4),
+        'total_pnl': round(float(closed['pnl'].sum()), 2),
+        'avg_pnl': round(float(closed['pnl'].mean()), 2),
+        'avg_win': round(float(wins['pnl'].mean()), 2) if len(wins) else 0.0,
+        'avg_loss': round(float(losses['pnl'].mean()), 2) if len(losses) else 0.0,
+        'profit_factor': round(float(wins['pnl'].sum() / -losses['pnl'].sum()), 2) if losses['pnl'].sum() < 0 else None,
+        'max_drawdown': round(float(drawdown.min()), 2),
+        'avg_days_held': round(float(closed['days_held'].mean()), 1),
+        'exit_reasons': closed['exit_reason'].value_counts().to_dict(),
+        'by_symbol': closed.groupby('symbol')['pnl'].agg(['count', 'sum', 'mean']).round(2).to_dict(orient='index'),
+    }
+
+
+def run_backtest(snapshots, rules=None):
+    """Backtest the selection rules on the snapshots. Returns the trades and their statistics."""
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    snapshots = prepare_snapshots(snapshots)
+
+    candidates = select_spreads(snapshots, rules['pop_floor'], rules['pop_ceiling'], rules['widths'],
+                                rules['min_volume'], rules['min_credit'])
+    trades = open_trades(candidates, rules['max_new_per_day'])
+    trades = track_trades(trades, snapshots, rules['take_profit'], rules['stop_loss'])
+    return trades, trade_statistics(trades)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest the bull put spread selection rules on chain snapshots')
+    parser.add_argument('--symbols', help='comma separated symbols (default: all recorded symbols)')
+    parser.add_argument('--start', help='first scan date (YYYY-MM-DD)')
+    parser.add_argument('--end', help='last scan date (YYYY-MM-DD)')
+    parser.add_argument('--pop-floor', type=float, default=DEFAULT_RULES['pop_floor'])
+    parser.add_argument('--pop-ceiling', type=float, default=DEFAULT_RULES['pop_ceiling'])
+    parser.add_argument('--widths', default='2.5,5,10', help='comma separated spread widths')
+    parser.add_argument('--min-credit', type=float, default=DEFAULT_RULES['min_credit'])
+    parser.add_argument('--max-new-per-day', type=int, default=DEFAULT_RULES['max_new_per_day'],
+                        help='new spreads opened per symbol and day')
+    parser.add_argument('--take-profit', type=float, default=DEFAULT_RULES['take_profit'],
+                        help='close at this fraction of the max profit')
+    parser.add_argument('--stop-loss', type=float, default=DEFAULT_RULES['stop_loss'],
+                        help='close when the loss reaches this multiple of the credit')
+    parser.add_argument('--output-dir', default=BACKTEST_DIR)
+    args = parser.parse_args()
+
+    from chain_snapshots import read_snapshots
+
+    symbols = [symbol.strip().upper() for symbol in args.symbols.split(',')] if args.symbols else None
+    rules = {
+        'pop_floor': args.pop_floor,
+        'pop_ceiling': args.pop_ceiling,
+        'widths': [float(width) for width in args.widths.split(',')],
+        'min_credit': args.min_credit,
+        'max_new_per_day': args.max_new_per_day,
+        'take_profit': args.take_profit,
+        'stop_loss': args.stop_loss,
+    }
+
+    # A scan date snapshotted twice would pair every leg with its own duplicate
+    snapshots = read_snapshots(symbols, args.start, args.end, columns=SNAPSHOT_COLUMNS, latest=True)
+    print(f"Replaying {snapshots['scan_date'].nunique()} scan dates, {len(snapshots)} contracts")
+    trades, stats = run_backtest(snapshots, rules)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = os.path.join(args.output_dir, f"backtest_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    trades.to_csv(base + '.csv', index=False)
+    with open(base + '.json', 'w') as f:
+        json.dump({'rules': rules, 'symbols': symbols, 'start': args.start, 'end': args.end, 'stats': stats}, f, indent=2)
+
+    print(json.dumps(stats, indent=2))
+    print(f"Trades saved to {base}.csv")
+
+
+if __name__ == "__main__":
+    main()
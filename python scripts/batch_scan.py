@@ -0,0 +1,239 @@
+"""
+Batch option scanner.
+
+Runs many scan jobs in one process, without any prompts, so scans can be scheduled
+(cron, launchd, ...) without paying the imports and a login per configuration.
+
+The jobs are read from a JSON config file:
+
+{
+    "defaults": {"option_type": "put", "type_profit": "chance_of_profit_short"},
+    "jobs": [
+        {"name": "tech_spreads", "kind": "spreads", "symbols": ["AMD", "META"],
+         "expirations": ["2024-04-26", "2024-05-17"],
+         "pop_floor": 0.65, "pop_ceiling": 0.85, "widths": [2.5, 5, 10]},
+        {"name": "puts", "kind": "options", "symbols": ["AMD", "NFLX"],
+         "expirations": ["2024-04-26"], "pop_floor": 0.70, "pop_ceiling": 0.78,
+         "min_open_interest": 100, "max_bid_ask_width": 0.25, "max_strike_distance": 0.15}
+    ]
+}
+
+- "spreads" jobs build credit spreads like get_high_prob_bull_put_spreads.py and
+  append them to the ../output/datasets/<option type>_credit_spreads Parquet dataset
+- "options" jobs clean single options like get_high_prob_put_options.py and append
+  them to the ../output/datasets/<option type>_option_data Parquet dataset
+
+With --format csv (or both), the CSV files of the interactive scripts are written to
+--output-dir as well: one {symbols}_{exp_date}_{option_type}_credit_spreads.csv per expiration,
+and one {symbol}_{option_type}_option_data.csv per symbol (with the expiration added to
+the name when a job scans several expirations).
+
+All jobs share one login and one ChainCache. Before any job runs, the distinct
+(symbol, expiration, option type) chains needed by all jobs are fetched once,
+concurrently, so jobs that overlap never fetch the same chain twice. Each job then
+pre-filters the raw cached chains with its own PoP band and liquidity limits
+(min_volume, min_open_interest, max_bid_ask_width, max_strike_distance; see
+chain_filters.py) before any DataFrame is built. Jobs with "fill_iv": true first derive
+the missing IV, greeks and PoP of the chains from the bid/ask mid (see iv_solver.py).
+
+With --snapshot, the full fetched chains are also appended to the chain_snapshots
+dataset (see chain_snapshots.py), which is the history replayed by backtest.py.
+
+Usage:
+    python batch_scan.py scans.json [--format parquet|csv|both] [--output-dir .] [--profile] [--snapshot]
+"""
+
+import argparse
+import json
+import os
+
+import pandas as pd
+
+import get_high_prob_bull_put_spreads as spread_scan
+import get_high_prob_put_options as option_scan
+from chain_cache import ChainCache
+from chain_filters import build_filters, fetch_spot_prices
+from chain_snapshots import write_cached_snapshots
+from run_profiler import RunReport
+from scan_output import write_dataset, write_results
+
+JOB_DEFAULTS = {
+    'kind': 'spreads',
+    'option_type': 'put',
+    'type_profit': 'chance_of_profit_short',
+    'pop_floor': 0.65,
+    'pop_ceiling': 0.85,
+    'widths': [2.5, 5, 10],
+    'min_volume': 1,
+    'min_open_interest': 0,
+    'max_bid_ask_width': None,
+    'max_strike_distance': None,
+    'fill_iv': False,
+}
+
+
+def load_jobs(path):
+    """Read the job config and return the jobs with the defaults applied."""
+    with open(path) as f:
+        config = json.load(f)
+
+    defaults = dict(JOB_DEFAULTS, **config.get('defaults', {}))
+    jobs = []
+    for number, job in enumerate(config['jobs']):
+        job = dict(defaults, **job)
+        job.setdefault('name', f"job_{number}")
+        job['symbols'] = [symbol.strip().upper() for symbol in job['symbols']]
+        if job['kind'] not in ('spreads', 'options'):
+            raise ValueError(f"Unknown job kind '{job['kind']}' in job '{job['name']}'")
+        jobs.append(job)
+    return jobs
+
+
+def chain_keys(job):
+    """Return the (symbol, expiration, option type) chains a job needs."""
+    return [(symbol, expiration, job['option_type'])
+            for symbol in job['symbols'] for expiration in job['expirations']]
+
+
+def job_options(job, cache, expiration, spot_prices=None):
+    """Return the raw cached options of a job for one expiration.
+
+    With spot_prices, the missing IV, greeks and PoP are derived first.
+    """
+    options = []
+    for symbol in job['symbols']:
+        options.extend(cache.get(symbol, expiration, job['option_type']))
+    if spot_prices is not None:
+        from iv_solver import fill_missing_fields
+
+        options = fill_missing_fields(options, spot_prices)
+    return options
+
+
+def job_spot_prices(job):
+    """Return the spot prices needed to derive missing values, or None when the job does not fill them."""
+    return fetch_spot_prices(job['symbols']) if job['fill_iv'] else None
+
+
+def job_filters(job):
+    """Return the prefilter() arguments of a job: its PoP band and liquidity limits."""
+    filters = build_filters(job['symbols'], job['min_volume'], job['min_open_interest'],
+                            job['max_bid_ask_width'], job['max_strike_distance'])
+    filters.update(typeProfit=job['type_profit'], profitFloor=job['pop_floor'], profitCeiling=job['pop_ceiling'])
+    return filters
+
+
+def build_job_spreads(job, cache):
+    """Return {expiration: spreads DataFrame} for the expirations of a job that have spreads."""
+    results = {}
+    filters = job_filters(job)
+    spot_prices = job_spot_prices(job)
+    for expiration in job['expirations']:
+        df = spread_scan.cleanOptions(job_options(job, cache, expiration, spot_prices), filters)
+        if df.empty:
+            continue
+
+        df = df.sort_values('strike', ascending=False)
+        spreads = spread_scan.createSpreads(df, job['widths'])
+        if len(spreads) == 0:
+            continue
+        results[expiration] = spread_scan.buildSpreadsFrame(spreads)
+    return results
+
+
+def build_job_options(job, cache):
+    """Return the cleaned single options of all expirations of a job, or None when there are none."""
+    frames = []
+    filters = job_filters(job)
+    spot_prices = job_spot_prices(job)
+    for expiration in job['expirations']:
+        df = option_scan.cleanOptions(job_options(job, cache, expiration, spot_prices), filters)
+        if not df.empty:
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def run_spreads_job(job, cache, output_dir, output_format='parquet', scan_date=None, run_id=None):
+    """Build the credit spreads of a job and write them per expiration."""
+    written = []
+    dataset = spread_scan.spreadsDataset(job['option_type'])
+    for expiration, spreads_df in build_job_spreads(job, cache).items():
+        path = os.path.join(output_dir, spread_scan.spreadsFileName(job['symbols'], expiration, job['option_type']))
+        for written_path in write_results(spreads_df, dataset, output_format, path,
+                                          scan_date=scan_date, run_id=run_id):
+            if written_path not in written:
+                written.append(written_path)
+    return written
+
+
+def run_options_job(job, cache, output_dir, output_format='parquet'):
+    """Write the single options of a job."""
+    df = build_job_options(job, cache)
+    if df is None:
+        return []
+
+    file_type = job['option_type']
+    written = []
+    if output_format in ('parquet', 'both'):
+        written.append(write_dataset(df, f'{file_type}_option_data'))
+    if output_format not in ('csv', 'both'):
+        return written
+
+    names = None
+    if len(job['expirations']) > 1:
+        # Keep the per-symbol files of different expirations apart
+        names = df['symbol'] + '_' + df['exp date'].str.replace('-', '_')
+    return written + option_scan.writeSymbolFiles(df, file_type, output_dir, names)
+
+
+def run_jobs(jobs, cache, output_dir, report=None, output_format='parquet', snapshot=False):
+    """Prefetch every chain needed by the jobs once, then run the jobs. Returns {job name: paths}."""
+    os.makedirs(output_dir, exist_ok=True)
+    keys = [key for job in jobs for key in chain_keys(job)]
+
+    if report:
+        with report.stage('fetch', hot=True) as stage:
+            fetched = cache.prefetch(keys)
+            stage['rows'] = len(fetched)
+    else:
+        fetched = cache.prefetch(keys)
+    print(f"Fetched {len(fetched)} distinct chains for {len(keys)} chain requests")
+
+    if snapshot:
+        print(f"Chain snapshots appended to {write_cached_snapshots(cache, keys)}")
+
+    results = {}
+    for job in jobs:
+        runner = run_spreads_job if job['kind'] == 'spreads' else run_options_job
+        if report:
+            with report.stage(job['name'], hot=True) as stage:
+                results[job['name']] = runner(job, cache, output_dir, output_format)
+                stage['rows'] = len(results[job['name']])
+        else:
+            results[job['name']] = runner(job, cache, output_dir, output_format)
+        print(f"{job['name']}: written to {', '.join(results[job['name']]) or 'nothing'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many option scans in one process')
+    parser.add_argument('config', help='JSON file with the scan jobs')
+    parser.add_argument('--format', choices=['parquet', 'csv', 'both'], default='parquet',
+                        help='append to the Parquet datasets, write CSV files, or both')
+    parser.add_argument('--output-dir', default='.', help='directory for the CSV files')
+    parser.add_argument('--profile', action='store_true', help='capture a cProfile of the scan')
+    parser.add_argument('--snapshot', action='store_true', help='also append the full chains to the chain_snapshots dataset')
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.config)
+    report = RunReport('batch_scan', profile=args.profile)
+
+    with report.stage('login'):
+        spread_scan.try_login()
+
+    run_jobs(jobs, ChainCache(), args.output_dir, report, args.format, args.snapshot)
+    report.write()
+
+
+if __name__ == "__main__":
+    main()
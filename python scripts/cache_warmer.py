@@ -0,0 +1,277 @@
+"""
+Pre-market cache warming and in-session refresh for a watchlist.
+
+The first scan of the day is the slowest because everything is cold: the chain ids, the
+expiration lists, the chains with their market data (chain_cache.ChainCache) and the
+option instrument metadata (instrument_cache.InstrumentCache). CacheWarmer keeps them
+warm for the watchlist in a long running process (rh_daemon.py --watchlist):
+
+- the target expirations of every symbol are its next `weeklies` listed expirations
+  and its next `monthlies` monthly ones (the third Friday, or the Thursday before it).
+  The expiration lists come from the option chain of the symbol and are kept for the
+  day in ../output/cache/expirations.json
+- before the open (PREMARKET_START to the open, US/Eastern, on weekdays) every chain of
+  the watchlist is fetched once, and the listed instruments are stored in the instrument
+  cache, so order and position joins do not fetch them either
+- during the session the chains are refreshed on a staleness policy: a chain that was
+  queried recently is fetched again shortly before it expires from the ChainCache (like
+  rh_daemon's watched chains), a chain nobody asks for may get COLD_AGE old. The query
+  count of a chain decays with a half life of QUERY_HALF_LIFE, and the due chains are
+  refreshed in the order of their query count
+- each round spends at most a budget of API requests (the HTTP requests of the round
+  itself, counted by a RequestMeter of the request scheduler, which also keeps its rate
+  limit; the requests of concurrent scans do not count): the chains are fetched in groups, in priority order,
+  each group as large as the rest of the budget allows at the cost per chain seen so
+  far; the chains that do not fit wait for the next round
+
+Usage:
+    python rh_daemon.py --watchlist AMD,META,NVDA           # warm and refresh in the daemon
+    python cache_warmer.py watchlist.txt [--budget 400]    # one warm round, to warm the disk caches
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import date, datetime
+
+from instrument_cache import InstrumentCache
+from option_market_data import chain_id
+from request_scheduler import RequestMeter, get_scheduler
+
+EXPIRATIONS_PATH = '../output/cache/expirations.json'
+MARKET_TIMEZONE = 'America/New_York'
+PREMARKET_START = (7, 0)
+MARKET_OPEN = (9, 30)
+MARKET_CLOSE = (16, 0)
+WARM_BUDGET = 600
+REFRESH_BUDGET = 60
+QUERY_HALF_LIFE = 30 * 60
+COLD_AGE = 30 * 60
+HOT_QUERIES = 0.5  # one query within the last half life
+
+
+def market_phase(now=None):
+    """'premarket', 'open' or 'closed' at the epoch time now (US/Eastern, weekdays)."""
+    from zoneinfo import ZoneInfo
+
+    local = datetime.fromtimestamp(time.time() if now is None else now, ZoneInfo(MARKET_TIMEZONE))
+    if local.weekday() >= 5:
+        return 'closed'
+    minutes = local.hour * 60 + local.minute
+    if PREMARKET_START[0] * 60 + PREMARKET_START[1] <= minutes < MARKET_OPEN[0] * 60 + MARKET_OPEN[1]:
+        return 'premarket'
+    if MARKET_OPEN[0] * 60 + MARKET_OPEN[1] <= minutes < MARKET_CLOSE[0] * 60 + MARKET_CLOSE[1]:
+        return 'open'
+    return 'closed'
+
+
+def is_monthly(expiration):
+    """Whether an expiration is a monthly one: the third Friday, or the Thursday before it on holidays."""
+    day = date.fromisoformat(str(expiration)[:10])
+    third_friday = 15 + (4 - date(day.year, day.month, 15).weekday()) % 7
+    return day.day == third_friday or (day.weekday() == 3 and day.day == third_friday - 1)
+
+
+def target_expirations(expirations, today=None, weeklies=2, monthlies=1):
+    """The next `weeklies` expirations and the next `monthlies` monthly expirations, sorted."""
+    today = str(today or date.today())
+    upcoming = sorted(expiration for expiration in expirations if expiration >= today)
+    monthly = [expiration for expiration in upcoming if is_monthly(expiration)]
+    return sorted(set(upcoming[:weeklies]) | set(monthly[:monthlies]))
+
+
+def _fetch_expirations(symbol):
+    from robin_stocks.robinhood.helper import request_get
+
+    chain = chain_id(symbol)
+    if not chain:
+        return []
+    data = request_get(f'https://api.robinhood.com/options/chains/{chain}/') or {}
+    return data.get('expiration_dates') or []
+
+
+class CacheWarmer:
+    """Warms the chain, expiration and instrument caches of a watchlist, within a request budget per round."""
+
+    def __init__(self, cache, symbols, option_types=('put',), weeklies=2, monthlies=1,
+                 instrument_cache=None, expirations_path=EXPIRATIONS_PATH):
+        self.cache = cache
+        self.symbols = [symbol.strip().upper() for symbol in symbols if symbol.strip()]
+        self.option_types = list(option_types)
+        self.weeklies = weeklies
+        self.monthlies = monthlies
+        self.instrument_cache = instrument_cache or InstrumentCache()
+        self.expirations_path = expirations_path
+        self.expirations = {}  # symbol -> {'date', 'expirations'}
+        self.queries = {}      # chain key -> (decayed query count, time of the last query)
+        self.lock = threading.Lock()
+        self.warmed_on = None
+        self.counters = {'rounds': 0, 'chains': 0, 'requests': 0, 'deferred': 0}
+        self._load_expirations()
+
+    # Expirations
+
+    def _load_expirations(self):
+        if os.path.exists(self.expirations_path):
+            with open(self.expirations_path) as f:
+                self.expirations = json.load(f)
+
+    def _save_expirations(self):
+        os.makedirs(os.path.dirname(self.expirations_path), exist_ok=True)
+        tmp_path = self.expirations_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.expirations, f)
+        os.replace(tmp_path, self.expirations_path)
+
+    def refresh_expirations(self, today=None):
+        """Fetch the expiration lists that were not fetched today. Returns the symbols fetched."""
+        today = str(today or date.today())
+        missing = [symbol for symbol in self.symbols if self.expirations.get(symbol, {}).get('date') != today]
+        if missing:
+            for symbol, expirations in zip(missing, get_scheduler().map(_fetch_expirations, missing)):
+                self.expirations[symbol] = {'date': today, 'expirations': sorted(expirations or [])}
+            self._save_expirations()
+        return missing
+
+    def target_keys(self, today=None):
+        """The (symbol, expiration, option type) chain keys of the watchlist."""
+        keys = []
+        for symbol in self.symbols:
+            listed = self.expirations.get(symbol, {}).get('expirations', [])
+            for expiration in target_expirations(listed, today, self.weeklies, self.monthlies):
+                keys.extend(self.cache.key(symbol, expiration, option_type) for option_type in self.option_types)
+        return keys
+
+    # Query counts
+
+    def record_query(self, keys, now=None):
+        """Count a query of the chain keys (called by the scans)."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for key in keys:
+                key = self.cache.key(*key)
+                self.queries[key] = (self.score(key, now) + 1.0, now)
+
+    def score(self, key, now=None):
+        """The decayed query count of a chain key."""
+        now = time.time() if now is None else now
+        count, last = self.queries.get(key, (0.0, now))
+        return count * math.exp(-math.log(2) * (now - last) / QUERY_HALF_LIFE)
+
+    def max_age(self, key, now=None, interval=0):
+        """How old the chain of a key may get before it is refreshed."""
+        if self.score(key, now) >= HOT_QUERIES:
+            return max(self.cache.ttl - interval, 0)
+        return max(COLD_AGE, self.cache.ttl)
+
+    # Rounds
+
+    def _fetch(self, keys, budget):
+        """Fetch the keys in priority order, in groups, until the request budget is used up."""
+        scheduler = get_scheduler()
+        fetched = []
+        # Only the requests of this round, with the pages and batches of every chain
+        with RequestMeter() as meter:
+            while len(fetched) < len(keys):
+                spent = meter.requests
+                # Requests per chain seen in this and the earlier rounds; without any, one chain is the probe
+                with self.lock:
+                    chains, requests = self.counters['chains'] + len(fetched), self.counters['requests'] + spent
+                group = min(scheduler.max_concurrency, int((budget - spent) // max(requests / chains, 1))) if chains else 1
+                if group < 1:
+                    break
+                batch = keys[len(fetched):len(fetched) + group]
+                self.cache.refresh(batch)
+                # The listed instruments come with the chains, store them for the order and position joins
+                with self.cache.lock:
+                    chains = [self.cache.chains.get(key, []) for key in batch]
+                self.instrument_cache.add(option for options in chains for option in options)
+                fetched.extend(batch)
+        spent = meter.requests
+        with self.lock:
+            self.counters['rounds'] += 1
+            self.counters['chains'] += len(fetched)
+            self.counters['requests'] += spent
+            self.counters['deferred'] += len(keys) - len(fetched)
+        return fetched, spent
+
+    def _by_priority(self, keys, now):
+        # The most queried chains first, the oldest first among equals
+        return sorted(keys, key=lambda key: (-self.score(key, now), -(self.cache.age(key, now) or math.inf)))
+
+    def warm(self, budget=WARM_BUDGET, today=None, now=None):
+        """Fetch the expiration lists and every watchlist chain that is not fresh. Returns (fetched keys, requests)."""
+        now = time.time() if now is None else now
+        self.refresh_expirations(today)
+        keys = [key for key in self.target_keys(today) if not self.cache.is_fresh(key, now)]
+        fetched, spent = self._fetch(self._by_priority(keys, now), budget)
+        if len(fetched) == len(keys):
+            self.warmed_on = str(today or date.today())
+        return fetched, spent
+
+    def due_keys(self, now=None, interval=0, today=None):
+        """The watchlist and queried chains that are older than their max age."""
+        now = time.time() if now is None else now
+        with self.lock:
+            # Forget the chains whose query count decayed away
+            self.queries = {key: value for key, value in self.queries.items() if self.score(key, now) >= 0.01}
+            queried = list(self.queries)
+        keys = list(dict.fromkeys(self.target_keys(today) + queried))
+        due = []
+        for key in keys:
+            age = self.cache.age(key, now)
+            if age is None or age >= self.max_age(key, now, interval):
+                due.append(key)
+        return self._by_priority(due, now)
+
+    def refresh(self, budget=REFRESH_BUDGET, now=None, interval=0, today=None):
+        """Refresh the due chains, the most queried first. Returns (fetched keys, requests)."""
+        self.refresh_expirations(today)
+        return self._fetch(self.due_keys(now, interval, today), budget)
+
+    def run_once(self, now=None, interval=0, warm_budget=WARM_BUDGET, refresh_budget=REFRESH_BUDGET):
+        """One scheduler round: warm once before the open, refresh during the session. Returns the phase."""
+        now = time.time() if now is None else now
+        phase = market_phase(now)
+        if phase == 'premarket' and self.warmed_on != str(date.today()):
+            self.warm(warm_budget, now=now)
+        elif phase == 'open':
+            self.refresh(refresh_budget, now, interval)
+        return phase
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, symbols=len(self.symbols), queried_chains=len(self.queries),
+                        warmed_on=self.warmed_on)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm the chain, expiration and instrument caches of a watchlist')
+    parser.add_argument('symbols', help='comma separated symbols, or a file with one symbol per line')
+    parser.add_argument('--types', default='put', help='option types to warm, separated by commas')
+    parser.add_argument('--weeklies', type=int, default=2, help='number of upcoming expirations')
+    parser.add_argument('--monthlies', type=int, default=1, help='number of upcoming monthly expirations')
+    parser.add_argument('--budget', type=int, default=WARM_BUDGET, help='maximum API requests of the round')
+    args = parser.parse_args()
+
+    from api_replay import install_from_env
+    from chain_cache import ChainCache
+    from get_high_prob_bull_put_spreads import try_login
+    from sharded_scan import read_symbols
+
+    install_from_env()
+    try_login()
+
+    warmer = CacheWarmer(ChainCache(), read_symbols(args.symbols), args.types.split(','), args.weeklies, args.monthlies)
+    started = time.perf_counter()
+    fetched, spent = warmer.warm(args.budget)
+    print(f"Warmed {len(fetched)} chains of {len(warmer.symbols)} symbols with {spent} requests "
+          f"in {time.perf_counter() - started:.1f}s ({warmer.stats()['deferred']} deferred by the budget)")
+    print(f"Instrument cache: {len(warmer.instrument_cache.instruments)} instruments")
+
+
+if __name__ == "__main__":
+    main()
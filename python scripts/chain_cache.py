@@ -0,0 +1,116 @@
+"""
+Shared option chain cache.
+
+Holds the full option chain (instruments merged with their market data) per
+(symbol, expiration date, option type) so that several scans in one process, or
+repeated queries in a long-running process, fetch each chain only once.
+
+The market data of every tradable option is fetched before the PoP band is applied
+(option_market_data.fetch_options), so fetching the full band [0, 1] costs the same
+number of requests as a narrow band. The cache therefore always stores the full chain,
+including the options without a PoP (which iv_solver can derive), and each scan applies
+its own band locally (chain_filters.prefilter).
+
+A fetcher schedules its own requests (fetch_options batches them through the request
+scheduler), so the chains of a prefetch are fetched on plain threads.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chain_filters import prefilter
+from option_market_data import fetch_options
+from request_scheduler import get_scheduler, in_scheduled_call, submit
+
+DEFAULT_TTL_SECONDS = 5 * 60
+
+
+def fetch_chain(symbol, expirationDate, optionType):
+    """Fetch every option of one chain with its market data."""
+    return fetch_options(
+        symbol,
+        expirationDate=expirationDate,
+        strikePrice=None,
+        optionType=optionType,
+        typeProfit='chance_of_profit_short',
+        profitFloor=0.0,
+        profitCeiling=1.0,
+        info=None,
+        keep_missing=True,
+    )
+
+
+def filter_by_profitability(options, typeProfit='chance_of_profit_short', profitFloor=0.0, profitCeiling=1.0):
+    """Keep the options whose typeProfit value is inside [profitFloor, profitCeiling]."""
+    return list(prefilter(options, typeProfit=typeProfit, profitFloor=profitFloor, profitCeiling=profitCeiling))
+
+
+class ChainCache:
+    """Thread-safe cache of full option chains keyed by (symbol, expiration date, option type)."""
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, fetcher=fetch_chain):
+        self.ttl = ttl
+        self.fetcher = fetcher
+        self.chains = {}      # key -> list of options
+        self.fetched_at = {}  # key -> epoch seconds
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def key(symbol, expirationDate, optionType):
+        return (symbol.strip().upper(), expirationDate, optionType)
+
+    def is_fresh(self, key, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            return key in self.chains and now - self.fetched_at[key] <= self.ttl
+
+    def age(self, key, now=None):
+        """Return the age of a cached chain in seconds, or None when it is not cached."""
+        now = time.time() if now is None else now
+        with self.lock:
+            return now - self.fetched_at[key] if key in self.fetched_at else None
+
+    def _fetch(self, key):
+        options = self.fetcher(*key) or []
+        with self.lock:
+            self.chains[key] = options
+            self.fetched_at[key] = time.time()
+        return options
+
+    def prefetch(self, keys):
+        """Fetch the distinct stale or missing chains among keys concurrently. Returns the fetched keys."""
+        missing = []
+        for key in keys:
+            key = self.key(*key)
+            if key not in missing and not self.is_fresh(key):
+                missing.append(key)
+        return self.refresh(missing)
+
+    def refresh(self, keys):
+        """Fetch the chains of the keys concurrently, fresh or not. Returns the fetched keys."""
+        keys = list(dict.fromkeys(self.key(*key) for key in keys))
+        if in_scheduled_call():
+            for key in keys:
+                self._fetch(key)
+        else:
+            with ThreadPoolExecutor(max_workers=get_scheduler().max_concurrency) as executor:
+                for future in [submit(executor, self._fetch, key) for key in keys]:
+                    future.result()
+        return keys
+
+    def get(self, symbol, expirationDate, optionType):
+        """Return the chain for the key, fetching it when it is missing or stale."""
+        key = self.key(symbol, expirationDate, optionType)
+        if self.is_fresh(key):
+            with self.lock:
+                self.counters['hits'] += 1
+                return self.chains[key]
+        with self.lock:
+            self.counters['misses'] += 1
+        return self._fetch(key)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, chains=len(self.chains))
@@ -0,0 +1,141 @@
+"""
+Pre-filtering of raw option chain payloads.
+
+The scanners used to build a DataFrame from the full chain payload (every field of every
+contract) and only then drop the illiquid rows. The predicates here are applied to the raw
+records as they stream in, so rejected contracts are never materialized:
+- minimum volume and open interest
+- maximum bid/ask width
+- PoP band (chance_of_profit_short by default)
+- maximum strike distance from spot, as a fraction of the spot price
+
+Only the survivors are turned into columns, and only the fields a scanner needs
+(see select_fields), so the DataFrame is built once from small column lists.
+
+Usage:
+    filters = {'min_volume': 10, 'min_open_interest': 100, 'max_bid_ask_width': 0.25}
+    df = pd.DataFrame(select_fields(prefilter(options, **filters), ['symbol', 'strike_price']))
+"""
+
+from request_scheduler import get_scheduler
+
+# The scanners only kept the contracts that traded, so that is the default
+DEFAULT_FILTERS = {'min_volume': 1}
+# Flags of the values derived by iv_solver.fill_missing_fields, carried into the scanner output
+DERIVED_FLAGS = ['iv_derived', 'greeks_derived', 'pop_derived']
+
+
+def _number(option, field):
+    """Return option[field] as a float, or None when it is missing or not a number."""
+    try:
+        return float(option[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def fetch_spot_prices(symbols):
+    """Return {symbol: latest price} for the symbols, skipping the ones without a price."""
+    import robin_stocks.robinhood as r
+
+    symbols = sorted({symbol.strip().upper() for symbol in symbols})
+    prices = get_scheduler().call(r.stocks.get_latest_price, symbols) or []
+    spot = {}
+    for symbol, price in zip(symbols, prices):
+        try:
+            spot[symbol] = float(price)
+        except (TypeError, ValueError):
+            continue
+    return spot
+
+
+def parse_spot_arguments(values):
+    """Parse SYMBOL=PRICE arguments into {symbol: price}."""
+    spot = {}
+    for value in values or []:
+        symbol, price = value.split('=')
+        spot[symbol.strip().upper()] = float(price)
+    return spot
+
+
+def prefilter(options, min_volume=0, min_open_interest=0, max_bid_ask_width=None,
+              typeProfit='chance_of_profit_short', profitFloor=None, profitCeiling=None,
+              max_strike_distance=None, spot_prices=None):
+    """Yield the raw options that pass every predicate.
+
+    Cheap checks run first; a contract is dropped at the first predicate it fails.
+    max_strike_distance needs spot_prices ({symbol: price}); contracts of symbols without
+    a spot price are kept.
+    """
+    check_band = profitFloor is not None or profitCeiling is not None
+    floor = 0.0 if profitFloor is None else profitFloor
+    ceiling = 1.0 if profitCeiling is None else profitCeiling
+
+    for option in options:
+        if not option:
+            continue
+
+        if min_volume and (_number(option, 'volume') or 0) < min_volume:
+            continue
+        if min_open_interest and (_number(option, 'open_interest') or 0) < min_open_interest:
+            continue
+
+        if max_bid_ask_width is not None:
+            bid, ask = _number(option, 'bid_price'), _number(option, 'ask_price')
+            if bid is None or ask is None or ask - bid > max_bid_ask_width:
+                continue
+
+        if check_band:
+            value = _number(option, typeProfit)
+            if value is None or not floor <= value <= ceiling:
+                continue
+
+        if max_strike_distance is not None and spot_prices:
+            spot = spot_prices.get(option.get('symbol') or option.get('chain_symbol'))
+            strike = _number(option, 'strike_price')
+            if spot and strike is not None and abs(strike - spot) / spot > max_strike_distance:
+                continue
+
+        yield option
+
+
+def select_fields(options, fields):
+    """Return {field: [values]} with only the given fields of the options, for pd.DataFrame()."""
+    columns = {field: [] for field in fields}
+    for option in options:
+        for field in fields:
+            columns[field].append(option[field])
+    return columns
+
+
+def add_filter_arguments(parser):
+    """Add the pre-filter options to an argparse parser."""
+    parser.add_argument('--min-volume', type=float, default=DEFAULT_FILTERS['min_volume'],
+                        help='minimum contract volume (default: %(default)s)')
+    parser.add_argument('--min-open-interest', type=float, default=0, help='minimum open interest')
+    parser.add_argument('--max-bid-ask', type=float, default=None, help='maximum bid/ask width in dollars')
+    parser.add_argument('--max-strike-distance', type=float, default=None,
+                        help='maximum distance of the strike from spot, as a fraction of spot (e.g. 0.15)')
+
+
+def build_filters(symbols, min_volume=DEFAULT_FILTERS['min_volume'], min_open_interest=0,
+                  max_bid_ask_width=None, max_strike_distance=None):
+    """Return the prefilter() keyword arguments, fetching spot prices when the strike distance is limited."""
+    filters = {
+        'min_volume': min_volume,
+        'min_open_interest': min_open_interest,
+        'max_bid_ask_width': max_bid_ask_width,
+    }
+    if max_strike_distance is not None:
+        filters['max_strike_distance'] = max_strike_distance
+        filters['spot_prices'] = fetch_spot_prices(symbols)
+    return filters
+
+
+def filter_settings(args):
+    """Return the build_filters() keyword arguments for the options added by add_filter_arguments()."""
+    return {
+        'min_volume': args.min_volume,
+        'min_open_interest': args.min_open_interest,
+        'max_bid_ask_width': args.max_bid_ask,
+        'max_strike_distance': args.max_strike_distance,
+    }
@@ -0,0 +1,79 @@
+"""
+Daily option chain snapshots.
+
+A snapshot is the full chain of a symbol and expiration on a scan date: every contract
+with its quotes, PoP, greeks and the underlying price at the time of the scan. Snapshots
+are appended to the partitioned ../output/datasets/chain_snapshots Parquet dataset
+(see scan_output.py), and are the history that backtest.py replays.
+
+Snapshots are recorded by batch_scan.py with --snapshot, from the chains it already
+fetched, so recording them costs one extra request for the spot prices.
+
+Usage:
+    from chain_snapshots import read_snapshots
+    df = read_snapshots(symbols=['AMD'], start='2024-01-01', end='2024-03-31')
+"""
+
+import pandas as pd
+
+from chain_filters import fetch_spot_prices, select_fields
+from scan_output import read_dataset, write_dataset
+
+SNAPSHOT_DATASET = 'chain_snapshots'
+
+# Raw payload fields and the snapshot column names
+SNAPSHOT_FIELDS = {
+    'symbol': 'symbol',
+    'expiration_date': 'exp date',
+    'strike_price': 'strike',
+    'type': 'type',
+    'bid_price': 'bid',
+    'ask_price': 'ask',
+    'adjusted_mark_price': 'mark',
+    'volume': 'volume',
+    'open_interest': 'open interest',
+    'chance_of_profit_long': 'PoP buy',
+    'chance_of_profit_short': 'PoP sell',
+    'implied_volatility': 'impl vol',
+    'delta': 'delta',
+}
+# The columns that identify a contract within a scan date
+CONTRACT_KEY = ['symbol', 'exp date', 'strike', 'type']
+NUMERIC_COLUMNS = ['strike', 'bid', 'ask', 'mark', 'volume', 'open interest', 'PoP buy', 'PoP sell', 'impl vol', 'delta']
+
+
+def snapshot_frame(options, spot_prices=None):
+    """Convert raw chain options to snapshot rows, with the underlying price of each symbol."""
+    # Only the snapshot fields of the options are materialized
+    rows = ({field: option.get(field) for field in SNAPSHOT_FIELDS} | {'symbol': option.get('symbol') or option.get('chain_symbol')}
+            for option in options if option)
+    df = pd.DataFrame(select_fields(rows, SNAPSHOT_FIELDS)).rename(columns=SNAPSHOT_FIELDS)
+    df[NUMERIC_COLUMNS] = df[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    df['underlying'] = df['symbol'].map(spot_prices or {}).astype(float)
+    return df
+
+
+def write_snapshots(options, spot_prices=None, scan_date=None):
+    """Append the chain options to the snapshot dataset. Returns the dataset path."""
+    return write_dataset(snapshot_frame(options, spot_prices), SNAPSHOT_DATASET, scan_date)
+
+
+def write_cached_snapshots(cache, keys, scan_date=None):
+    """Append the cached chains of the (symbol, expiration, option type) keys as one snapshot."""
+    keys = list(dict.fromkeys(cache.key(*key) for key in keys))
+    options = [option for key in keys for option in cache.get(*key)]
+    return write_snapshots(options, fetch_spot_prices([key[0] for key in keys]), scan_date)
+
+
+def read_snapshots(symbols=None, start=None, end=None, columns=None, latest=False):
+    """Read the snapshots of the symbols between the start and end scan dates (inclusive).
+
+    A scan date can have several snapshots (batch_scan.py --snapshot run more than once).
+    With latest, only the last snapshot of every contract of a scan date is kept.
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ['scan_date'] + (CONTRACT_KEY if latest else [])))
+    df = read_dataset(SNAPSHOT_DATASET, columns=columns, symbols=symbols, write_order=latest, start=start, end=end)
+    if latest and not df.empty:
+        df = df.drop_duplicates(['scan_date'] + CONTRACT_KEY, keep='last')
+    return df.reset_index(drop=True)
@@ -0,0 +1,311 @@
+"""
+Delta export of the completed stock, option and crypto orders.
+
+r.export_completed_*_orders downloads the whole order history and rewrites
+../output/{stock,options,crypto}_output.csv on every run. This export only asks for the
+orders updated since the last export (the watermark, the largest 'updated_at' seen) and
+appends their rows as a new segment:
+
+    ../output/exports/<kind>/segment_<UTC time>.csv
+
+- the rows have the columns of the robin_stocks exports, plus 'order_id' and
+  'updated_at'; the instruments of the option legs come from the instrument cache
+  (instrument_cache.py) instead of one request per leg
+- the watermarks are kept in ../output/exports/watermarks.json, with the ids of the
+  orders updated at the watermark itself ('ids'): the next export asks for the orders
+  updated at or after the watermark and drops those, so an unchanged order is never
+  exported twice and a run without changes writes nothing. An order that changes
+  after an export (a partial fill that completes) is exported again in a later segment,
+  and the latest rows of an order id win
+- compaction merges the segments into the full export file (../output/stock_output.csv,
+  ...), which the existing scripts and notebooks keep reading, and deletes them. It runs
+  when a kind has more than compact_after segments, or with --compact
+- the first export of a kind (no watermark) is a full export, written as the full file
+- the orders are paged through here and a page that cannot be loaded fails the export of
+  that kind: no file is written and the watermark stays where it was
+
+Loaders can read only what is new: read_export(kind, new_only=True) is the last
+segment, new_segments(kind, after) the segments written after a given segment.
+
+Usage:
+    python delta_export.py [--kinds stock,option,crypto] [--compact] [--full]
+"""
+
+import argparse
+import glob
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from request_scheduler import get_scheduler
+
+EXPORT_ROOT = '../output/exports'
+WATERMARKS_PATH = os.path.join(EXPORT_ROOT, 'watermarks.json')
+FULL_EXPORTS = {
+    'stock': '../output/stock_output.csv',
+    'option': '../output/options_output.csv',
+    'crypto': '../output/crypto_output.csv',
+}
+COMPACT_AFTER = 7
+ORDER_COLUMNS = ['symbol', 'date', 'order_type', 'side', 'fees', 'quantity', 'average_price']
+OPTION_COLUMNS = ['chain_symbol', 'expiration_date', 'strike_price', 'option_type', 'side', 'order_created_at',
+                  'direction', 'order_quantity', 'order_type', 'opening_strategy', 'closing_strategy', 'price',
+                  'processed_quantity']
+EXPORT_COLUMNS = {
+    'stock': ORDER_COLUMNS + ['order_id', 'updated_at'],
+    'option': OPTION_COLUMNS + ['order_id', 'updated_at'],
+    'crypto': ORDER_COLUMNS + ['order_id', 'updated_at'],
+}
+
+
+def load_watermarks(path=WATERMARKS_PATH):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_watermarks(watermarks, path=WATERMARKS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class IncompleteFetchError(Exception):
+    """Raised when a page of a listing could not be loaded."""
+
+
+def fetch_pages(url, payload=None):
+    """All the results of a paginated listing. Raises IncompleteFetchError when any page fails.
+
+    robin_stocks' request_get(..., 'pagination') returns the pages it loaded when a later
+    page fails, which would look like a complete listing here.
+    """
+    from robin_stocks.robinhood.helper import request_get
+
+    results = []
+    page = 1
+    while url:
+        data = request_get(url, 'regular', payload)
+        if not isinstance(data, dict) or not isinstance(data.get('results'), list):
+            raise IncompleteFetchError(f"page {page} of {url} could not be loaded ({len(results)} results loaded)")
+        results.extend(data['results'])
+        url, payload, page = data.get('next'), None, page + 1
+    return results
+
+
+def fetch_orders(kind, since=None, seen=()):
+    """Fetch the orders of a kind updated at or after since (all orders without since).
+
+    The orders updated exactly at since whose ids are in seen were exported already and
+    are left out.
+
+    Raises IncompleteFetchError when a page could not be loaded, so that nothing is
+    exported from a partial listing.
+    """
+    from robin_stocks.robinhood.urls import crypto_orders_url, option_orders_url, orders_url
+
+    urls = {'stock': orders_url, 'option': option_orders_url, 'crypto': crypto_orders_url}
+    payload = {'updated_at[gte]': since} if since else None
+    orders = get_scheduler().call(fetch_pages, urls[kind](), payload)
+    # The filter is applied again here, in case an endpoint ignores it
+    return [order for order in orders if order and (
+        not since or order.get('updated_at', '') > since
+        or (order.get('updated_at') == since and order.get('id') not in seen))]
+
+
+def _lookup(function, keys):
+    """{key: function(key)} for the distinct keys, through the request scheduler."""
+    keys = sorted({key for key in keys if key})
+    return dict(zip(keys, get_scheduler().map(function, keys)))
+
+
+def stock_rows(orders):
+    """Export rows of stock orders: filled orders, and the executions of cancelled partial fills."""
+    import robin_stocks.robinhood as r
+
+    symbols = _lookup(r.stocks.get_symbol_by_url, [order.get('instrument') for order in orders])
+    rows = []
+    for order in orders:
+        symbol = symbols.get(order.get('instrument'))
+        if order['state'] == 'cancelled' and order.get('executions'):
+            for partial in order['executions']:
+                rows.append([symbol, partial['timestamp'], order['type'], order['side'], order['fees'],
+                             partial['quantity'], partial['price'], order['id'], order['updated_at']])
+        if order['state'] == 'filled' and order.get('cancel') is None:
+            rows.append([symbol, order['last_transaction_at'], order['type'], order['side'], order['fees'],
+                         order['quantity'], order['average_price'], order['id'], order['updated_at']])
+    return pd.DataFrame(rows, columns=EXPORT_COLUMNS['stock'])
+
+
+def crypto_rows(orders):
+    """Export rows of the filled crypto orders."""
+    import robin_stocks.robinhood as r
+
+    symbols = _lookup(lambda pair_id: r.crypto.get_crypto_quote_from_id(pair_id, 'symbol'),
+                      [order.get('currency_pair_id') for order in orders])
+    rows = [[symbols.get(order['currency_pair_id']), order['last_transaction_at'], order['type'], order['side'],
+             order.get('fees', 0.0), order['quantity'], order['average_price'], order['id'], order['updated_at']]
+            for order in orders if order['state'] == 'filled' and order.get('cancel_url') is None]
+    return pd.DataFrame(rows, columns=EXPORT_COLUMNS['crypto'])
+
+
+def option_rows(orders):
+    """Export rows of the filled option orders, one per leg."""
+    from instrument_cache import InstrumentCache, explode_legs
+
+    filled = pd.DataFrame([order for order in orders if order['state'] == 'filled'])
+    if filled.empty:
+        return pd.DataFrame(columns=EXPORT_COLUMNS['option'])
+    legs = explode_legs(filled)
+    legs = InstrumentCache().join(legs, 'option', fields=['expiration_date', 'strike_price', 'type'], prefix='instrument_')
+    rows = pd.DataFrame({
+        'chain_symbol': legs['chain_symbol'],
+        'expiration_date': legs['instrument_expiration_date'],
+        'strike_price': legs['instrument_strike_price'],
+        'option_type': legs['instrument_type'],
+        'side': legs['leg_side'] if 'leg_side' in legs else legs['side'],
+        'order_created_at': legs['created_at'],
+        'direction': legs['direction'],
+        'order_quantity': legs['quantity'],
+        'order_type': legs['type'],
+        'opening_strategy': legs['opening_strategy'],
+        'closing_strategy': legs['closing_strategy'],
+        'price': legs['price'],
+        'processed_quantity': legs['processed_quantity'],
+        'order_id': legs['id'],
+        'updated_at': legs['updated_at'],
+    })
+    return rows[EXPORT_COLUMNS['option']]
+
+
+ROW_BUILDERS = {'stock': stock_rows, 'option': option_rows, 'crypto': crypto_rows}
+
+
+def segment_dir(kind, root=EXPORT_ROOT):
+    return os.path.join(root, kind)
+
+
+def segments(kind, root=EXPORT_ROOT):
+    """The segment files of a kind, oldest first."""
+    return sorted(glob.glob(os.path.join(segment_dir(kind, root), 'segment_*.csv')))
+
+
+def new_segments(kind, after=None, root=EXPORT_ROOT):
+    """The segments written after the segment file 'after' (all of them without after)."""
+    return [path for path in segments(kind, root) if after is None or os.path.basename(path) > os.path.basename(after)]
+
+
+def _latest_rows(frames):
+    """Concatenate export frames, oldest first, keeping only the latest rows of every order id."""
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return pd.DataFrame()
+    for position, frame in enumerate(frames):
+        frame['_segment'] = position
+    rows = pd.concat(frames, ignore_index=True)
+    if 'order_id' in rows:
+        newest = rows.groupby('order_id')['_segment'].transform('max')
+        rows = rows[rows['order_id'].isna() | (rows['_segment'] == newest)]
+    return rows.drop(columns=['_segment'])
+
+
+def read_export(kind, new_only=False, root=EXPORT_ROOT):
+    """The export rows of a kind: the full file plus the segments, or only the last segment."""
+    paths = segments(kind, root)
+    if new_only:
+        return pd.read_csv(paths[-1]) if paths else pd.DataFrame(columns=EXPORT_COLUMNS[kind])
+    full_path = FULL_EXPORTS[kind]
+    frames = [pd.read_csv(full_path)] if os.path.exists(full_path) else []
+    return _latest_rows(frames + [pd.read_csv(path) for path in paths])
+
+
+def _write_csv(df, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    df.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def compact(kind, root=EXPORT_ROOT):
+    """Merge the segments of a kind into its full export file and delete them."""
+    paths = segments(kind, root)
+    if not paths:
+        return 0
+    _write_csv(read_export(kind, root=root), FULL_EXPORTS[kind])
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+
+def export_delta(kind, watermarks, full=False, compact_after=COMPACT_AFTER, root=EXPORT_ROOT):
+    """Export the orders of a kind updated since its watermark. Returns (rows written, path).
+
+    The export files and the watermark are only written after a complete fetch.
+    """
+    since = None if full else watermarks.get(kind)
+    seen = set(watermarks.get('ids', {}).get(kind, [])) if since else set()
+    orders = fetch_orders(kind, since, seen)
+    rows = ROW_BUILDERS[kind](orders)
+
+    if since is None:
+        # Full export: it replaces the full file and the segments it covers
+        _write_csv(rows, FULL_EXPORTS[kind])
+        for path in segments(kind, root):
+            os.remove(path)
+        path = FULL_EXPORTS[kind]
+    elif len(rows):
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(segment_dir(kind, root), f'segment_{stamp}.csv')
+        _write_csv(rows, path)
+    else:
+        path = None
+
+    updated = [order['updated_at'] for order in orders if order.get('updated_at')]
+    if updated:
+        watermark = max(updated + ([since] if since else []))
+        # The orders at the new watermark, to leave out of the next export
+        ids = {order['id'] for order in orders if order.get('updated_at') == watermark}
+        if watermark == since:
+            ids |= seen
+        watermarks[kind] = watermark
+        watermarks.setdefault('ids', {})[kind] = sorted(ids)
+    if len(segments(kind, root)) > compact_after:
+        compact(kind, root)
+    return len(rows), path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the orders completed since the last export')
+    parser.add_argument('--kinds', default='stock,option,crypto', help='order kinds to export, separated by commas')
+    parser.add_argument('--compact', action='store_true', help='merge the segments into the full export files')
+    parser.add_argument('--full', action='store_true', help='export the whole history again')
+    parser.add_argument('--compact-after', type=int, default=COMPACT_AFTER, help='segments before an automatic compaction')
+    args = parser.parse_args()
+
+    import robin_stocks.robinhood as r
+    from api_replay import install_from_env
+
+    install_from_env()
+    r.login()
+
+    watermarks = load_watermarks()
+    for kind in args.kinds.split(','):
+        try:
+            count, path = export_delta(kind, watermarks, args.full, args.compact_after)
+        except IncompleteFetchError as error:
+            print(f"{kind}: not exported, the orders could not be fetched completely: {error}")
+            continue
+        save_watermarks(watermarks)
+        print(f"{kind}: {count} rows" + (f" -> {path}" if path else " (nothing new)"))
+        if args.compact:
+            print(f"{kind}: compacted {compact(kind)} segments into {FULL_EXPORTS[kind]}")
+
+
+if __name__ == "__main__":
+    main()
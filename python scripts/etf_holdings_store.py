@@ -0,0 +1,211 @@
+"""
+ETF holdings store.
+
+Loads the constituents of a configured list of ETFs, caches them locally as JSON
+with a refresh TTL, and builds a reverse index from ticker to the ETFs that hold it
+(with the weight of the ticker in each ETF).
+
+robin_stocks has no ETF holdings endpoint (there is no r.account.get_holdings), so the
+constituents come from the holdings file that every ETF issuer publishes, saved as
+../output/etf_holdings/<ETF>.csv: a symbol or ticker column and, optionally, a weight
+column (a fraction, or a percentage when its header says so, e.g. 'Weight (%)' or
+'% of Net Assets', or when the values carry a % sign). An ETF without a holdings file raises
+HoldingsUnavailableError instead of being cached as an ETF that holds nothing.
+
+Once the store is loaded, bulk questions such as "which ETFs hold any of these 300
+tickers" are answered from the in-memory index without any API calls. Only ETFs whose
+cached holdings are older than the TTL are fetched again.
+
+Usage:
+    store = EtfHoldingsStore(['QQQ', 'SPY', 'XLK'])
+    store.refresh()
+    store.etfs_holding('NVDA')             # {'QQQ': 0.08, 'SPY': 0.06, ...}
+    store.etfs_holding_any(['NVDA', 'AMD']) # {'NVDA': {...}, 'AMD': {...}}
+"""
+
+import json
+import os
+import time
+
+DEFAULT_CACHE_PATH = '../output/cache/etf_holdings.json'
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+HOLDINGS_DIR = '../output/etf_holdings'
+SYMBOL_COLUMNS = ['symbol', 'ticker', 'holding ticker']
+WEIGHT_COLUMNS = ['weight', 'weight (%)', '% weight', 'weighting', '% of net assets']
+PERCENT_MARKERS = ['%', 'percent', 'pct']
+
+
+class HoldingsUnavailableError(RuntimeError):
+    """Raised when the holdings of an ETF can not be loaded."""
+
+
+def fetch_etf_holdings(etf, holdings_dir=HOLDINGS_DIR):
+    """Read the holdings of one ETF from its issuer holdings file as a list of {'symbol', 'weight'}."""
+    import pandas as pd
+
+    path = os.path.join(holdings_dir, f'{etf.upper()}.csv')
+    if not os.path.exists(path):
+        raise HoldingsUnavailableError(f"No holdings for {etf}: robin_stocks has no ETF holdings endpoint, "
+                                       f"save the issuer's holdings file of {etf} as {path}")
+    df = pd.read_csv(path)
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    symbol_column = next((columns[name] for name in SYMBOL_COLUMNS if name in columns), None)
+    if symbol_column is None:
+        raise HoldingsUnavailableError(f"{path} has no {' or '.join(SYMBOL_COLUMNS)} column")
+    weight_column = next((columns[name] for name in WEIGHT_COLUMNS if name in columns), None)
+    weights = pd.Series(float('nan'), index=df.index)
+    if weight_column is not None:
+        values = df[weight_column].astype(str).str.strip()
+        weights = pd.to_numeric(values.str.rstrip('%'), errors='coerce')
+        # Decide from the header, not from the largest weight: an equal weight ETF holds
+        # nothing above 1%. A plain 'Weight' column is a percentage when it adds up to about 100.
+        header = str(weight_column).lower()
+        if (any(marker in header for marker in PERCENT_MARKERS) or values.str.endswith('%').any()
+                or weights.sum() > 2):
+            weights = weights / 100
+    return [{'symbol': symbol, 'weight': None if pd.isna(weight) else float(weight)}
+            for symbol, weight in zip(df[symbol_column], weights) if isinstance(symbol, str) and symbol.strip()]
+
+
+def normalize_holdings(holdings):
+    """Convert the holdings payload into a {ticker: weight} dict.
+
+    The payload can be a dict keyed by ticker, a list of dicts with a symbol and a
+    weight, or a plain list of tickers. Missing weights are stored as None.
+    """
+    if not holdings:
+        return {}
+
+    if isinstance(holdings, dict):
+        items = holdings.items()
+        return {
+            ticker.upper(): _to_weight(value.get('weight') if isinstance(value, dict) else value)
+            for ticker, value in items
+        }
+
+    normalized = {}
+    for item in holdings:
+        if isinstance(item, dict):
+            ticker = item.get('symbol') or item.get('ticker')
+            if ticker:
+                normalized[ticker.upper()] = _to_weight(item.get('weight'))
+        elif item:
+            normalized[str(item).upper()] = None
+    return normalized
+
+
+def _to_weight(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EtfHoldingsStore:
+    """Cached ETF constituents with a ticker -> {etf: weight} reverse index."""
+
+    def __init__(self, etfs, cache_path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, fetcher=fetch_etf_holdings):
+        self.etfs = [etf.strip().upper() for etf in etfs]
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.fetcher = fetcher
+        self.holdings = {}    # etf -> {ticker: weight}
+        self.fetched_at = {}  # etf -> epoch seconds
+        self.index = {}       # ticker -> {etf: weight}
+        self.unavailable = {}  # etf -> why its holdings could not be loaded
+        self._load_cache()
+
+    def _read_cache(self):
+        """Return the cache file as {etf: {'fetched_at', 'holdings'}} ({} when there is none)."""
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path) as f:
+            return json.load(f)
+
+    def _load_cache(self):
+        """Load the cached holdings of the configured ETFs from disk, if any."""
+        cached = self._read_cache()
+        for etf, entry in cached.items():
+            if etf not in self.etfs:
+                continue
+            self.holdings[etf] = entry['holdings']
+            self.fetched_at[etf] = entry['fetched_at']
+        self._build_index()
+
+    def _save_cache(self):
+        """Write the cached holdings to disk, keeping the entries of the ETFs this store does not use."""
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        cached = self._read_cache()
+        cached.update({
+            etf: {'fetched_at': self.fetched_at[etf], 'holdings': holdings}
+            for etf, holdings in self.holdings.items()
+        })
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _build_index(self):
+        """Rebuild the ticker -> {etf: weight} reverse index from the holdings."""
+        index = {}
+        for etf, holdings in self.holdings.items():
+            for ticker, weight in holdings.items():
+                index.setdefault(ticker, {})[etf] = weight
+        self.index = index
+
+    def stale_etfs(self, now=None):
+        """Return the configured ETFs whose cached holdings are missing or older than the TTL."""
+        now = time.time() if now is None else now
+        return [etf for etf in self.etfs if now - self.fetched_at.get(etf, 0) > self.ttl]
+
+    def refresh(self, force=False, strict=True):
+        """Load the holdings of stale ETFs (or all of them when force is set) and rebuild the index.
+
+        The ETFs whose holdings can not be loaded are kept in self.unavailable; with strict,
+        HoldingsUnavailableError is raised for them once the others are loaded.
+        Returns the list of ETFs that were loaded.
+        """
+        to_fetch = list(self.etfs) if force else self.stale_etfs()
+        if not to_fetch:
+            return []
+
+        fetched = []
+        for etf in to_fetch:
+            try:
+                holdings = normalize_holdings(self.fetcher(etf))
+            except HoldingsUnavailableError as error:
+                self.unavailable[etf] = str(error)
+                continue
+            self.unavailable.pop(etf, None)
+            self.holdings[etf] = holdings
+            self.fetched_at[etf] = time.time()
+            fetched.append(etf)
+
+        if fetched:
+            self._build_index()
+            self._save_cache()
+        if strict and any(etf in self.unavailable for etf in to_fetch):
+            raise HoldingsUnavailableError('; '.join(self.unavailable[etf] for etf in to_fetch if etf in self.unavailable))
+        return fetched
+
+    def etfs_holding(self, ticker):
+        """Return {etf: weight} for every cached ETF that holds the ticker."""
+        return dict(self.index.get(ticker.strip().upper(), {}))
+
+    def etfs_holding_any(self, tickers):
+        """Return {ticker: {etf: weight}} for every ticker held by at least one cached ETF."""
+        result = {}
+        for ticker in tickers:
+            ticker = ticker.strip().upper()
+            if ticker in self.index:
+                result[ticker] = dict(self.index[ticker])
+        return result
+
+    def holders_of_any(self, tickers):
+        """Return the set of ETFs that hold at least one of the tickers."""
+        etfs = set()
+        for ticker in tickers:
+            etfs.update(self.index.get(ticker.strip().upper(), {}))
+        return etfs
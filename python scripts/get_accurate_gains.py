@@ -1,4 +1,9 @@
+import argparse
+
 import robin_stocks.robinhood as r
+from request_scheduler import get_scheduler
+from api_replay import install_from_env
+import accounts
 
 '''
 Robinhood includes dividends as part of your net gain. This script removes
@@ -8,29 +13,62 @@ off.
 Note: load_portfolio_profile() contains some other useful breakdowns of equity.
 Print profileData and see what other values you can play around with.
 
+The account is selected with --account or RH_ACCOUNT (see accounts.py);
+multi_account.py computes the same gains for several accounts at once.
+
 '''
 
 
-login = r.login("joncrissey@gmail.com")
+def fetch_gain_inputs():
+    """Fetch the portfolio profile, bank transfers, card transactions and total dividends."""
+    scheduler = get_scheduler()
+    return {
+        'profile': scheduler.call(r.load_portfolio_profile),
+        'transfers': scheduler.call(r.get_bank_transfers) or [],
+        'card_transactions': scheduler.call(r.get_card_transactions) or [],
+        'dividends': scheduler.call(r.get_total_dividends),
+    }
+
+
+def compute_gains(profile, transfers, card_transactions, dividends):
+    """Return the money invested, the equity, the dividends and the gains without dividends."""
+    deposits = sum(float(x['amount']) for x in transfers if (x['direction'] == 'deposit') and (x['state'] == 'completed'))
+    withdrawals = sum(float(x['amount']) for x in transfers if (x['direction'] == 'withdraw') and (x['state'] == 'completed'))
+    debits = sum(float(x['amount']['amount']) for x in card_transactions if (x['direction'] == 'debit' and (x['transaction_type'] == 'settled')))
+    reversal_fees = sum(float(x['fees']) for x in transfers if (x['direction'] == 'deposit') and (x['state'] == 'reversed'))
+
+    money_invested = deposits + reversal_fees - (withdrawals)
+    equity = float(profile['extended_hours_equity'] or profile['equity'])
+    gain_minus_dividends = equity - dividends - money_invested
+    return {
+        'deposits': deposits,
+        'withdrawals': withdrawals,
+        'card_debits': debits,
+        'money_invested': money_invested,
+        'equity': equity,
+        'dividends': dividends,
+        'gain_minus_dividends': gain_minus_dividends,
+        'percent_dividend': dividends / money_invested * 100 if money_invested else float('nan'),
+        'percent_gain': gain_minus_dividends / money_invested * 100 if money_invested else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gains of the account without dividends')
+    parser.add_argument('--account', help='account name or username (see accounts.py)')
+    args = parser.parse_args()
 
-profileData = r.load_portfolio_profile()
-allTransactions = r.get_bank_transfers()
-cardTransactions= r.get_card_transactions()
+    # Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+    install_from_env()
+    accounts.login(args.account)
 
-deposits = sum(float(x['amount']) for x in allTransactions if (x['direction'] == 'deposit') and (x['state'] == 'completed'))
-withdrawals = sum(float(x['amount']) for x in allTransactions if (x['direction'] == 'withdraw') and (x['state'] == 'completed'))
-debits = sum(float(x['amount']['amount']) for x in cardTransactions if (x['direction'] == 'debit' and (x['transaction_type'] == 'settled')))
-reversal_fees = sum(float(x['fees']) for x in allTransactions if (x['direction'] == 'deposit') and (x['state'] == 'reversed'))
+    gains = compute_gains(**fetch_gain_inputs())
 
-money_invested = deposits + reversal_fees - (withdrawals)
-dividends = r.get_total_dividends()
-percentDividend = dividends/money_invested*100
+    print("The total money invested is {:.2f}".format(gains['money_invested']))
+    print("The total equity is {:.2f}".format(gains['equity']))
+    print("The net worth has increased {:0.2}% due to dividends that amount to {:0.2f}".format(gains['percent_dividend'], gains['dividends']))
+    print("The net worth has increased {:0.3}% due to other gains that amount to {:0.2f}".format(gains['percent_gain'], gains['gain_minus_dividends']))
 
-equity = float(profileData['extended_hours_equity'])
-totalGainMinusDividends = equity - dividends - money_invested
-percentGain = totalGainMinusDividends/money_invested*100
 
-print("The total money invested is {:.2f}".format(money_invested))
-print("The total equity is {:.2f}".format(equity))
-print("The net worth has increased {:0.2}% due to dividends that amount to {:0.2f}".format(percentDividend, dividends))
-print("The net worth has increased {:0.3}% due to other gains that amount to {:0.2f}".format(percentGain, totalGainMinusDividends))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
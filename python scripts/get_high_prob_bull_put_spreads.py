@@ -13,15 +13,30 @@ The 'chance_of_profit_short' is set as the type of profit, which represents the
 The script uses these inputs to find options strategies that have a 70% chance of profit when sold and a 30% chance of profit when bought.
 
 Finally, the script outputs the data collected to a CSV file for further analysis.
+
+Each stage of the run is timed and a JSON run report is written to ../output/reports.
+Run with --profile to also capture a cProfile of the fetch, cleanup and spread stages.
+Run with --format parquet (or both) to append the spreads to the partitioned
+../output/datasets/put_credit_spreads dataset instead of (or as well as) the CSV file.
+Run with --montecarlo to add the spread-level Monte Carlo PoP, EV and tail loss
+(see spread_montecarlo.py), and with --fill-iv to derive missing IV, greeks and PoP
+from the bid/ask mid (see iv_solver.py).
 """
 
-import robin_stocks.robinhood.options as roptions
 import robin_stocks.robinhood as r
+import argparse
 import getpass
 import pandas as pd
+from option_market_data import fetch_options
+from api_replay import install_from_env
+from run_profiler import RunReport
+from scan_output import write_results
+from chain_filters import DEFAULT_FILTERS, DERIVED_FLAGS, add_filter_arguments, build_filters, fetch_spot_prices, filter_settings, prefilter, select_fields
 
 def try_login():
-    
+    # Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+    install_from_env()
+
     try:
         # Try to login with the username
         login = r.login()
@@ -57,50 +72,54 @@ def createSpreads(df, spread_widths):
                 # Check if the spread width is in the list of given spread widths
                 if current_spread_width in spread_widths:
                     # If it is, create a new row that combines the data from both options
-                    spread = {
-                        column: round((float(option1[column]) + float(option2[column])) / 2, 2) if column in ['PoP buy', 'PoP sell', 'impl vol', 'delta', 'rho', 'theta', 'vega']
-                        else round(option1[column] - option2[column], 2) if column in ['mark', 'ask', 'bid', 'volume'] 
-                        else f"-{option1[column]} / +{option2[column]}" if option1[column] != option2[column] 
-                        else option1[column] 
-                        for column in df.columns
-                    }
-                    # Add the spread width to the spread
-                    spread['width'] = current_spread_width
-                    # Add the new row to the list of spreads
-                    spreads.append(spread)
+                    # and add it to the list of spreads
+                    spreads.append(combineOptions(option1, option2, df.columns, current_spread_width))
     return spreads
 
-def main():
-    login = try_login()
-
-    inputSymbols = input("Enter a stock symbol, separated by commas: ").split(',')
-    expirationDate = input("Enter the option expiration date (YYYY-MM-DD): ")
+def combineOptions(option1, option2, columns, width):
+    """Combine a short (higher strike) and a long (lower strike) option into one spread row."""
+    spread = {
+        column: round((float(option1[column]) + float(option2[column])) / 2, 2) if column in ['PoP buy', 'PoP sell', 'impl vol', 'delta', 'rho', 'theta', 'vega']
+        else round(option1[column] - option2[column], 2) if column in ['mark', 'ask', 'bid', 'volume'] 
+        else bool(option1[column] or option2[column]) if column in DERIVED_FLAGS
+        else f"-{option1[column]} / +{option2[column]}" if option1[column] != option2[column] 
+        else option1[column] 
+        for column in columns
+    }
+    # Add the spread width to the spread
+    spread['width'] = width
+    return spread
+
+def fetchOptions(inputSymbols, expirationDate, optionType='put', typeProfit='chance_of_profit_short',
+                 profitFloor=0.65, profitCeiling=0.85, strikePrice=None, keep_missing=False):
+    """Find options that meet the profitability criteria (batched market data, see option_market_data.py).
+
+    With keep_missing, the options without a typeProfit value are kept too, so that it can be derived.
+    """
+    return fetch_options(
+        inputSymbols,
+        expirationDate=expirationDate,
+        strikePrice=strikePrice,
+        optionType=optionType,
+        typeProfit=typeProfit,
+        profitFloor=profitFloor,
+        profitCeiling=profitCeiling,
+        info=None,
+        keep_missing=keep_missing
+    )
 
-    #Define the profitability criteria
-    typeProfit = 'chance_of_profit_short'
-    profitFloor = 0.65
-    profitCeiling = 0.85
+def cleanOptions(options, filters=None):
+    """Convert the raw options to a DataFrame with the scanner columns, rounded and renamed.
 
-    strikePrice = None
-    optionType = 'put'
+    The raw options are pre-filtered first (see chain_filters.prefilter, by default only
+    the contracts that traded are kept), and only the survivors are materialized.
+    """
+    survivors = list(prefilter(options, **(DEFAULT_FILTERS if filters is None else filters)))
+    # Keep the flags of the values derived by iv_solver.fill_missing_fields
+    flags = [flag for flag in DERIVED_FLAGS if survivors and flag in survivors[0]]
 
-    # Find options that meet the profitability criteria
-    options = roptions.find_options_by_specific_profitability(
-        inputSymbols, 
-        expirationDate=expirationDate, 
-        strikePrice=strikePrice, 
-        optionType=optionType, 
-        typeProfit=typeProfit, 
-        profitFloor=profitFloor, 
-        profitCeiling=profitCeiling, 
-        info=None
-    )
-    df = pd.DataFrame(options)
-    # df.to_csv('option_data_raw.csv', index=False)
-
-    # df = pd.read_csv('option_data_raw.csv')
-    # Convert the list of options to a DataFrame and select only the specified columns
-    df = pd.DataFrame(options)[[
+    # Build the DataFrame from the specified columns of the surviving options only
+    df = pd.DataFrame(select_fields(survivors, [
         'symbol', 
         'strike_price', 
         'expiration_date', 
@@ -116,7 +135,7 @@ def main():
         'rho', 
         'theta', 
         'vega'
-    ]]
+    ] + flags))
 
     # Limit the decimal places of some columns to 2
     df[['ask_price', 'bid_price', 'adjusted_mark_price', 'strike_price']] = df[['ask_price', 'bid_price', 'adjusted_mark_price', 'strike_price']].astype(float).round(2)
@@ -137,34 +156,10 @@ def main():
         'implied_volatility': 'impl vol'
     })
 
-    # Omit rows with Volume equal to 0
-    df = df.loc[df['volume'] != 0]
-
-    # Write the DataFrame to a CSV file
-    df.to_csv('option_data.csv', index=False)
-
-    # Sort the DataFrame by Strike price
-    df = df.sort_values(['symbol','PoP sell'], ascending=False)
-
-    print(df)
-
-    df = df.sort_values('strike', ascending=False)
-    # Initialize an empty list to store the spreads
-
-    # Sort the DataFrame by strike price in descending order
+    return df
 
-    # df = df.drop(['impl vol', 'delta', 
-    #     'rho', 'theta','vega','volume'], axis=1 )
-
-    df = df.sort_values('strike', ascending=False)
-    # Initialize an empty list to store the spreads
-    spreads = createSpreads(df, [2.5, 5, 10])
-    
-    if(len(spreads) == 0):
-        print("No spreads found")
-        return
-    
-    # # Convert the list of spreads to a DataFrame
+def buildSpreadsFrame(spreads):
+    """Convert the list of spreads to a DataFrame with credit, max cost and max profit."""
     spreads_df = pd.DataFrame(spreads)
 
     spreads_df[['mark', 'ask', 'bid']] = spreads_df[['mark', 'ask', 'bid']].astype(float).round(2)
@@ -177,28 +172,115 @@ def main():
     # Define the new order of the columns
     columns_order = ['symbol', 'strike', 'exp date', 'credit', 'max_cost', 'max_profit', 'width', 'ask', 'bid', 'volume', 'PoP buy', 'PoP sell', 'impl vol', 'delta',	'rho',	'theta', 'vega']
 
-    # Reorder the DataFrame columns
-    spreads_df = spreads_df.reindex(columns=columns_order)
+    # Reorder the DataFrame columns, keeping the derived value flags at the end
+    return spreads_df.reindex(columns=columns_order + [flag for flag in DERIVED_FLAGS if flag in spreads_df.columns])
 
+def spreadsDataset(optionType='put'):
+    """Name of the spreads dataset (and CSV file suffix) of an option type."""
+    return f'{optionType.lower().strip()}_credit_spreads'
+
+def spreadsFileName(inputSymbols, expirationDate, optionType='put'):
+    """Create the CSV file name from the symbols, the expiration date and the option type."""
     # Get the symbols from the user input and join them with an underscore
     symbols = '_'.join(inputSymbols)
 
-    # Get the expiration date from the user input
-    exp_date = expirationDate
-
     # Format the expiration date to remove any characters that are not allowed in file names
-    exp_date = exp_date.replace('-', '_')
+    exp_date = expirationDate.replace('-', '_')
 
-    # Create the CSV file name
-    csv_file_name = f'{symbols}_{exp_date}_put_credit_spreads.csv'
+    return f'{symbols}_{exp_date}_{spreadsDataset(optionType)}.csv'
+
+def main(profile=False, output_format='csv', filters=None, montecarlo=False, fill_iv=False):
+    report = RunReport('bull_put_scan', profile=profile)
+
+    with report.stage('login'):
+        login = try_login()
+
+    inputSymbols = input("Enter a stock symbol, separated by commas: ").split(',')
+    expirationDate = input("Enter the option expiration date (YYYY-MM-DD): ")
+
+    #Define the profitability criteria
+    typeProfit = 'chance_of_profit_short'
+    profitFloor = 0.65
+    profitCeiling = 0.85
 
-    # Save the DataFrame to a CSV file
-    spreads_df.to_csv(csv_file_name, index=False)
+    strikePrice = None
+    optionType = 'put'
+
+    # Find options that meet the profitability criteria
+    with report.stage('fetch', hot=True) as stage:
+        # With --fill-iv, the options without a PoP are kept until it is derived
+        options = fetchOptions(inputSymbols, expirationDate, optionType, typeProfit,
+                               profitFloor, profitCeiling, strikePrice, keep_missing=fill_iv)
+        stage['rows'] = len(options)
+
+    if fill_iv:
+        from iv_solver import fill_missing_fields
+
+        with report.stage('fill_iv', hot=True) as stage:
+            # Derive the missing IV, greeks and PoP from the bid/ask mid, then apply the PoP band to them
+            options = fill_missing_fields(options, fetch_spot_prices(inputSymbols))
+            stage['rows'] = sum(option['iv_derived'] for option in options)
+            options = list(prefilter(options, typeProfit=typeProfit, profitFloor=profitFloor, profitCeiling=profitCeiling))
+
+    with report.stage('cleanup', hot=True) as stage:
+        df = cleanOptions(options, build_filters(inputSymbols, **(filters or {})))
+        stage['rows'] = len(df)
+
+    with report.stage('to_csv'):
+        # Write the DataFrame to a CSV file
+        df.to_csv('option_data.csv', index=False)
+
+    with report.stage('sort'):
+        # Sort the DataFrame by Strike price
+        df = df.sort_values(['symbol','PoP sell'], ascending=False)
+
+        print(df)
+
+        # Sort the DataFrame by strike price in descending order
+        df = df.sort_values('strike', ascending=False)
+
+    with report.stage('spreads', hot=True) as stage:
+        # Initialize an empty list to store the spreads
+        spreads = createSpreads(df, [2.5, 5, 10])
+        stage['rows'] = len(spreads)
+    
+    if(len(spreads) == 0):
+        print("No spreads found")
+        report.write()
+        return
+    
+    with report.stage('spread_metrics'):
+        spreads_df = buildSpreadsFrame(spreads)
+
+    if montecarlo:
+        from spread_montecarlo import add_montecarlo_columns
+
+        with report.stage('montecarlo', hot=True) as stage:
+            # Spread-level PoP, expected value and tail loss from simulated prices
+            spreads_df = add_montecarlo_columns(spreads_df, fetch_spot_prices(inputSymbols))
+            stage['rows'] = len(spreads_df)
+
+    # Create the CSV file name
+    csv_file_name = spreadsFileName(inputSymbols, expirationDate, optionType)
 
-    # Save the DataFrame to a CSV file
-    #spreads_df.to_csv('put_credit_spreads.csv', index=False)
+    with report.stage('spreads_output') as stage:
+        # Save the DataFrame to the spreads dataset and/or a CSV file
+        write_results(spreads_df, spreadsDataset(optionType), output_format, csv_file_name)
+        stage['rows'] = len(spreads_df)
 
     print(spreads_df)
+    report.write()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Find high probability put credit spreads')
+    parser.add_argument('--profile', action='store_true', help='capture a cProfile of the hot stages')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'both'], default='csv',
+                        help='write the spreads as CSV, to the Parquet dataset, or both')
+    parser.add_argument('--montecarlo', action='store_true',
+                        help="add the Monte Carlo 'MC PoP', 'MC EV', 'MC P(max loss)' and 'MC CVaR' columns")
+    parser.add_argument('--fill-iv', action='store_true',
+                        help='derive missing IV, greeks and PoP from the bid/ask mid (see iv_solver.py)')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+    main(profile=args.profile, output_format=args.format, filters=filter_settings(args),
+         montecarlo=args.montecarlo, fill_iv=args.fill_iv)
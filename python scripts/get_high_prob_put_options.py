@@ -13,112 +13,194 @@ The 'chance_of_profit_short' is set as the type of profit, which represents the
 The script uses these inputs to find options strategies that have a 70% chance of profit when sold and a 30% chance of profit when bought.
 
 Finally, the script outputs the data collected to a CSV file for further analysis.
+
+The fetch and cleanup steps are also used by batch_scan.py to run many scans in one process.
+Run with --format parquet (or both) to append the options to the partitioned
+../output/datasets/<order type>_option_data dataset instead of (or as well as) the CSV files.
+Run with --fill-iv to derive missing IV, greeks and PoP from the bid/ask mid (see iv_solver.py).
+Every stage is timed, with its API requests, in a run report (run_profiler.py); run with
+--profile to also capture a cProfile of the hot stages.
 """
 
-import robin_stocks.robinhood.options as roptions
 import robin_stocks.robinhood as r
+import argparse
 import getpass
+import os
 import pandas as pd
-
-username = input("Enter your username: ")
-password = getpass.getpass("Enter your password: ")
-login = r.login(username, password)
-
-# Prompt the user to enter the stock symbols
-inputSymbols = input("Enter a stock symbol, separated by commas: ").split(',')
-
-orderType = input("Enter the order type (call or put): ")
-
-# Remove leading and trailing whitespace from each symbol
-inputSymbols = [symbol.strip() for symbol in inputSymbols]
-
-# Define the symbols for which you want to find options
-#inputSymbols = ['AMD','META','NFLX']
-
-# Define the profitability criteria
-typeProfit = 'chance_of_profit_short'
-profitFloor = 0.70
-profitCeiling = 0.78
-
-# Define the expiration date, strike price, and option type
-expirationDate = '2024-03-22'
-strikePrice = None
-optionType = 'put'
-
-# Find options that meet the profitability criteria
-options = roptions.find_options_by_specific_profitability(
-    inputSymbols, 
-    expirationDate=expirationDate, 
-    strikePrice=strikePrice, 
-    optionType=optionType, 
-    typeProfit=typeProfit, 
-    profitFloor=profitFloor, 
-    profitCeiling=profitCeiling, 
-    info=None
-)
-
-# Convert the list of options to a DataFrame and select only the specified columns
-df = pd.DataFrame(options)[[
-    'symbol', 
-    'strike_price', 
-    'expiration_date', 
-    'ask_price', 
-    'bid_price', 
-    'volume', 
-    'break_even_price', 
-    'chance_of_profit_long', 
-    'chance_of_profit_short', 
-    'implied_volatility', 
-    'delta', 
-    'rho', 
-    'theta', 
-    'vega'
-]]
-
-# Limit the decimal places of some columns to 2
-df[['ask_price', 'bid_price', 'strike_price', 'break_even_price']] = df[['ask_price', 'bid_price', 'strike_price', 'break_even_price']].astype(float).round(2)
-
-
-# Limit the decimal places of some columns to 2
-df[['chance_of_profit_long', 'chance_of_profit_short', 'implied_volatility']] = df[['chance_of_profit_long', 'chance_of_profit_short', 'implied_volatility']].astype(float).round(4)
-
-# Rename the columns
-df = df.rename(columns={ 
-    'strike_price': 'strike', 
-    'expiration_date': 'exp date', 
-    'ask_price': 'ask', 
-    'bid_price': 'bid', 
-    'volume': 'volume', 
-    'break_even_price': 'break even', 
-    'chance_of_profit_long': 'PoP long', 
-    'chance_of_profit_short': 'PoP short', 
-    'implied_volatility': 'impl vol'
-})
-
-# Omit rows with Volume equal to 0
-df = df.loc[df['volume'] != 0]
-
-# Calculate the max cost and max profit for buying and selling options
-df['max_cost_buy'] = (df['ask'] * 100).round(2)
-df['max_profit_buy'] = ((df['strike'] - df['ask']) * 100).round(2)
-df['max_loss_buy'] = df['max_cost_buy']
-df['max_cost_sell'] = (df['bid'] * 100).round(2)
-df['max_profit_sell'] = ((df['strike'] - df['bid']) * 100).round(2)
-df['max_loss_sell'] = (df['strike'].astype(float) * 100).round(2)
-
-# Sort the DataFrame by Strike price
-df = df.sort_values(['symbol','PoP short'], ascending=False)
-
-# Write the DataFrame to a CSV file
-# df.to_csv('put_option_data.csv', index=False)
-
-# Group the DataFrame by the 'symbol' column
-groups = df.groupby('symbol')
-
-# Loop through the groups
-for name, group in groups:
-    # Sort the group by 'PoP short'
-    group = group.sort_values('PoP short', ascending=False)
-    
-    # Write the group to a CSV file
-    group.to_csv(f'{name}_{orderType}_option_data.csv', index=False)
+from option_market_data import fetch_options
+from api_replay import install_from_env
+from scan_output import write_dataset
+from chain_filters import DEFAULT_FILTERS, DERIVED_FLAGS, add_filter_arguments, build_filters, fetch_spot_prices, filter_settings, prefilter, select_fields
+from run_profiler import RunReport
+
+def fetchOptions(inputSymbols, expirationDate, optionType='put', typeProfit='chance_of_profit_short',
+                 profitFloor=0.70, profitCeiling=0.78, strikePrice=None, keep_missing=False):
+    """Find options that meet the profitability criteria (batched market data, see option_market_data.py).
+
+    With keep_missing, the options without a typeProfit value are kept too, so that it can be derived.
+    """
+    return fetch_options(
+        inputSymbols,
+        expirationDate=expirationDate,
+        strikePrice=strikePrice,
+        optionType=optionType,
+        typeProfit=typeProfit,
+        profitFloor=profitFloor,
+        profitCeiling=profitCeiling,
+        info=None,
+        keep_missing=keep_missing
+    )
+
+def cleanOptions(options, filters=None):
+    """Convert the raw options to a DataFrame with buy and sell metrics, sorted by symbol and PoP.
+
+    The raw options are pre-filtered first (see chain_filters.prefilter, by default only
+    the contracts that traded are kept), and only the survivors are materialized.
+    """
+    survivors = list(prefilter(options, **(DEFAULT_FILTERS if filters is None else filters)))
+    # Keep the flags of the values derived by iv_solver.fill_missing_fields
+    flags = [flag for flag in DERIVED_FLAGS if survivors and flag in survivors[0]]
+
+    # Build the DataFrame from the specified columns of the surviving options only
+    df = pd.DataFrame(select_fields(survivors, [
+        'symbol', 
+        'strike_price', 
+        'expiration_date', 
+        'ask_price', 
+        'bid_price', 
+        'volume', 
+        'break_even_price', 
+        'chance_of_profit_long', 
+        'chance_of_profit_short', 
+        'implied_volatility', 
+        'delta', 
+        'rho', 
+        'theta', 
+        'vega'
+    ] + flags))
+
+    # Limit the decimal places of some columns to 2
+    df[['ask_price', 'bid_price', 'strike_price', 'break_even_price']] = df[['ask_price', 'bid_price', 'strike_price', 'break_even_price']].astype(float).round(2)
+
+
+    # Limit the decimal places of some columns to 2
+    df[['chance_of_profit_long', 'chance_of_profit_short', 'implied_volatility']] = df[['chance_of_profit_long', 'chance_of_profit_short', 'implied_volatility']].astype(float).round(4)
+
+    # Rename the columns
+    df = df.rename(columns={ 
+        'strike_price': 'strike', 
+        'expiration_date': 'exp date', 
+        'ask_price': 'ask', 
+        'bid_price': 'bid', 
+        'volume': 'volume', 
+        'break_even_price': 'break even', 
+        'chance_of_profit_long': 'PoP long', 
+        'chance_of_profit_short': 'PoP short', 
+        'implied_volatility': 'impl vol'
+    })
+
+    # Calculate the max cost and max profit for buying and selling options
+    df['max_cost_buy'] = (df['ask'] * 100).round(2)
+    df['max_profit_buy'] = ((df['strike'] - df['ask']) * 100).round(2)
+    df['max_loss_buy'] = df['max_cost_buy']
+    df['max_cost_sell'] = (df['bid'] * 100).round(2)
+    df['max_profit_sell'] = ((df['strike'] - df['bid']) * 100).round(2)
+    df['max_loss_sell'] = (df['strike'].astype(float) * 100).round(2)
+
+    # Sort the DataFrame by Strike price
+    return df.sort_values(['symbol','PoP short'], ascending=False)
+
+def writeSymbolFiles(df, orderType, output_dir='.', names=None):
+    """Write one CSV file per symbol, sorted by 'PoP short'. Returns the paths written.
+
+    names gives the file name prefix of every row (the symbol by default), to split the
+    files further without touching the 'symbol' column.
+    """
+    # Group the DataFrame by the file name prefix
+    groups = df.groupby(df['symbol'] if names is None else names)
+
+    # Loop through the groups
+    paths = []
+    for name, group in groups:
+        # Sort the group by 'PoP short'
+        group = group.sort_values('PoP short', ascending=False)
+        
+        # Write the group to a CSV file
+        path = os.path.join(output_dir, f'{name}_{orderType}_option_data.csv')
+        group.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def main(output_format='csv', filters=None, fill_iv=False, profile=False):
+    report = RunReport('options_scan', profile=profile)
+
+    # Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+    install_from_env()
+
+    username = input("Enter your username: ")
+    password = getpass.getpass("Enter your password: ")
+    with report.stage('login'):
+        login = r.login(username, password)
+
+    # Prompt the user to enter the stock symbols
+    inputSymbols = input("Enter a stock symbol, separated by commas: ").split(',')
+
+    orderType = input("Enter the order type (call or put): ")
+
+    # Define the expiration date
+    expirationDate = input("Enter the option expiration date (YYYY-MM-DD): ")
+
+    # Remove leading and trailing whitespace from each symbol
+    inputSymbols = [symbol.strip() for symbol in inputSymbols]
+
+    # Define the profitability criteria
+    typeProfit = 'chance_of_profit_short'
+    profitFloor = 0.70
+    profitCeiling = 0.78
+
+    # Define the strike price and option type
+    strikePrice = None
+    optionType = 'put'
+
+    # Find options that meet the profitability criteria
+    with report.stage('fetch', hot=True) as stage:
+        # With --fill-iv, the options without a PoP are kept until it is derived
+        options = fetchOptions(inputSymbols, expirationDate, optionType, typeProfit,
+                               profitFloor, profitCeiling, strikePrice, keep_missing=fill_iv)
+        stage['rows'] = len(options)
+
+    if fill_iv:
+        from iv_solver import fill_missing_fields
+
+        with report.stage('fill_iv', hot=True) as stage:
+            # Derive the missing IV, greeks and PoP from the bid/ask mid, then apply the PoP band to them
+            options = fill_missing_fields(options, fetch_spot_prices(inputSymbols))
+            stage['rows'] = sum(option['iv_derived'] for option in options)
+            options = list(prefilter(options, typeProfit=typeProfit, profitFloor=profitFloor, profitCeiling=profitCeiling))
+
+    with report.stage('cleanup', hot=True) as stage:
+        df = cleanOptions(options, build_filters(inputSymbols, **(filters or {})))
+        stage['rows'] = len(df)
+
+    # Write the DataFrame to a CSV file
+    # df.to_csv('put_option_data.csv', index=False)
+
+    with report.stage('output') as stage:
+        if output_format in ('parquet', 'both'):
+            write_dataset(df, f'{orderType}_option_data')
+        if output_format in ('csv', 'both'):
+            writeSymbolFiles(df, orderType)
+        stage['rows'] = len(df)
+
+    report.write()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find high probability options')
+    parser.add_argument('--profile', action='store_true', help='capture a cProfile of the hot stages')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'both'], default='csv',
+                        help='write one CSV per symbol, append to the Parquet dataset, or both')
+    parser.add_argument('--fill-iv', action='store_true',
+                        help='derive missing IV, greeks and PoP from the bid/ask mid (see iv_solver.py)')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+    main(output_format=args.format, filters=filter_settings(args), fill_iv=args.fill_iv, profile=args.profile)
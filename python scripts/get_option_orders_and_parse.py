@@ -8,118 +8,168 @@ After logging in, it fetches all option orders and converts the list of orders (
 
 It then filters out any cancelled orders from the DataFrame.
 
+The expiration, strike and type of every leg come from the leg itself; when a leg lacks
+one of them, it is filled in from the local instrument cache (instrument_cache.py), which
+only requests the instruments it has not seen before.
+
 The resulting DataFrame contains the details of all non-cancelled option orders.
 
+Every stage (login, fetch, legs, format, output) is timed, with its API requests, in a
+run report (run_profiler.py); run with --profile to also capture a cProfile of the hot stages.
+
 Dependencies:
 - robin_stocks: a Python library that interacts with the Robinhood API
 - pandas: a Python library for data manipulation and analysis
 - getpass: a Python library for securely entering passwords
 """
+import argparse
 import os
 import robin_stocks.robinhood as r
 import pandas as pd
 import datetime
 import getpass
+from request_scheduler import get_scheduler
+from api_replay import install_from_env
+from instrument_cache import InstrumentCache, explode_legs, instrument_ids
+from run_profiler import RunReport
 
 # username = input("Enter your username: ")
 # password = getpass.getpass("Enter your password: ")
 # login = r.login(username, password)
 
+parser = argparse.ArgumentParser(description='Download the option orders to CSV')
+parser.add_argument('--profile', action='store_true', help='capture a cProfile of the hot stages')
+args = parser.parse_args()
+report = RunReport('option_orders', profile=args.profile)
 
-try:
-    # Try to login with the username
-    login = r.login()
-except:
-    # If login fails, prompt for password
-    username = input("Enter your username: ")
-    password = getpass.getpass("Enter your password: ")
-    login = r.login(username, password)
-
-# Rest of your code...
-# Get all option orders
-all_orders = r.orders.get_all_option_orders()
-
-# Convert the list of dictionaries to a DataFrame
-df = pd.DataFrame(all_orders)
-
-df = df[df['state'] != 'cancelled']
-
-legs_data = df['legs'].apply(pd.Series)
-
-# Extract the 'expiration_date', 'strike_price', and 'option_type' from the 'legs' list
-df['expiration_date'] = df['legs'].apply(lambda x: x[0]['expiration_date'] if x else None)
-df['strike_price'] = df['legs'].apply(lambda x: '/'.join([f"{float(leg['strike_price']):.2f}" for leg in x]) if x else None)
-df['option_type'] = df['legs'].apply(lambda x: '/'.join([leg['option_type'] for leg in x]) if x else None)
-df['position_effect'] = df['legs'].apply(lambda x: x[0]['position_effect'] if x else None)
-df['option'] = df['legs'].apply(lambda x: x[0]['option'][-13:][:-1] if x else None)
-
-
-#Specify the columns to drop
-columns_to_drop = ['net_amount','estimated_total_net_amount','premium','regulatory_fees',
-            'time_in_force','form_source','client_bid_at_submission','client_ask_at_submission',
-            'client_time_at_submission','trigger','type','updated_at','chain_id','quantity',
-            'pending_quantity','response_category','stop_price','account_number',
-            'cancel_url', 'canceled_quantity', 'ref_id', 'legs', 'state', 'id',
-            'estimated_total_net_amount_direction']
-
-# Drop the specified columns
-df = df.drop(columns=columns_to_drop)
-
-df = df[['chain_symbol'] + [col for col in df.columns if col != 'chain_symbol']]
-
-# Convert 'created_at' to datetime format
-df['created_at'] = pd.to_datetime(df['created_at'])
-
+# Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+install_from_env()
 
-df = df[df['created_at'] > '2024-03-25']
-
-df['created_at'] = df['created_at'].dt.date
-
-
-#Specify the new column order
-new_order = ['chain_symbol', 'created_at', 'option', 'position_effect', 'expiration_date', 'strike_price', 'price', 'processed_quantity', 'opening_strategy', 
-            'direction', 'processed_premium', 'option_type', 'closing_strategy', 'net_amount_direction', 'average_net_premium_paid']
-#Reorder the columns
-df = df.reindex(columns=new_order)
-
-
-# Specify the column abbreviations
-column_abbreviations = {
-    'chain_symbol': 'symbol',
-    'average_net_premium_paid': 'avg_net_premium',
-    'processed_premium': 'premium',
-    'processed_quantity': 'quantity',
-    # Add more abbreviations as needed
-}
-
-
-# Rename the columns
-df = df.rename(columns=column_abbreviations)
-
-
-# Display the DataFrame
-df = df.sort_values(['option'])
-
-# Iterate over each column in the DataFrame
-
-for col in df.columns:
-    if df[col].apply(lambda x: isinstance(x, datetime.date)).any():
-        continue
+with report.stage('login'):
     try:
-        df[col] = df[col].astype(float).round(2)
-    except ValueError:
-        pass
-# Save the DataFrame to a CSV file
-
-# Count the occurrences of each 'option' value
-option_counts = df['option'].value_counts()
+        # Try to login with the username
+        login = r.login()
+    except:
+        # If login fails, prompt for password
+        username = input("Enter your username: ")
+        password = getpass.getpass("Enter your password: ")
+        login = r.login(username, password)
+
+with report.stage('fetch', hot=True) as stage:
+    # Rest of your code...
+    # Get all option orders
+    all_orders = get_scheduler().call(r.orders.get_all_option_orders)
+
+    # Convert the list of dictionaries to a DataFrame
+    df = pd.DataFrame(all_orders)
+
+    df = df[df['state'] != 'cancelled']
+    stage['rows'] = len(df)
+
+
+def join_known(values):
+    """Join the known values of the legs with '/', skipping the legs whose value is unknown."""
+    return '/'.join(value for value in values if isinstance(value, str)) or None
+
+
+with report.stage('legs', hot=True) as stage:
+    # One row per leg. The legs carry their expiration, strike and type; the local instrument
+    # cache only fills in the ones that are missing
+    legs = explode_legs(df[['id', 'legs']], leg_fields=('option', 'position_effect', 'expiration_date', 'strike_price', 'option_type'))
+    legs['instrument_id'] = instrument_ids(legs['option']).to_numpy()
+    legs['strike_price'] = pd.to_numeric(legs['strike_price'], errors='coerce')
+    missing = legs[['expiration_date', 'strike_price', 'option_type']].isna().any(axis=1)
+    if missing.any():
+        cached = InstrumentCache().join(legs.loc[missing, ['option']], 'option', fields=['expiration_date', 'strike_price', 'type'])
+        cached.index = legs.index[missing]
+        legs['expiration_date'] = legs['expiration_date'].fillna(cached['expiration_date'])
+        legs['strike_price'] = legs['strike_price'].fillna(pd.to_numeric(cached['strike_price'], errors='coerce'))
+        legs['option_type'] = legs['option_type'].fillna(cached['type'])
+    legs['strike_price'] = legs['strike_price'].map('{:.2f}'.format, na_action='ignore')
+
+    # Summarize the legs of each order: the first leg for the expiration, position effect and
+    # instrument, all legs for the strikes and option types
+    order_legs = legs.groupby('id', sort=False).agg(
+        expiration_date=('expiration_date', 'first'),
+        strike_price=('strike_price', join_known),
+        option_type=('option_type', join_known),
+        position_effect=('position_effect', 'first'),
+        option=('instrument_id', 'first'),
+    )
+    df = df.join(order_legs, on='id')
+    stage['rows'] = len(legs)
+
+with report.stage('format', hot=True) as stage:
+    #Specify the columns to drop
+    columns_to_drop = ['net_amount','estimated_total_net_amount','premium','regulatory_fees',
+                'time_in_force','form_source','client_bid_at_submission','client_ask_at_submission',
+                'client_time_at_submission','trigger','type','updated_at','chain_id','quantity',
+                'pending_quantity','response_category','stop_price','account_number',
+                'cancel_url', 'canceled_quantity', 'ref_id', 'legs', 'state', 'id',
+                'estimated_total_net_amount_direction']
+
+    # Drop the specified columns
+    df = df.drop(columns=columns_to_drop)
+
+    df = df[['chain_symbol'] + [col for col in df.columns if col != 'chain_symbol']]
+
+    # Convert 'created_at' to datetime format
+    df['created_at'] = pd.to_datetime(df['created_at'])
+
+
+    df = df[df['created_at'] > '2024-03-25']
+
+    df['created_at'] = df['created_at'].dt.date
+
+
+    #Specify the new column order
+    new_order = ['chain_symbol', 'created_at', 'option', 'position_effect', 'expiration_date', 'strike_price', 'price', 'processed_quantity', 'opening_strategy', 
+                'direction', 'processed_premium', 'option_type', 'closing_strategy', 'net_amount_direction', 'average_net_premium_paid']
+    #Reorder the columns
+    df = df.reindex(columns=new_order)
+
+
+    # Specify the column abbreviations
+    column_abbreviations = {
+        'chain_symbol': 'symbol',
+        'average_net_premium_paid': 'avg_net_premium',
+        'processed_premium': 'premium',
+        'processed_quantity': 'quantity',
+        # Add more abbreviations as needed
+    }
+
+
+    # Rename the columns
+    df = df.rename(columns=column_abbreviations)
+
+
+    # Display the DataFrame
+    df = df.sort_values(['option'])
+
+    # Iterate over each column in the DataFrame
+
+    for col in df.columns:
+        if df[col].apply(lambda x: isinstance(x, datetime.date)).any():
+            continue
+        try:
+            df[col] = df[col].astype(float).round(2)
+        except ValueError:
+            pass
+    # Save the DataFrame to a CSV file
 
-# Get the 'option' values that appear only once
-open_options = option_counts[option_counts == 1].index
+    # Count the occurrences of each 'option' value
+    option_counts = df['option'].value_counts()
 
-# Filter the DataFrame to only include rows with 'option' values that appear only once
-df = df[df['option'].isin(open_options)]
-# Filter the DataFrame to only include rows where 'position_effect' is not 'close'
-df = df[df['position_effect'] != 'close']
+    # Get the 'option' values that appear only once
+    open_options = option_counts[option_counts == 1].index
 
-df.to_csv('recent_option_orders.csv', index=False)
+    # Filter the DataFrame to only include rows with 'option' values that appear only once
+    df = df[df['option'].isin(open_options)]
+    # Filter the DataFrame to only include rows where 'position_effect' is not 'close'
+    df = df[df['position_effect'] != 'close']
+    stage['rows'] = len(df)
+
+with report.stage('output'):
+    df.to_csv('recent_option_orders.csv', index=False)
+
+report.write()
@@ -4,22 +4,31 @@ import robin_stocks.robinhood as r
 import pandas as pd
 from plotly import express as px
 from plotly.subplots import make_subplots
+from request_scheduler import get_scheduler
+from api_replay import install_from_env
+from instrument_cache import InstrumentCache
+import accounts
 
-# Get the current options holdings for the user's account
-email = input("Please enter your Robinhood email address: ")
-login = r.login(email)
+# Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+install_from_env()
 
+# Get the current options holdings for the user's account (RH_ACCOUNT, see accounts.py)
+login = accounts.login()
 
-account_info = r.profiles.load_account_profile()
+
+account_info = get_scheduler().call(r.profiles.load_account_profile)
 
 # Print your account information
 print(account_info)
 
-options = r.get_open_option_positions()
+options = get_scheduler().call(r.get_open_option_positions)
 
 # Create a Pandas DataFrame to store the options data
 df = pd.DataFrame(options)
 
+# Positions only carry the option instrument URL, join the expiration, strike and type
+df = InstrumentCache().join(df, 'option', fields=['expiration_date', 'strike_price', 'type'])
+
 # Display all stats for each option in the DataFrame
 print(df)
 
@@ -31,7 +40,7 @@ fig.update_layout(height=600, width=800)
 fig.add_trace(
     dict(
         type="scatter",
-        x=df["expirationDate"],
+        x=df["expiration_date"],
         y=df["bid_price"] / 100,
         name="Bid Price",
         line=dict(color="#3f68b2"),
@@ -41,7 +50,7 @@ fig.add_trace(
 fig.add_trace(
     dict(
         type="scatter",
-        x=df["expirationDate"],
+        x=df["expiration_date"],
         y=df["option_value"] / 100,
         name="Option Value",
         line=dict(color="#ffa634"),
@@ -50,7 +59,7 @@ fig.add_trace(
 fig.add_trace(
     dict(
         type="scatter",
-        x=df["expirationDate"],
+        x=df["expiration_date"],
         y=df["adjusted_mark_price"] / 100,
         name="Mark Price",
         line=dict(color="#3f68b2"),
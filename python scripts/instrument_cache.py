@@ -0,0 +1,146 @@
+"""
+Persistent option instrument metadata cache.
+
+Order legs, positions and events only refer to their contract by the option instrument
+URL (https://api.robinhood.com/options/instruments/<id>/). Instruments never change, so
+their metadata (underlying, strike, type, expiration, tradability, ...) is fetched once
+and kept for good in ../output/cache/option_instruments.json.
+
+- unknown instrument ids are resolved in bulk, with one request per batch of ids
+  (the instruments endpoint accepts ?ids=id1,id2,...)
+- lookups are plain dict lookups in memory
+- tables join the metadata with one vectorized merge on the instrument id, which is
+  extracted from the URL column with a regex instead of by slicing each string
+- several processes can share the cache file (multi_account.py workers): a save merges
+  the instruments stored by the others since the load, through a temporary file of its
+  own. An instrument lost to two saves at the same moment is only fetched again later
+
+Usage:
+    cache = InstrumentCache()
+    orders = cache.join(legs_df, 'option')   # adds chain_symbol, strike_price, type, ...
+    cache.get('5f1a...')                      # metadata dict of one instrument
+"""
+
+import json
+import os
+import threading
+
+import pandas as pd
+
+from request_scheduler import get_scheduler
+
+DEFAULT_CACHE_PATH = '../output/cache/option_instruments.json'
+BATCH_SIZE = 50
+INSTRUMENT_FIELDS = ['id', 'url', 'chain_id', 'chain_symbol', 'strike_price', 'type', 'expiration_date',
+                     'issue_date', 'state', 'tradability', 'rhs_tradability']
+UUID_PATTERN = r'([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})'
+
+
+def instrument_ids(urls):
+    """Extract the instrument ids from a Series of instrument URLs (or ids), vectorized."""
+    return pd.Series(urls).astype('string').str.extract(UUID_PATTERN, expand=False).str.lower()
+
+
+def fetch_instruments(ids):
+    """Fetch the metadata of a batch of option instruments in one request."""
+    from robin_stocks.robinhood.helper import request_get
+    from robin_stocks.robinhood.urls import option_instruments_url
+
+    return request_get(option_instruments_url(), 'pagination', {'ids': ','.join(ids)}) or []
+
+
+class InstrumentCache:
+    """Instrument id -> metadata, resolved in bulk and stored permanently."""
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, fetcher=fetch_instruments, batch_size=BATCH_SIZE):
+        self.cache_path = cache_path
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.instruments = {}  # id -> metadata
+        self._load_cache()
+
+    def _load_cache(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                self.instruments = json.load(f)
+
+    def _save_cache(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Keep the instruments other processes stored since the load
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path) as f:
+                    stored = json.load(f)
+            except ValueError:
+                stored = {}
+            self.instruments = dict(stored, **self.instruments)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.instruments, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def resolve(self, ids):
+        """Fetch the unknown ids in batches and store them. Returns the ids that were fetched."""
+        missing = sorted({str(id).lower() for id in ids if isinstance(id, str) and id} - set(self.instruments))
+        if not missing:
+            return []
+
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        for results in get_scheduler().map(self.fetcher, batches):
+            for instrument in results or []:
+                if instrument and instrument.get('id'):
+                    self.instruments[instrument['id'].lower()] = {field: instrument.get(field) for field in INSTRUMENT_FIELDS}
+        self._save_cache()
+        return missing
+
+    def add(self, instruments):
+        """Store instruments that were fetched elsewhere (chain listings). Returns the number of new ones."""
+        new = 0
+        for instrument in instruments:
+            if instrument and instrument.get('id') and instrument['id'].lower() not in self.instruments:
+                self.instruments[instrument['id'].lower()] = {field: instrument.get(field) for field in INSTRUMENT_FIELDS}
+                new += 1
+        if new:
+            self._save_cache()
+        return new
+
+    def get(self, id):
+        """Return the metadata of one instrument (id or URL), fetching it if it is unknown."""
+        id = instrument_ids([id]).iloc[0]
+        if pd.isna(id):
+            return None
+        self.resolve([id])
+        return self.instruments.get(id)
+
+    def frame(self, ids=None):
+        """Return the metadata of the ids (all cached instruments by default) as a DataFrame."""
+        instruments = self.instruments if ids is None else {id: self.instruments[id] for id in ids if id in self.instruments}
+        return pd.DataFrame(list(instruments.values()), columns=INSTRUMENT_FIELDS)
+
+    def join(self, df, url_column='option', fields=None, prefix=''):
+        """Return df with an 'instrument_id' column and the metadata of its instruments joined in.
+
+        fields selects the metadata columns (all but id and url by default); prefix is
+        prepended to their names, to keep them apart from columns that df already has.
+        """
+        df = df.copy()
+        df['instrument_id'] = instrument_ids(df[url_column]).to_numpy()
+        ids = df['instrument_id'].dropna().unique()
+        self.resolve(ids)
+
+        fields = fields or [field for field in INSTRUMENT_FIELDS if field not in ('id', 'url')]
+        metadata = self.frame(ids)[['id'] + fields].rename(columns={field: prefix + field for field in fields})
+        return df.merge(metadata.rename(columns={'id': 'instrument_id'}), on='instrument_id', how='left')
+
+
+def explode_legs(orders, legs_column='legs', leg_fields=('option', 'side', 'position_effect', 'ratio_quantity')):
+    """Return one row per order leg, with the order columns repeated and the leg fields as columns."""
+    legs = orders.drop(columns=[legs_column]).join(orders[legs_column].rename('_leg').explode())
+    legs = legs[legs['_leg'].notna()]
+    legs['leg'] = legs.groupby(level=0).cumcount()
+    leg_values = pd.DataFrame(legs['_leg'].tolist(), index=legs.index)
+    for field in leg_fields:
+        legs['leg_' + field if field in legs.columns else field] = leg_values.get(field)
+    return legs.drop(columns=['_leg']).reset_index(drop=True)
@@ -0,0 +1,300 @@
+"""
+Orders, positions, transfers, events and P&L of several Robinhood accounts in one run.
+
+The accounts come from accounts.py (RH_ACCOUNTS or ../output/accounts.json). Every account
+is fetched in its own worker process with its own stored session, so the accounts are
+fetched concurrently and a login never replaces the session of another account. A worker
+fetches, through the request scheduler:
+
+- the completed stock and option orders (the rows of delta_export.py)
+- the open stock positions and the open option positions (with the instrument cache)
+- the bank transfers, card transactions, total dividends and portfolio equity
+- the option events (expirations, assignments, exercises)
+
+and writes them, tagged with an 'account' column, to ../output/accounts/<account>/. Like
+sharded_scan.py, workers only return small summaries; the parent reads the tables back and
+writes the combined ones to ../output/accounts/<table>.csv, plus:
+
+- pnl.csv: per account and for all accounts ('ALL'): the money invested, the equity, the
+  dividends and the gain without dividends (get_accurate_gains.py), the net option
+  premiums and event cash, the realized and unrealized stock gain (cost_basis.py)
+- exposure.csv: per account and symbol, and per symbol for all accounts: the stock value,
+  the option market value and the delta dollars of the options (the P&L of a 1% move of
+  the underlying, scaled to 100%; stress_scenarios.py), and the net delta dollars
+
+The API rate limit is split between the workers, so the total request rate stays the same
+as a single process. The parent logs in to every account first, one after the other, so
+an expired session can still prompt for the password and MFA code: a worker has no
+terminal and only reuses the stored sessions.
+
+Usage:
+    RH_ACCOUNTS="main=jane@example.com,ira=jane.ira@example.com" python multi_account.py
+    python multi_account.py --accounts main,ira --rate 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import accounts as account_config
+
+ACCOUNTS_DIR = '../output/accounts'
+TABLES = ['stock_orders', 'option_orders', 'stock_positions', 'option_positions', 'transfers', 'events']
+ALL_ACCOUNTS = 'ALL'
+DELTA_MOVE = 0.01
+
+
+def account_dir(name, root=ACCOUNTS_DIR):
+    return os.path.join(root, name)
+
+
+def fetch_stock_positions():
+    """The open stock positions with their symbol, quantity, average buy price and latest price."""
+    import robin_stocks.robinhood as r
+    from chain_filters import fetch_spot_prices
+    from request_scheduler import get_scheduler
+
+    scheduler = get_scheduler()
+    positions = pd.DataFrame(scheduler.call(r.get_open_stock_positions) or [])
+    if positions.empty:
+        return pd.DataFrame(columns=['symbol', 'quantity', 'average_buy_price', 'price', 'market_value'])
+    instruments = sorted(positions['instrument'].unique())
+    symbols = dict(zip(instruments, scheduler.map(r.stocks.get_symbol_by_url, instruments)))
+    positions = pd.DataFrame({
+        'symbol': positions['instrument'].map(symbols),
+        'quantity': pd.to_numeric(positions['quantity'], errors='coerce'),
+        'average_buy_price': pd.to_numeric(positions['average_buy_price'], errors='coerce'),
+    }).dropna(subset=['symbol'])
+    prices = fetch_spot_prices(positions['symbol'])
+    positions['price'] = positions['symbol'].map(prices)
+    positions['market_value'] = positions['quantity'] * positions['price']
+    return positions.reset_index(drop=True)
+
+
+def fetch_option_events():
+    """The option events of the account (one paginated request), with their underlying symbol."""
+    from robin_stocks.robinhood.helper import request_get
+    from robin_stocks.robinhood.urls import events_url
+
+    from instrument_cache import InstrumentCache
+    from request_scheduler import get_scheduler
+
+    events = pd.DataFrame(get_scheduler().call(request_get, events_url(), 'pagination') or [])
+    if events.empty:
+        return pd.DataFrame(columns=['chain_symbol', 'type', 'event_date', 'direction', 'quantity', 'total_cash_amount'])
+    events = InstrumentCache().join(events, 'option', fields=['chain_symbol', 'strike_price', 'expiration_date'], prefix='option_')
+    return events.drop(columns=['equity_components'], errors='ignore').rename(columns={'option_chain_symbol': 'chain_symbol'})
+
+
+def option_delta_dollars(legs, rate=0.0):
+    """Delta dollars of every leg: its P&L for a 1% move of the underlying, scaled to a 100% move."""
+    from stress_scenarios import revalue
+
+    if legs.empty:
+        return np.zeros(0)
+    pnl = revalue(legs, [-DELTA_MOVE, DELTA_MOVE], [0.0], [0], rate)[0, :, 0, :]
+    return (pnl[1] - pnl[0]) / (2 * DELTA_MOVE)
+
+
+def option_premiums(option_orders):
+    """Net premium of the filled option orders: credits minus debits (each order once, not per leg)."""
+    if option_orders.empty:
+        return 0.0
+    orders = option_orders.drop_duplicates('order_id')
+    amount = pd.to_numeric(orders['price'], errors='coerce') * pd.to_numeric(orders['processed_quantity'], errors='coerce') * 100
+    return float(np.where(orders['direction'] == 'credit', amount, -amount).sum())
+
+
+def event_cash(events):
+    """Net cash of the option events: credits minus debits."""
+    if events.empty:
+        return 0.0
+    amount = pd.to_numeric(events['total_cash_amount'], errors='coerce').fillna(0.0)
+    return float(np.where(events['direction'] == 'credit', amount, -amount).sum())
+
+
+def stock_gains(stock_orders, stock_positions):
+    """Realized and unrealized gain of the stock orders (cost_basis.py), priced at the latest prices."""
+    from cost_basis import run_cost_basis, summarize
+
+    if stock_orders.empty:
+        return 0.0, 0.0
+    fills = pd.DataFrame({
+        'asset_class': 'stock',
+        'symbol': stock_orders['symbol'].astype(str).str.upper(),
+        'date': pd.to_datetime(stock_orders['date'], errors='coerce', utc=True),
+        'side': stock_orders['side'],
+        'quantity': pd.to_numeric(stock_orders['quantity'], errors='coerce').fillna(0.0),
+        'average_price': pd.to_numeric(stock_orders['average_price'], errors='coerce').fillna(0.0),
+        'fees': pd.to_numeric(stock_orders['fees'], errors='coerce').fillna(0.0),
+    })
+    fills = fills[fills['side'].isin(['buy', 'sell'])].reset_index(drop=True)
+    prices = dict(zip(stock_positions['symbol'], stock_positions['price']))
+    summary = summarize(run_cost_basis(fills), prices)
+    return float(summary['realized_gain'].sum()), float(summary['unrealized_gain'].sum())
+
+
+def fetch_account(account, rate, root=ACCOUNTS_DIR):
+    """Worker: log in to one account, fetch and write its tables. Returns a small summary dict."""
+    started = time.perf_counter()
+
+    from api_replay import install_from_env
+    from delta_export import fetch_orders, option_rows, stock_rows
+    from get_accurate_gains import compute_gains, fetch_gain_inputs
+    from request_scheduler import TokenBucket, get_scheduler
+    from stress_scenarios import load_open_legs, prepare_legs
+
+    install_from_env()
+    try:
+        account_config.login(account)
+    except EOFError:
+        # The stored session expired between the parent's login and this one
+        raise RuntimeError(f"The stored session of account '{account['name']}' is not valid and a worker "
+                           f"cannot prompt for the password or MFA code, run multi_account.py again") from None
+
+    # Each worker gets its share of the overall request rate
+    scheduler = get_scheduler()
+    scheduler.bucket = TokenBucket(rate, max(1, rate))
+
+    gain_inputs = fetch_gain_inputs()
+    open_legs = load_open_legs()
+    tables = {
+        'stock_orders': stock_rows(fetch_orders('stock')),
+        'option_orders': option_rows(fetch_orders('option')),
+        'stock_positions': fetch_stock_positions(),
+        'option_positions': prepare_legs(open_legs) if len(open_legs) else open_legs,
+        'transfers': pd.DataFrame(gain_inputs['transfers']),
+        'events': fetch_option_events(),
+    }
+    legs = tables['option_positions']
+    legs['market_value'] = legs['quantity'] * legs['mark_price'] * 100
+    legs['delta_dollars'] = option_delta_dollars(legs)
+
+    directory = account_dir(account['name'], root)
+    os.makedirs(directory, exist_ok=True)
+    for table, df in tables.items():
+        df.insert(0, 'account', account['name'])
+        df.to_csv(os.path.join(directory, f'{table}.csv'), index=False)
+
+    gains = compute_gains(**gain_inputs)
+    realized, unrealized = stock_gains(tables['stock_orders'], tables['stock_positions'])
+    pnl = {
+        'account': account['name'],
+        'money_invested': gains['money_invested'],
+        'equity': gains['equity'],
+        'dividends': gains['dividends'],
+        'gain_minus_dividends': gains['gain_minus_dividends'],
+        'option_premiums': option_premiums(tables['option_orders']),
+        'option_event_cash': event_cash(tables['events']),
+        'stock_realized_gain': realized,
+        'stock_unrealized_gain': unrealized,
+        'stock_value': float(tables['stock_positions']['market_value'].sum()),
+        'option_value': float(legs['market_value'].sum()),
+    }
+    return {
+        'account': account['name'],
+        'pnl': pnl,
+        'rows': {table: len(df) for table, df in tables.items()},
+        'seconds': round(time.perf_counter() - started, 2),
+        'api': scheduler.stats(),
+    }
+
+
+def run_accounts(accounts, rate=5.0, root=ACCOUNTS_DIR):
+    """Fetch every account in its own process. Returns the worker summaries, in account order."""
+    from api_replay import install_from_env
+
+    # Log in here, where the password and MFA prompts can be answered; the workers reuse the stored sessions
+    install_from_env()
+    for account in accounts:
+        print(f"Logging in to {account['name']}")
+        account_config.login(account)
+
+    # spawn gives every worker a clean interpreter instead of a fork of a threaded parent
+    context = multiprocessing.get_context('spawn')
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=len(accounts), mp_context=context) as executor:
+        futures = [executor.submit(fetch_account, account, rate / len(accounts), root) for account in accounts]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[summary['account']] = summary
+            print(f"{summary['account']}: {sum(summary['rows'].values())} rows in {summary['seconds']}s, "
+                  f"{summary['api']['calls']} api calls")
+    return [summaries[account['name']] for account in accounts]
+
+
+def combine_tables(names, root=ACCOUNTS_DIR):
+    """Concatenate the tables of the accounts into ../output/accounts/<table>.csv. Returns {table: DataFrame}."""
+    combined = {}
+    for table in TABLES:
+        frames = []
+        for name in names:
+            path = os.path.join(account_dir(name, root), f'{table}.csv')
+            if os.path.exists(path) and os.path.getsize(path):
+                frames.append(pd.read_csv(path))
+        combined[table] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['account'])
+        combined[table].to_csv(os.path.join(root, f'{table}.csv'), index=False)
+    return combined
+
+
+def pnl_table(summaries):
+    """P&L per account plus the 'ALL' row of the sums."""
+    pnl = pd.DataFrame([summary['pnl'] for summary in summaries])
+    total = pnl.drop(columns=['account']).sum().to_frame().T.assign(account=ALL_ACCOUNTS)
+    pnl = pd.concat([pnl, total[pnl.columns]], ignore_index=True)
+    pnl['option_pnl'] = pnl['option_premiums'] + pnl['option_event_cash']
+    return pnl
+
+
+def exposure_table(stock_positions, option_positions):
+    """Stock value, option value and delta dollars per account and symbol, plus the 'ALL' rows per symbol."""
+    stocks = stock_positions.reindex(columns=['account', 'symbol', 'quantity', 'market_value']).rename(
+        columns={'quantity': 'shares', 'market_value': 'stock_value'})
+    options = option_positions.reindex(columns=['account', 'chain_symbol', 'quantity', 'market_value', 'delta_dollars']).rename(
+        columns={'chain_symbol': 'symbol', 'quantity': 'contracts', 'market_value': 'option_value'})
+    columns = ['shares', 'stock_value', 'contracts', 'option_value', 'delta_dollars']
+    exposure = pd.concat([stocks, options], ignore_index=True).reindex(columns=['account', 'symbol'] + columns)
+    exposure[columns] = exposure[columns].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+
+    per_account = exposure.groupby(['account', 'symbol'], as_index=False)[columns].sum()
+    combined = exposure.groupby('symbol', as_index=False)[columns].sum().assign(account=ALL_ACCOUNTS)
+    exposure = pd.concat([per_account, combined[per_account.columns]], ignore_index=True)
+    # Shares are their own delta dollars
+    exposure['net_delta_dollars'] = exposure['stock_value'] + exposure['delta_dollars']
+    return exposure
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Orders, positions, P&L and exposure of several accounts in one run')
+    parser.add_argument('--accounts', help='account names separated by commas (default: all configured accounts)')
+    parser.add_argument('--rate', type=float, default=5.0, help='API requests per second, split between the accounts')
+    args = parser.parse_args()
+
+    configured = account_config.load_accounts()
+    if args.accounts:
+        configured = [account_config.get_account(name, configured) for name in args.accounts.split(',')]
+    if not configured:
+        print("No accounts configured: set RH_ACCOUNTS or write ../output/accounts.json (see accounts.py)")
+        return
+
+    os.makedirs(ACCOUNTS_DIR, exist_ok=True)
+    summaries = run_accounts(configured, args.rate)
+    tables = combine_tables([account['name'] for account in configured])
+
+    pnl = pnl_table(summaries)
+    exposure = exposure_table(tables['stock_positions'], tables['option_positions'])
+    pnl.to_csv(os.path.join(ACCOUNTS_DIR, 'pnl.csv'), index=False)
+    exposure.to_csv(os.path.join(ACCOUNTS_DIR, 'exposure.csv'), index=False)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(pnl.set_index('account').round(2).T.to_string())
+        print(exposure[exposure['account'] == ALL_ACCOUNTS].drop(columns=['account']).round(2).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
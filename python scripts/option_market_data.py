@@ -0,0 +1,169 @@
+"""
+Batched option market data for the scanners.
+
+robin_stocks' find_options_by_specific_profitability and find_options_by_expiration list
+the instruments of a symbol and then fetch the market data of every instrument on its
+own: get_option_market_data_by_id requests the instrument again and then its market
+data, so a chain of N contracts costs 2N requests, one after the other (plus two chain id
+lookups per symbol), before the PoP band is applied. fetch_options returns the same
+options with:
+
+- one chain id lookup per symbol, kept for the process once it is answered, and the
+  paginated list of its active instruments, filtered by expiration, type and strike by
+  the endpoint
+- the market data of MARKET_DATA_BATCH instruments per request, by instrument URL. The
+  batches of all the symbols are submitted to the request scheduler together, so they
+  are pipelined under its rate limit and concurrency instead of waiting for each other
+- the PoP band applied to every batch as it returns
+
+A chain of 200 contracts takes 2 + 4 requests instead of about 400.
+
+Usage:
+    from option_market_data import fetch_options
+    options = fetch_options(['AMD', 'META'], '2024-04-26', optionType='put', profitFloor=0.65, profitCeiling=0.85)
+"""
+
+import threading
+
+from request_scheduler import get_scheduler
+
+MARKET_DATA_BATCH = 50
+PROFIT_TYPES = ('chance_of_profit_short', 'chance_of_profit_long')
+
+_chain_ids = {}  # symbol -> chain id
+_chain_ids_lock = threading.Lock()
+
+
+def _lookup_chain_id(symbol):
+    """The chain id of a symbol, '' when it has no options, None when the lookup failed."""
+    from robin_stocks.robinhood.helper import request_get
+    from robin_stocks.robinhood.urls import instruments_url
+
+    # id_for_chain returns None for a failed request and for an unknown symbol alike
+    data = request_get(instruments_url(), 'regular', {'symbol': symbol})
+    if not isinstance(data, dict) or not isinstance(data.get('results'), list):
+        return None
+    results = data['results']
+    return (results[0].get('tradable_chain_id') if results else None) or ''
+
+
+def chain_id(symbol):
+    """Return the option chain id of a symbol ('' when it has no options or the lookup failed).
+
+    Only the answered lookups are kept for the process; a failed one is tried again on the next call.
+    """
+    symbol = symbol.upper().strip()
+    with _chain_ids_lock:
+        if symbol in _chain_ids:
+            return _chain_ids[symbol]
+    value = get_scheduler().call(_lookup_chain_id, symbol)
+    if value is None:
+        return ''
+    with _chain_ids_lock:
+        _chain_ids[symbol] = value
+    return value
+
+
+def list_instruments(symbol, expirationDate=None, strikePrice=None, optionType=None):
+    """Return the active option instruments of a symbol, without market data."""
+    from robin_stocks.robinhood.helper import request_get
+    from robin_stocks.robinhood.urls import option_instruments_url
+
+    symbol = symbol.upper().strip()
+    chain = chain_id(symbol)
+    if not chain:
+        print(f"Symbol {symbol} is not valid for finding options.")
+        return []
+
+    payload = {'chain_id': chain, 'chain_symbol': symbol, 'state': 'active'}
+    if expirationDate:
+        payload['expiration_dates'] = expirationDate
+    if strikePrice:
+        payload['strike_price'] = strikePrice
+    if optionType:
+        payload['type'] = optionType.lower().strip()
+
+    instruments = get_scheduler().call(request_get, option_instruments_url(), 'pagination', payload) or []
+    return [instrument for instrument in instruments
+            if instrument and (not expirationDate or instrument.get('expiration_date') == expirationDate)]
+
+
+def fetch_market_data_batch(instrument_urls):
+    """Fetch the market data of a batch of option instruments (URLs) in one request."""
+    from robin_stocks.robinhood.helper import request_get
+    from robin_stocks.robinhood.urls import marketdata_options_url
+
+    return request_get(marketdata_options_url(), 'results', {'instruments': ','.join(instrument_urls)})
+
+
+def _batches(items, size=MARKET_DATA_BATCH):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def fetch_market_data(instrument_urls):
+    """Return {instrument url: market data} for the option instruments, one request per batch."""
+    market_data = {}
+    for results in get_scheduler().map(fetch_market_data_batch, _batches(sorted(set(instrument_urls)))):
+        for data in results or []:
+            if data and data.get('instrument'):
+                market_data[data['instrument']] = data
+    return market_data
+
+
+def merge_batch(instruments, results, typeProfit='chance_of_profit_short', profitFloor=0.0, profitCeiling=1.0,
+                keep_missing=False):
+    """Merge the market data of a batch into its instruments and keep the ones inside the PoP band.
+
+    Without typeProfit every instrument is kept, with its market data when there is some.
+    With keep_missing, the options that have market data but no typeProfit value are kept
+    too (for iv_solver.fill_missing_fields to derive it).
+    """
+    market_data = {data['instrument']: data for data in results or [] if data and data.get('instrument')}
+    options = []
+    for instrument in instruments:
+        data = market_data.get(instrument['url'])
+        if data is None:
+            if typeProfit is None:
+                options.append(instrument)
+            continue
+        option = dict(instrument, **data)
+        if typeProfit is not None:
+            try:
+                value = float(option[typeProfit])
+            except (KeyError, TypeError, ValueError):
+                if keep_missing:
+                    options.append(option)
+                continue
+            if not profitFloor <= value <= profitCeiling:
+                continue
+        options.append(option)
+    return options
+
+
+def fetch_options(inputSymbols, expirationDate=None, strikePrice=None, optionType=None,
+                  typeProfit='chance_of_profit_short', profitFloor=0.0, profitCeiling=1.0, info=None,
+                  keep_missing=False):
+    """Return the options of the symbols with their market data whose typeProfit is in [profitFloor, profitCeiling].
+
+    Same arguments and results as roptions.find_options_by_specific_profitability; with
+    typeProfit=None, the results of roptions.find_options_by_expiration (no PoP band).
+    keep_missing also keeps the options without a typeProfit value (see merge_batch).
+    """
+    from robin_stocks.robinhood.helper import filter_data, inputs_to_set
+
+    if typeProfit is not None and typeProfit not in PROFIT_TYPES:
+        print("Invalid string for 'typeProfit'. Defaulting to 'chance_of_profit_short'.")
+        typeProfit = 'chance_of_profit_short'
+
+    scheduler = get_scheduler()
+    symbols = inputs_to_set(inputSymbols)
+    chains = scheduler.map(lambda symbol: list_instruments(symbol, expirationDate, strikePrice, optionType), symbols)
+
+    # The batches of all the symbols, in symbol and instrument order
+    batches = [batch for instruments in chains for batch in _batches(instruments)]
+    merged = [None] * len(batches)
+    urls = [[instrument['url'] for instrument in batch] for batch in batches]
+    for position, results in scheduler.map_unordered(fetch_market_data_batch, urls):
+        merged[position] = merge_batch(batches[position], results, typeProfit, profitFloor, profitCeiling, keep_missing)
+
+    return filter_data([option for options in merged for option in options], info)
@@ -0,0 +1,312 @@
+"""
+Append-only intraday option quote history.
+
+Every quote is a fixed-width record (QUOTE_DTYPE: contract, timestamp, bid, ask, mark, IV,
+greeks, volume and open interest) in flat binary segment files under
+../output/quote_history/, read back with numpy memory maps:
+
+- the writer appends the records of every poll to the active segment (NNNNNN.active),
+  in time order, with one write per poll
+- when the active segment holds segment_records records, or its first record is
+  segment_seconds older than the poll being appended, it is sealed: its records are
+  sorted by contract and time into NNNNNN.sealed, with NNNNNN.index.npz holding the
+  [start, stop) rows of every contract. The writer also seals it at the end of its
+  session (watchlist_scanner.py), so the history of a session ends up in sealed segments. In a sealed segment the history of a contract is
+  one contiguous block, and a chain (whose contracts were registered together and have
+  consecutive codes) usually is too, so readers get memmap views without copying
+- contract ids are mapped to the uint32 codes of the records by contracts.json (id,
+  symbol, expiration, strike and type of every code), which only grows
+
+Readers open the files at query time and only see whole records, so they can read while
+a scanner keeps appending; the part of a history that is still in the active segment is
+found with one vectorized scan and copied (the active segment is small). They list the
+active segments before the sealed ones: a segment sealed in between is then found in
+the sealed listing (and its active file skipped), and one sealed after both listings is
+read from its sealed file when its active file is gone.
+
+Usage:
+    history = QuoteHistory()
+    history.append(chain_items)                      # raw chain payloads, as fetched
+    quotes = history.contract_history(contract_id)   # DataFrame, in time order
+    views = history.contract_slices(contract_id)     # zero-copy record arrays, per segment
+    chain = history.chain_history('AMD', '2024-04-26', start='2024-04-22 09:30')
+"""
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+HISTORY_ROOT = '../output/quote_history'
+SEGMENT_RECORDS = 100_000
+SEGMENT_SECONDS = 15 * 60
+QUOTE_DTYPE = np.dtype([
+    ('contract', '<u4'),
+    ('timestamp', '<M8[ms]'),
+    ('bid', '<f4'),
+    ('ask', '<f4'),
+    ('mark', '<f4'),
+    ('iv', '<f4'),
+    ('delta', '<f4'),
+    ('gamma', '<f4'),
+    ('theta', '<f4'),
+    ('vega', '<f4'),
+    ('rho', '<f4'),
+    ('volume', '<u4'),
+    ('open_interest', '<u4'),
+])
+# Record field -> raw chain payload field
+PAYLOAD_FIELDS = {
+    'bid': 'bid_price',
+    'ask': 'ask_price',
+    'mark': 'adjusted_mark_price',
+    'iv': 'implied_volatility',
+    'delta': 'delta',
+    'gamma': 'gamma',
+    'theta': 'theta',
+    'vega': 'vega',
+    'rho': 'rho',
+    'volume': 'volume',
+    'open_interest': 'open_interest',
+}
+CONTRACT_FIELDS = ['id', 'symbol', 'expiration', 'strike', 'type']
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _memmap(path):
+    """Map the whole records of a segment file read-only (empty array for an empty file)."""
+    count = os.path.getsize(path) // QUOTE_DTYPE.itemsize
+    if not count:
+        return np.empty(0, dtype=QUOTE_DTYPE)
+    return np.memmap(path, dtype=QUOTE_DTYPE, mode='r', shape=(count,))
+
+
+def _merge_ranges(starts, stops):
+    """Merge adjacent [start, stop) ranges of sorted rows."""
+    ranges = []
+    for start, stop in zip(starts, stops):
+        if stop <= start:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([start, stop])
+    return ranges
+
+
+class QuoteHistory:
+    """Memory-mapped, append-only store of option quotes over time."""
+
+    def __init__(self, root=HISTORY_ROOT, segment_records=SEGMENT_RECORDS, segment_seconds=SEGMENT_SECONDS):
+        self.root = root
+        self.segment_records = segment_records
+        self.segment_seconds = segment_seconds
+        self.contracts_path = os.path.join(root, 'contracts.json')
+        self.contracts = []  # code -> contract metadata
+        self.codes = {}      # contract id -> code
+        self._load_contracts()
+
+    # Contracts
+
+    def _load_contracts(self):
+        if os.path.exists(self.contracts_path):
+            with open(self.contracts_path) as f:
+                self.contracts = json.load(f)
+        self.codes = {contract['id']: code for code, contract in enumerate(self.contracts)}
+
+    def _save_contracts(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.contracts_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.contracts, f)
+        os.replace(tmp_path, self.contracts_path)
+
+    def register(self, items):
+        """Return the codes of the raw chain items, registering the new contracts."""
+        new = False
+        codes = np.empty(len(items), dtype='<u4')
+        for i, item in enumerate(items):
+            code = self.codes.get(item['id'])
+            if code is None:
+                code = self.codes[item['id']] = len(self.contracts)
+                self.contracts.append({
+                    'id': item['id'],
+                    'symbol': item.get('symbol') or item.get('chain_symbol'),
+                    'expiration': item.get('expiration_date'),
+                    'strike': _number(item.get('strike_price')),
+                    'type': item.get('type'),
+                })
+                new = True
+            codes[i] = code
+        if new:
+            self._save_contracts()
+        return codes
+
+    def contract_frame(self):
+        """The registered contracts as a DataFrame indexed by code."""
+        return pd.DataFrame(self.contracts, columns=CONTRACT_FIELDS)
+
+    # Writing
+
+    def _segments(self, suffix):
+        return sorted(glob.glob(os.path.join(self.root, f'*.{suffix}')))
+
+    def _active_path(self):
+        for path in self._segments('active'):
+            # Left over by a seal that was interrupted after the sealed file was written
+            if os.path.exists(path[:-len('.active')] + '.sealed'):
+                os.remove(path)
+        active = self._segments('active')
+        if active:
+            return active[-1]
+        sealed = self._segments('sealed')
+        number = int(os.path.basename(sealed[-1]).split('.')[0]) + 1 if sealed else 0
+        return os.path.join(self.root, f'{number:06d}.active')
+
+    def append(self, items, timestamp=None):
+        """Append the quotes of raw chain items (one poll), stamped with timestamp (default: now)."""
+        items = [item for item in items if item and item.get('id')]
+        if not items:
+            return 0
+
+        records = np.zeros(len(items), dtype=QUOTE_DTYPE)
+        records['contract'] = self.register(items)
+        stamp = pd.Timestamp(timestamp) if timestamp is not None else pd.Timestamp(time.time(), unit='s')
+        records['timestamp'] = np.datetime64(stamp.tz_convert(None) if stamp.tzinfo else stamp, 'ms')
+        for field, payload_field in PAYLOAD_FIELDS.items():
+            values = np.array([_number(item.get(payload_field)) for item in items])
+            if records.dtype[field].kind == 'u':
+                values = np.nan_to_num(values).clip(0)
+            records[field] = values
+
+        path = self._active_path()
+        if self._expired(path, records['timestamp'][0]):
+            self.seal(path)
+            path = self._active_path()
+        with open(path, 'ab') as f:
+            f.write(records.tobytes())
+        if os.path.getsize(path) // QUOTE_DTYPE.itemsize >= self.segment_records:
+            self.seal(path)
+        return len(records)
+
+    def _expired(self, path, timestamp):
+        """Whether the first record of an active segment is segment_seconds older than timestamp."""
+        if self.segment_seconds is None or not os.path.exists(path) or os.path.getsize(path) < QUOTE_DTYPE.itemsize:
+            return False
+        first = np.fromfile(path, dtype=QUOTE_DTYPE, count=1)['timestamp'][0]
+        return timestamp - first >= np.timedelta64(int(self.segment_seconds * 1000), 'ms')
+
+    def seal(self, path=None):
+        """Sort the active segment by contract and time and write it as a sealed, indexed segment."""
+        path = path or self._active_path()
+        if not os.path.exists(path) or os.path.getsize(path) < QUOTE_DTYPE.itemsize:
+            return None
+        records = np.fromfile(path, dtype=QUOTE_DTYPE, count=os.path.getsize(path) // QUOTE_DTYPE.itemsize)
+        records = records[np.lexsort((records['timestamp'], records['contract']))]
+
+        base = path[:-len('.active')]
+        codes, starts = np.unique(records['contract'], return_index=True)
+        stops = np.append(starts[1:], len(records))
+        np.savez(base + '.index.tmp.npz', codes=codes, starts=starts, stops=stops,
+                 first=records['timestamp'].min(), last=records['timestamp'].max())
+        os.replace(base + '.index.tmp.npz', base + '.index.npz')
+        records.tofile(base + '.sealed.tmp')
+        os.replace(base + '.sealed.tmp', base + '.sealed')
+        os.remove(path)
+        return base + '.sealed'
+
+    # Reading
+
+    def _sealed_ranges(self, codes, merge=True, paths=None):
+        """Yield (sealed segment path, [[start, stop), ...]) of the codes' rows."""
+        for path in self._segments('sealed') if paths is None else paths:
+            index = np.load(path[:-len('.sealed')] + '.index.npz')
+            positions = np.searchsorted(index['codes'], codes)
+            found = positions < len(index['codes'])
+            found[found] = index['codes'][positions[found]] == codes[found]
+            if found.any():
+                starts, stops = index['starts'][positions[found]], index['stops'][positions[found]]
+                yield path, _merge_ranges(starts, stops) if merge else list(zip(starts, stops))
+
+    def _sealed_parts(self, paths, codes, low=None, high=None):
+        """The codes' record views of sealed segments, limited to [low, high]."""
+        timed = low is not None or high is not None
+        parts = []
+        for path, ranges in self._sealed_ranges(codes, merge=not timed, paths=paths):
+            records = _memmap(path)
+            for begin, stop in ranges:
+                part = records[begin:stop]
+                if timed:
+                    stamps = part['timestamp']
+                    first = np.searchsorted(stamps, low, 'left') if low is not None else 0
+                    last = np.searchsorted(stamps, high, 'right') if high is not None else len(part)
+                    part = part[first:last]
+                parts.append(part)
+        return parts
+
+    def slices(self, codes, start=None, end=None):
+        """Record arrays of the codes' quotes, per segment; the sealed ones are memmap views.
+
+        start and end (UTC) limit the time range; the rows of a contract in a sealed
+        segment are sorted by time, so that range is a view as well.
+        """
+        codes = np.sort(np.asarray(codes, dtype='<u4'))
+        low = np.datetime64(pd.Timestamp(start), 'ms') if start is not None else None
+        high = np.datetime64(pd.Timestamp(end), 'ms') if end is not None else None
+
+        # Active first: a segment sealed after this listing is in the sealed one
+        active = self._segments('active')
+        sealed = self._segments('sealed')
+        active = [path for path in active if path[:-len('.active')] + '.sealed' not in sealed]
+        parts = self._sealed_parts(sealed, codes, low, high)
+
+        for path in active:
+            try:
+                records = _memmap(path)
+            except FileNotFoundError:
+                # Sealed after the listings
+                parts.extend(self._sealed_parts([path[:-len('.active')] + '.sealed'], codes, low, high))
+                continue
+            mask = np.isin(records['contract'], codes)
+            if low is not None:
+                mask &= records['timestamp'] >= low
+            if high is not None:
+                mask &= records['timestamp'] <= high
+            parts.append(records[mask])
+        return [part for part in parts if len(part)]
+
+    def contract_slices(self, contract_id, start=None, end=None):
+        if contract_id not in self.codes:
+            self._load_contracts()  # registered by the writer after this reader started
+        code = self.codes.get(contract_id)
+        return [] if code is None else self.slices([code], start, end)
+
+    def to_frame(self, parts):
+        """One DataFrame of record arrays, with the contract metadata, sorted by contract and time."""
+        if not parts:
+            return pd.DataFrame(columns=list(QUOTE_DTYPE.names) + CONTRACT_FIELDS)
+        df = pd.DataFrame(np.concatenate(parts))
+        df = df.join(self.contract_frame(), on='contract')
+        return df.sort_values(['contract', 'timestamp'], kind='mergesort').reset_index(drop=True)
+
+    def contract_history(self, contract_id, start=None, end=None):
+        """The quotes of one contract over time."""
+        return self.to_frame(self.contract_slices(contract_id, start, end))
+
+    def chain_history(self, symbol, expiration, option_type=None, start=None, end=None):
+        """The quotes of every contract of a chain over time."""
+        self._load_contracts()
+        contracts = self.contract_frame()
+        mask = (contracts['symbol'] == symbol.upper()) & (contracts['expiration'] == expiration)
+        if option_type:
+            mask &= contracts['type'] == option_type
+        return self.to_frame(self.slices(np.flatnonzero(mask), start, end))
@@ -0,0 +1,121 @@
+"""
+Order reconciliation script.
+
+Compares the parsed option orders written by rh_parse_option_orders.py
+(../output/options_orders_parsed.csv) with the option orders exported from the
+Robinhood API (../output/rh_rorders_export.csv).
+
+Instead of walking both files by position, the two sources are joined on a stable
+order key made of the order timestamp (to the second), the chain symbol and the
+sorted strike prices. The join is a single hash join (pandas merge), so inserting or
+removing one row on either side only affects that row.
+
+Each order ends up with one of these statuses:
+- matched: present in both files with the same cost (within the tolerance)
+- cost_mismatch: present in both files with a different cost
+- parsed_only: present only in the parsed orders
+- export_only: present only in the API export
+
+The result is saved to ../output/orders_reconciliation.csv and a summary is printed.
+"""
+
+import pandas as pd
+
+PARSED_PATH = '../output/options_orders_parsed.csv'
+EXPORT_PATH = '../output/rh_rorders_export.csv'
+OUTPUT_PATH = '../output/orders_reconciliation.csv'
+
+
+def normalize_strikes(strikes):
+    """Turn strike strings such as '187.5/182.5', '-187.5 / +182.5' or '[182.5, 187.5]'
+    into a canonical '182.50/187.50' key."""
+    strikes = strikes.fillna('').astype(str)
+    values = strikes.str.extractall(r'(\d+(?:\.\d+)?)')[0].astype(float)
+    values = values.map('{:.2f}'.format).reset_index(level='match', drop=True)
+    values = values.sort_values(key=lambda s: s.astype(float))
+    normalized = values.groupby(level=0).agg('/'.join)
+    return normalized.reindex(strikes.index).fillna('')
+
+
+def add_order_key(df, time_column):
+    """Add the 'order_key' and 'occurrence' columns used to join the two sources.
+
+    The occurrence counter keeps orders with an identical key (same second, symbol and
+    strikes) apart without depending on their position in the file.
+    """
+    df = df.copy()
+    timestamps = pd.to_datetime(df[time_column], format='mixed', utc=True).dt.floor('s')
+    df['order_key'] = (
+        timestamps.dt.strftime('%Y-%m-%d %H:%M:%S')
+        + '|' + df['chain_symbol'].astype(str).str.upper()
+        + '|' + normalize_strikes(df['strike_price'])
+    )
+    df['occurrence'] = df.groupby('order_key').cumcount()
+    return df
+
+
+def reconcile(parsed_df, export_df, tolerance=0.5):
+    """Join parsed orders with exported orders and classify every row.
+
+    Returns a DataFrame with one row per order key and occurrence, the cost from each
+    side, the cost difference and the reconciliation status.
+    """
+    parsed = add_order_key(parsed_df, 'order_created_at')
+    export = add_order_key(export_df, 'created_at')
+
+    parsed = parsed[['order_key', 'occurrence', 'chain_symbol', 'expiration_date', 'strike_price', 'cost']]
+    export = export[['order_key', 'occurrence', 'chain_symbol', 'expiration_date', 'strike_price', 'cost']]
+
+    merged = parsed.merge(
+        export,
+        on=['order_key', 'occurrence'],
+        how='outer',
+        suffixes=('_parsed', '_export'),
+        indicator=True,
+    )
+
+    # Keep one symbol and expiration column, whichever side the row came from
+    for column in ['chain_symbol', 'expiration_date']:
+        merged[column] = merged[f'{column}_parsed'].fillna(merged[f'{column}_export'])
+    merged = merged.drop(columns=['chain_symbol_parsed', 'chain_symbol_export',
+                                  'expiration_date_parsed', 'expiration_date_export'])
+
+    merged['cost_diff'] = (merged['cost_parsed'] - merged['cost_export']).round(2)
+
+    merged['status'] = 'matched'
+    merged.loc[merged['cost_diff'].abs() > tolerance, 'status'] = 'cost_mismatch'
+    merged.loc[merged['_merge'] == 'left_only', 'status'] = 'parsed_only'
+    merged.loc[merged['_merge'] == 'right_only', 'status'] = 'export_only'
+    merged['status'] = merged['status'].astype('category')
+
+    columns = ['order_key', 'occurrence', 'chain_symbol', 'expiration_date', 'strike_price_parsed',
+               'strike_price_export', 'cost_parsed', 'cost_export', 'cost_diff', 'status']
+    return merged[columns].sort_values(['order_key', 'occurrence']).reset_index(drop=True)
+
+
+def summarize(reconciled):
+    """Return the number of rows per reconciliation status."""
+    return reconciled['status'].value_counts().reindex(
+        ['matched', 'cost_mismatch', 'parsed_only', 'export_only'], fill_value=0
+    )
+
+
+def main():
+    parsed_df = pd.read_csv(PARSED_PATH)
+    export_df = pd.read_csv(EXPORT_PATH)
+
+    reconciled = reconcile(parsed_df, export_df)
+    reconciled.to_csv(OUTPUT_PATH, index=False)
+
+    print(summarize(reconciled).to_string())
+
+    # Show only the rows that need attention
+    problems = reconciled[reconciled['status'] != 'matched']
+    if not problems.empty:
+        print(problems.to_string(index=False))
+
+    print(f"Reconciliation saved to {OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
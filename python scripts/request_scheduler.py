@@ -0,0 +1,339 @@
+"""
+Request scheduler for Robinhood API calls.
+
+robin_stocks sends every HTTP request through one shared requests.Session. The shared
+scheduler returned by get_scheduler() wraps the send of that session, so it schedules
+each HTTP request on its own (every page of a paginated listing, every market data
+batch, every chain id lookup):
+
+- limits the request rate with a token bucket (rate requests per second, with bursts)
+- adapts the number of requests in flight with AIMD: the concurrency limit grows by
+  one slot per window of successful requests and is halved whenever a request is throttled
+- retries a request on throttling (429) and, for idempotent methods, on server errors
+  (5xx), connection errors and timeouts, with jittered exponential backoff, honouring
+  Retry-After when the server sends it. Only that request is sent again, not the whole
+  robin_stocks operation it belongs to
+- keeps counters for calls, requests, retries, throttles, failures and latency
+
+Any other exception (a programming error such as AttributeError, KeyError or TypeError)
+is raised straight away and never retried.
+
+call() and map() run robin_stocks operations (made of one or more requests) and map()
+runs them concurrently. robin_stocks catches most HTTP errors itself, prints them and
+returns None or [None]; a call records the final HTTP status of each of its requests,
+and raises ThrottledError when it returned such a failed result after a request that was
+still throttled once its retries were used up.
+
+A RequestMeter counts the HTTP requests sent inside a with block, including the threads
+started by map() and submit() inside it, but not the requests of other threads.
+
+Usage:
+    from request_scheduler import RequestMeter, get_scheduler
+
+    scheduler = get_scheduler()
+    orders = scheduler.call(r.orders.get_all_option_orders)
+    events = scheduler.map(r.get_events, symbols)
+    for position, result in scheduler.map_unordered(fetch_batch, batches): ...
+    with RequestMeter() as meter:
+        scheduler.call(fetch)
+    print(meter.requests, scheduler.stats())
+"""
+
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from requests.exceptions import ConnectionError, Timeout
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# HTTP status codes of the requests of the call running in the current thread
+_call_state = threading.local()
+# The RequestMeters counting the requests of the current context
+_meters = contextvars.ContextVar('request_meters', default=())
+
+
+class ThrottledError(Exception):
+    """Raised when a call failed because a request was still throttled after all its retries."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions per second with bursts of `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestMeter:
+    """Counts the HTTP requests sent inside `with meter:` (see the module docstring)."""
+
+    def __init__(self):
+        self.counters = {'requests': 0, 'retries': 0, 'throttles': 0, 'failures': 0}
+        self.lock = threading.Lock()
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_meters.set(_meters.get() + (self,)))
+        return self
+
+    def __exit__(self, *exc_info):
+        _meters.reset(self._tokens.pop())
+
+    @property
+    def requests(self):
+        with self.lock:
+            return self.counters['requests']
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def in_scheduled_call():
+    """Whether the current thread is running inside a scheduled call."""
+    return getattr(_call_state, 'statuses', None) is not None
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit(fn, ...) in a copy of the current context, so the RequestMeters count its requests."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _is_failed_result(result):
+    return result is None or (isinstance(result, list) and len(result) == 1 and result[0] is None)
+
+
+def _record_status(status):
+    statuses = getattr(_call_state, 'statuses', None)
+    if statuses is not None:
+        statuses.append(status)
+
+
+def _retry_after(response):
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def attach_session(session, scheduler):
+    """Send every request of a requests session through the scheduler (once)."""
+    if getattr(session.send, 'scheduler', None) is not None:
+        return
+    send = session.send
+
+    def scheduled_send(request, **kwargs):
+        return scheduler.send(send, request, **kwargs)
+
+    scheduled_send.scheduler = scheduler
+    session.send = scheduled_send
+
+
+class RequestScheduler:
+    """Rate-limited, adaptively concurrent, retrying executor for API requests."""
+
+    def __init__(self, rate=5.0, burst=10, max_concurrency=8, min_concurrency=1,
+                 max_retries=4, base_delay=0.5, max_delay=30.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.limit = float(min(max_concurrency, max(min_concurrency, 2)))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+        self.counters = {'calls': 0, 'requests': 0, 'successes': 0, 'failures': 0, 'retries': 0, 'throttles': 0}
+        self.latencies = deque(maxlen=10000)
+        self.stats_lock = threading.Lock()
+
+    # Concurrency control
+
+    def _enter(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def _exit(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _on_success(self):
+        with self.condition:
+            # Additive increase: one extra slot per `limit` successful requests
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    def _on_throttle(self):
+        with self.condition:
+            # Multiplicative decrease
+            self.limit = max(self.min_concurrency, self.limit / 2)
+
+    def _count(self, name, amount=1):
+        with self.stats_lock:
+            self.counters[name] += amount
+        for meter in _meters.get():
+            if name in meter.counters:
+                with meter.lock:
+                    meter.counters[name] += amount
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Public API
+
+    def send(self, send, request, **kwargs):
+        """Send one HTTP request with send(request, **kwargs) under the limits, retrying it when it fails transiently."""
+        idempotent = request.method.upper() in IDEMPOTENT_METHODS
+        attempts = self.max_retries + 1
+
+        for attempt in range(attempts):
+            self.bucket.acquire()
+            self._enter()
+            self._count('requests')
+            started = time.perf_counter()
+            response = None
+            error = None
+            try:
+                response = send(request, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                error = e
+            finally:
+                with self.stats_lock:
+                    self.latencies.append(time.perf_counter() - started)
+                self._exit()
+
+            status = response.status_code if response is not None else None
+            throttled = status == 429
+            transient = error is not None or (status is not None and status >= 500)
+
+            if not (throttled or transient):
+                self._on_success()
+                self._count('successes')
+                _record_status(status)
+                return response
+
+            if throttled:
+                self._count('throttles')
+                self._on_throttle()
+
+            if attempt + 1 >= attempts or not (throttled or idempotent):
+                self._count('failures')
+                _record_status(status)
+                if error is not None:
+                    raise error
+                return response
+
+            self._count('retries')
+            if response is not None:
+                response.close()
+            time.sleep(self._backoff(attempt, _retry_after(response)))
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) and return its result (see the module docstring).
+
+        A call made from inside another scheduled call runs as part of the outer call.
+        """
+        if in_scheduled_call():
+            return fn(*args, **kwargs)
+
+        self._count('calls')
+        _call_state.statuses = []
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            statuses = _call_state.statuses
+            _call_state.statuses = None
+
+        if _is_failed_result(result) and 429 in statuses:
+            raise ThrottledError(f"{getattr(fn, '__name__', fn)} was throttled {self.max_retries + 1} times")
+        return result
+
+    def map(self, fn, items, **kwargs):
+        """Call fn(item, **kwargs) for every item concurrently and return the results in order.
+
+        A map made from inside a scheduled call runs its items one after the other, as
+        part of the outer call, which already runs on one of the threads of a map.
+        """
+        items = list(items)
+        if not items:
+            return []
+        if in_scheduled_call():
+            return [fn(item, **kwargs) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [submit(executor, self.call, fn, item, **kwargs) for item in items]
+            return [future.result() for future in futures]
+
+    def map_unordered(self, fn, items, **kwargs):
+        """Call fn(item, **kwargs) for every item concurrently and yield (position, result) as they finish.
+
+        Lets the caller process the first results while the later calls are still in flight.
+        """
+        items = list(items)
+        if in_scheduled_call():
+            for position, item in enumerate(items):
+                yield position, fn(item, **kwargs)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {submit(executor, self.call, fn, item, **kwargs): position for position, item in enumerate(items)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def stats(self):
+        """Return the call and request counters, the current concurrency limit and latency percentiles."""
+        with self.stats_lock:
+            stats = dict(self.counters)
+            latencies = sorted(self.latencies)
+        stats['concurrency_limit'] = round(self.limit, 2)
+        if latencies:
+            stats['latency_avg'] = round(sum(latencies) / len(latencies), 4)
+            stats['latency_p50'] = round(latencies[len(latencies) // 2], 4)
+            stats['latency_p95'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4)
+            stats['latency_max'] = round(latencies[-1], 4)
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+            try:
+                from robin_stocks.robinhood import helper
+                attach_session(helper.SESSION, _scheduler)
+            except ImportError:
+                pass
+        return _scheduler
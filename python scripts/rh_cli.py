@@ -0,0 +1,162 @@
+"""
+Unified command line for the scripts.
+
+    python rh_cli.py <command> [arguments of the command]
+    python rh_cli.py --import-times <command> ...
+    python rh_cli.py list
+
+Importing pandas, robin_stocks, plotly and friends takes most of the wall time of a
+quick lookup, so this entry point only uses the standard library at startup. The
+module of a command is imported when that command runs, and only then: `etf` with a
+fresh cache never imports robin_stocks or pandas, and a scan does not import plotly.
+
+Most commands run the existing script as if it was started directly, with its own
+arguments (python rh_cli.py batch scans.json --format csv is
+python batch_scan.py scans.json --format csv). `etf` is implemented here, so that the
+ETF membership check answers from the local holdings cache without a login.
+
+--import-times prints, after the command, the startup time of the CLI itself, the total
+run time and the time spent importing each top-level package (nested imports are
+counted in the package that triggered them).
+"""
+
+import argparse
+import builtins
+import contextlib
+import runpy
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()
+
+# command -> (module, description)
+COMMANDS = {
+    'scan': ('get_high_prob_bull_put_spreads', 'find high probability put credit spreads'),
+    'options': ('get_high_prob_put_options', 'find high probability single options'),
+    'batch': ('batch_scan', 'run the scan jobs of a JSON config without prompts'),
+    'sharded': ('sharded_scan', 'scan a large symbol universe with several processes'),
+    'watch': ('watchlist_scanner', 'poll a watchlist and update its spreads incrementally'),
+    'montecarlo': ('spread_montecarlo', 'add Monte Carlo PoP, EV and tail loss to a spreads CSV'),
+    'backtest': ('backtest', 'backtest the spread selection rules on chain snapshots'),
+    'exposure': ('chain_exposure', 'dealer gamma/delta exposure, OI-weighted IV and put/call ratios of chains'),
+    'fetch-orders': ('get_option_orders_and_parse', 'download the option orders to CSV'),
+    'export': ('delta_export', 'export the orders completed since the last export'),
+    'parse-orders': ('rh_parse_option_orders', 'parse the exported option orders and total their cost'),
+    'reconcile': ('reconcile_orders', 'reconcile the parsed orders with the Robinhood export'),
+    'gains': ('get_accurate_gains', 'compute the realized gains'),
+    'accounts': ('multi_account', 'orders, positions, P&L and exposure of several accounts'),
+    'holdings-graph': ('graph_holdings', 'graph the option holdings'),
+    'replay': ('api_replay', 'list the endpoints of a recorded API cassette'),
+    'daemon': ('rh_daemon', 'serve scans and reports from a warm local process'),
+    'warm': ('cache_warmer', 'warm the chain, expiration and instrument caches of a watchlist'),
+}
+
+
+class ImportTimer:
+    """Times the outermost imports, per top-level package, by wrapping builtins.__import__."""
+
+    def __init__(self):
+        self.times = {}
+        self.local = threading.local()
+        self.original = builtins.__import__
+
+    def __enter__(self):
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self.original
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        depth = getattr(self.local, 'depth', 0)
+        package = name.split('.')[0]
+        if depth or level or package in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+
+        self.local.depth = depth + 1
+        started = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            self.local.depth = depth
+            self.times[package] = self.times.get(package, 0.0) + time.perf_counter() - started
+
+    def report(self, command_started, limit=15):
+        imports = sum(self.times.values())
+        print(f"\ncli startup {(command_started - STARTED) * 1000:.0f} ms, imports {imports * 1000:.0f} ms, "
+              f"total {(time.perf_counter() - STARTED) * 1000:.0f} ms", file=sys.stderr)
+        for package, seconds in sorted(self.times.items(), key=lambda item: -item[1])[:limit]:
+            print(f"  {seconds * 1000:8.1f} ms  {package}", file=sys.stderr)
+
+
+def run_etf(argv):
+    """Check which ETFs hold the tickers, from the cache; reload only the stale ETFs."""
+    parser = argparse.ArgumentParser(prog='rh_cli.py etf', description='Check which ETFs hold the tickers')
+    parser.add_argument('tickers', nargs='+', help='tickers to look up')
+    parser.add_argument('--etfs', default='QQQ', help='ETFs to check, separated by commas')
+    parser.add_argument('--refresh', action='store_true', help='fetch the holdings even if the cache is fresh')
+    args = parser.parse_args(argv)
+
+    from etf_holdings_store import EtfHoldingsStore, HoldingsUnavailableError
+
+    store = EtfHoldingsStore(args.etfs.split(','))
+    if args.refresh or store.stale_etfs():
+        try:
+            store.refresh(force=args.refresh)
+        except HoldingsUnavailableError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+
+    for ticker in args.tickers:
+        holders = store.etfs_holding(ticker)
+        if holders:
+            weights = ', '.join(f"{etf} ({weight:.2%})" if weight is not None else etf for etf, weight in holders.items())
+            print(f"{ticker.upper()} is held by {weights}")
+        else:
+            print(f"{ticker.upper()} is not in the holdings of {', '.join(store.etfs)}")
+
+
+def run_script(module, argv):
+    """Run a script module as __main__, with argv as its command line arguments."""
+    sys.argv = [module + '.py'] + argv
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+def print_commands():
+    print("Commands:")
+    print(f"  {'etf':<15} check which ETFs hold the tickers (from the local cache)")
+    for command, (module, description) in COMMANDS.items():
+        print(f"  {command:<15} {description} ({module}.py)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Robinhood scripts', usage='%(prog)s [--import-times] <command> [arguments]')
+    parser.add_argument('--import-times', action='store_true', help='report the startup and import times')
+    parser.add_argument('command', help="command to run ('list' shows them)")
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of the command')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        print_commands()
+        return
+    if args.command != 'etf' and args.command not in COMMANDS:
+        print(f"Unknown command '{args.command}'")
+        print_commands()
+        sys.exit(2)
+
+    timer = ImportTimer() if args.import_times else None
+    command_started = time.perf_counter()
+    try:
+        with timer or contextlib.nullcontext():
+            if args.command == 'etf':
+                run_etf(args.arguments)
+            else:
+                run_script(COMMANDS[args.command][0], args.arguments)
+    finally:
+        if timer:
+            timer.report(command_started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Local daemon that keeps a warm session and caches in memory.
+
+Every script run starts cold: interpreter, imports, login, empty caches and full
+fetches. The daemon does all of that once and then answers scans and reports over
+HTTP on localhost, so repeated queries during the trading day come from memory:
+
+- the logged in robin_stocks session
+- a ChainCache of the option chains that were asked for
+- the ETF holdings store
+- the parsed option order ledger (../output/options_output.csv parsed like
+  rh_parse_option_orders.py), reloaded when the file changes
+
+A background thread keeps the chains that were queried in the last hour fresh (they
+are fetched again shortly before they expire), refreshes stale ETF holdings, reloads
+the ledger when its file changed and fetches the option events of the ledger.
+
+With --watchlist, the chains of the watchlist are also warmed before the open and kept
+fresh during the session by query frequency, within a request budget (cache_warmer.py).
+
+Endpoints (GET, JSON responses):
+    /health
+    /spreads?symbols=AMD,META&expirations=2024-04-26&pop_floor=0.65&pop_ceiling=0.85&widths=2.5,5,10
+    /options?symbols=AMD&expirations=2024-04-26&pop_floor=0.70&pop_ceiling=0.78
+    /etf?tickers=NVDA,AMD&etfs=QQQ,SPY
+    /pnl                   total option cost of the ledger, per symbol and with the option events
+    /ledger?symbol=AMD     parsed and aggregated orders
+    /reconcile             reconciliation of the ledger with ../output/rh_rorders_export.csv
+
+The scan endpoints accept the batch_scan.py job settings as query parameters
+(option_type, type_profit, min_volume, min_open_interest, max_bid_ask_width,
+max_strike_distance, fill_iv) and a limit on the number of rows.
+
+The daemon only listens on 127.0.0.1, and only answers requests whose Host header is
+127.0.0.1 or localhost (with its port), so a web page can not read the ledger through
+DNS rebinding. Errors come back as JSON: 400 for bad parameters or a missing order file,
+500 for any other failure.
+
+Usage:
+    python rh_daemon.py [--port 8765] [--chain-ttl 300] [--etfs QQQ,SPY] [--watchlist AMD,META]
+    curl 'http://127.0.0.1:8765/spreads?symbols=AMD&expirations=2024-04-26'
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import batch_scan
+import reconcile_orders
+import rh_parse_option_orders as order_parser
+from cache_warmer import CacheWarmer
+from chain_cache import ChainCache
+from etf_holdings_store import EtfHoldingsStore
+from get_high_prob_bull_put_spreads import try_login
+from request_scheduler import get_scheduler
+
+DEFAULT_PORT = 8765
+ORDERS_PATH = '../output/options_output.csv'
+WATCH_SECONDS = 60 * 60
+REFRESH_INTERVAL = 30
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+
+
+def _frame_rows(df, limit=None):
+    """Return the rows of a DataFrame as JSON-ready dicts (NaN becomes null)."""
+    if df is None:
+        return []
+    if limit:
+        df = df.head(limit)
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+class OrderLedger:
+    """The parsed order ledger, reloaded when the order export file changes."""
+
+    def __init__(self, path=ORDERS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.orders = None        # aggregated orders with their cost
+        self.events_total = None  # cash amount of the option events, None until fetched
+
+    def reload_if_changed(self):
+        """Parse the order file again when it changed. Returns True when it was reloaded."""
+        if not os.path.exists(self.path):
+            return False
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return False
+
+        orders = order_parser.aggregate_and_calculate_cost(order_parser.load_and_process_data(self.path))
+        with self.lock:
+            self.orders, self.mtime, self.events_total = orders, mtime, None
+        return True
+
+    def fetch_events(self):
+        """Fetch the option events of the ledger symbols, if they are not fetched yet."""
+        with self.lock:
+            orders, pending = self.orders, self.events_total is None
+        if orders is None or not pending:
+            return
+        total = order_parser.fetch_events_for_symbols(orders)
+        with self.lock:
+            if self.orders is orders:
+                self.events_total = total
+
+    def snapshot(self):
+        with self.lock:
+            return self.orders, self.events_total
+
+
+class DaemonState:
+    """Everything the daemon keeps warm between requests."""
+
+    def __init__(self, chain_ttl, etfs, orders_path=ORDERS_PATH, watchlist=None, warm_types=('put',)):
+        self.started = time.time()
+        self.cache = ChainCache(ttl=chain_ttl)
+        self.warmer = CacheWarmer(self.cache, watchlist, warm_types) if watchlist else None
+        self.etf_store = EtfHoldingsStore(etfs)
+        self.etf_lock = threading.Lock()
+        self.ledger = OrderLedger(orders_path)
+        self.watched = {}  # chain key -> last time it was queried
+        self.watch_lock = threading.Lock()
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+
+    def count_request(self):
+        with self.requests_lock:
+            self.requests += 1
+
+    def watch(self, keys):
+        now = time.time()
+        with self.watch_lock:
+            for key in keys:
+                self.watched[self.cache.key(*key)] = now
+        if self.warmer is not None:
+            self.warmer.record_query(keys, now)
+
+    def job(self, params):
+        """Build a batch_scan job from the query parameters."""
+        job = dict(batch_scan.JOB_DEFAULTS)
+        for name, values in params.items():
+            value = values[-1]
+            if name in ('symbols', 'expirations'):
+                job[name] = [item.strip().upper() if name == 'symbols' else item.strip() for item in value.split(',')]
+            elif name == 'widths':
+                job[name] = [float(width) for width in value.split(',')]
+            elif name == 'fill_iv':
+                job[name] = value.lower() in ('1', 'true', 'yes')
+            elif name in ('option_type', 'type_profit'):
+                job[name] = value
+            elif name in job:
+                job[name] = float(value)
+        if 'symbols' not in job or 'expirations' not in job:
+            raise ValueError("symbols and expirations are required")
+        self.watch(batch_scan.chain_keys(job))
+        return job
+
+    def spreads(self, params, limit=None):
+        job = self.job(params)
+        results = batch_scan.build_job_spreads(job, self.cache)
+        return {expiration: _frame_rows(df, limit) for expiration, df in results.items()}
+
+    def options(self, params, limit=None):
+        return _frame_rows(batch_scan.build_job_options(self.job(params), self.cache), limit)
+
+    def etf(self, params):
+        tickers = params.get('tickers', [''])[-1].split(',')
+        with self.etf_lock:
+            if 'etfs' in params:
+                etfs = [etf.strip().upper() for etf in params['etfs'][-1].split(',')]
+                if set(etfs) - set(self.etf_store.etfs):
+                    configured = self.etf_store.etfs
+                    self.etf_store.etfs = list(dict.fromkeys(configured + etfs))
+                    try:
+                        self.etf_store.refresh()
+                    except Exception:
+                        self.etf_store.etfs = configured
+                        raise
+            return self.etf_store.etfs_holding_any(tickers)
+
+    def pnl(self):
+        self.ledger.reload_if_changed()
+        orders, events_total = self.ledger.snapshot()
+        if orders is None:
+            raise FileNotFoundError(f"No order file at {self.ledger.path}")
+        order_cost = float(orders['cost'].sum())
+        return {
+            'order_cost': round(order_cost, 2),
+            'events_total': None if events_total is None else round(events_total, 2),
+            'total_option_cost': None if events_total is None else round(order_cost + events_total, 2),
+            'by_symbol': orders.groupby('chain_symbol')['cost'].sum().round(2).to_dict(),
+        }
+
+    def ledger_rows(self, params, limit=None):
+        self.ledger.reload_if_changed()
+        orders, _ = self.ledger.snapshot()
+        if orders is None:
+            raise FileNotFoundError(f"No order file at {self.ledger.path}")
+        if 'symbol' in params:
+            orders = orders[orders['chain_symbol'] == params['symbol'][-1].upper()]
+        return _frame_rows(orders, limit)
+
+    def reconcile(self, limit=None):
+        self.ledger.reload_if_changed()
+        orders, _ = self.ledger.snapshot()
+        if orders is None:
+            raise FileNotFoundError(f"No order file at {self.ledger.path}")
+        reconciled = reconcile_orders.reconcile(orders, pd.read_csv(reconcile_orders.EXPORT_PATH))
+        problems = reconciled[reconciled['status'] != 'matched']
+        return {
+            'summary': {status: int(count) for status, count in reconcile_orders.summarize(reconciled).items()},
+            'problems': _frame_rows(problems.astype({'status': str}), limit),
+        }
+
+    def health(self):
+        with self.watch_lock:
+            watched = len(self.watched)
+        with self.requests_lock:
+            requests = self.requests
+        with self.etf_lock:
+            etfs_unavailable = dict(self.etf_store.unavailable)
+        return {
+            'uptime_s': round(time.time() - self.started),
+            'requests': requests,
+            'chains': self.cache.stats(),
+            'watched_chains': watched,
+            'api': get_scheduler().stats(),
+            'warmer': self.warmer.stats() if self.warmer is not None else None,
+            'etfs_unavailable': etfs_unavailable,
+        }
+
+    def refresh_chains(self, interval=REFRESH_INTERVAL):
+        """Fetch the watched chains that would expire before the next round."""
+        if self.warmer is not None and self.warmer.run_once(interval=interval) == 'open':
+            return  # during the session the warmer refreshes the queried chains by priority
+        now = time.time()
+        with self.watch_lock:
+            # Forget the chains nobody asked for in a while
+            self.watched = {key: seen for key, seen in self.watched.items() if now - seen <= WATCH_SECONDS}
+            keys = list(self.watched)
+        expiring = [key for key in keys
+                    if self.cache.age(key, now) is None or self.cache.age(key, now) > self.cache.ttl - interval]
+        if expiring:
+            self.cache.refresh(expiring)
+
+    def refresh_etfs(self, interval=REFRESH_INTERVAL):
+        with self.etf_lock:
+            # The ETFs without holdings are reported in /health instead of failing every round
+            self.etf_store.refresh(strict=False)
+
+    def refresh_ledger(self, interval=REFRESH_INTERVAL):
+        self.ledger.reload_if_changed()
+        self.ledger.fetch_events()
+
+    def refresh_forever(self, interval=REFRESH_INTERVAL):
+        tasks = [self.refresh_chains, self.refresh_etfs, self.refresh_ledger]
+        while True:
+            for task in tasks:
+                try:
+                    task(interval)
+                except Exception as error:  # keep the daemon alive, the next round retries
+                    print(f"Background {task.__name__} failed: {error!r}")
+            time.sleep(interval)
+
+
+def allowed_hosts(port):
+    """The Host header values the daemon answers to (the port may be left out only for port 80)."""
+    hosts = {f'{host}:{port}' for host in LOCAL_HOSTS}
+    return hosts | set(LOCAL_HOSTS) if port == 80 else hosts
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    state = None
+    hosts = set()
+
+    def do_GET(self):
+        if (self.headers.get('Host') or '').lower() not in self.hosts:
+            return self._send(403, {'error': 'only requests to 127.0.0.1 or localhost are answered'})
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        started = time.perf_counter()
+        self.state.count_request()
+
+        try:
+            limit = int(params.pop('limit', ['0'])[-1]) or None
+        except ValueError as error:
+            return self._send(400, {'error': str(error)})
+
+        routes = {
+            '/health': lambda: self.state.health(),
+            '/spreads': lambda: self.state.spreads(params, limit),
+            '/options': lambda: self.state.options(params, limit),
+            '/etf': lambda: self.state.etf(params),
+            '/pnl': lambda: self.state.pnl(),
+            '/ledger': lambda: self.state.ledger_rows(params, limit),
+            '/reconcile': lambda: self.state.reconcile(limit),
+        }
+        if url.path not in routes:
+            return self._send(404, {'error': f"unknown endpoint {url.path}", 'endpoints': sorted(routes)})
+        try:
+            result = routes[url.path]()
+        except (ValueError, KeyError, FileNotFoundError) as error:
+            return self._send(400, {'error': str(error)})
+        except Exception as error:  # any other failure is still a JSON response
+            return self._send(500, {'error': f"{type(error).__name__}: {error}"})
+        self._send(200, {'result': result, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+    def _send(self, status, body):
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=DEFAULT_PORT, chain_ttl=300, etfs=('QQQ',), interval=REFRESH_INTERVAL, login=True,
+          watchlist=None, warm_types=('put',)):
+    """Log in, start the background refresh and serve until interrupted."""
+    if login:
+        try_login()
+
+    state = DaemonState(chain_ttl, list(etfs), watchlist=watchlist, warm_types=warm_types)
+    DaemonHandler.state = state
+    DaemonHandler.hosts = allowed_hosts(port)
+    threading.Thread(target=state.refresh_forever, args=(interval,), daemon=True).start()
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), DaemonHandler)
+    print(f"Serving on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve scans and reports from a warm local process')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--chain-ttl', type=float, default=300, help='seconds before a cached chain is stale')
+    parser.add_argument('--etfs', default='QQQ', help='ETFs of the holdings store, separated by commas')
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help='seconds between background refreshes')
+    parser.add_argument('--watchlist', help='symbols to warm before the open (comma separated, or a file with one per line)')
+    parser.add_argument('--warm-types', default='put', help='option types of the warmed chains, separated by commas')
+    args = parser.parse_args()
+
+    from sharded_scan import read_symbols
+
+    watchlist = read_symbols(args.watchlist) if args.watchlist else None
+    serve(args.port, args.chain_ttl, args.etfs.split(','), args.interval, watchlist=watchlist,
+          warm_types=args.warm_types.split(','))
+
+
+if __name__ == "__main__":
+    main()
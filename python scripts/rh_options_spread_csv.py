@@ -1,5 +1,6 @@
 import robin_stocks.robinhood as r
 import pandas as pd
+from strategy_classifier import add_strategy
 
 # Load and preprocess the options data
 df = pd.read_csv('../output/options_output.csv')
@@ -24,6 +25,9 @@ aggregated_df = df.groupby('order_created_at').agg({
     'processed_quantity': 'first'
 }).reset_index()
 
+# Label the strategy of every order once, from its legs
+aggregated_df = add_strategy(aggregated_df, df)
+
 # Function to extract strike prices from the strike_price string
 def extract_strikes(strike_string):
     return [float(s.strip('+-')) for s in strike_string.split('/')]
@@ -39,7 +43,7 @@ for symbol in unique_symbols:
     # Filter for the current symbol's spread orders
     symbol_spreads = aggregated_df[
         (aggregated_df['chain_symbol'] == symbol) & 
-        (aggregated_df['opening_strategy'].str.contains('spread|iron', case=False, na=False))
+        aggregated_df['is_spread'] & (aggregated_df['effect'] == 'open')
     ]
     
     # Find paired and unpaired opening orders
@@ -49,7 +53,7 @@ for symbol in unique_symbols:
         remaining_quantity = order['processed_quantity']
         closing_orders = aggregated_df[
             (aggregated_df['chain_symbol'] == symbol) &
-            (aggregated_df['closing_strategy'].str.contains('spread|iron', case=False, na=False)) &
+            aggregated_df['is_spread'] & ((aggregated_df['effect'] == 'close') | aggregated_df['is_roll']) &
             (aggregated_df['expiration_date'] == order['expiration_date']) &
             (aggregated_df['strike_price'] == order['strike_price'])
         ]
@@ -72,8 +76,7 @@ for symbol in unique_symbols:
         strikes = extract_strikes(order['strike_price'])
         
         potential_closes = aggregated_df[
-            (aggregated_df['closing_strategy'].notna()) &
-            (~aggregated_df['closing_strategy'].str.contains('spread|iron', case=False, na=False)) &  # Exclude spread closing orders
+            ((aggregated_df['effect'] == 'close') | aggregated_df['is_roll']) & ~aggregated_df['is_spread'] &  # Exclude spread closing orders
             (aggregated_df['expiration_date'] == order['expiration_date']) &
             (aggregated_df['chain_symbol'] == symbol) &
             (aggregated_df['strike_price'].apply(lambda x: any(s in strikes for s in extract_strikes(x))))
@@ -92,8 +95,7 @@ for symbol in unique_symbols:
     # Collect all other orders for the symbol
     all_other_orders = aggregated_df[
         (aggregated_df['chain_symbol'] == symbol) &
-        (~aggregated_df['opening_strategy'].str.contains('spread|iron', case=False, na=False)) &
-        (~aggregated_df['closing_strategy'].str.contains('spread|iron', case=False, na=False))
+        ~aggregated_df['is_spread']
     ]
     
     for _, order in all_other_orders.iterrows():
@@ -29,6 +29,7 @@ modifications for use with data from other sources.
 
 import robin_stocks.robinhood as r
 import pandas as pd
+from strategy_classifier import add_strategy
 
 # Load your spreadsheet
 df = pd.read_csv('../output/options_output.csv')
@@ -57,6 +58,9 @@ aggregated_df = df.groupby('order_created_at').agg({
     'processed_quantity': 'first'
 }).reset_index()
 
+# Label the strategy of every order once, from its legs
+aggregated_df = add_strategy(aggregated_df, df)
+
 # Function to extract strike prices from the strike_price string
 def extract_strikes(strike_string):
     return [float(s.strip('+-')) for s in strike_string.split('/')]
@@ -71,7 +75,7 @@ for symbol in unique_symbols:
     # Filter for the current symbol's spread orders
     symbol_spreads = aggregated_df[
         (aggregated_df['chain_symbol'] == symbol) & 
-        (aggregated_df['opening_strategy'].str.contains('spread|iron', case=False, na=False))
+        aggregated_df['is_spread'] & (aggregated_df['effect'] == 'open')
     ]
     
     # Find paired and unpaired opening orders
@@ -81,7 +85,7 @@ for symbol in unique_symbols:
         remaining_quantity = order['processed_quantity']
         closing_orders = aggregated_df[
             (aggregated_df['chain_symbol'] == symbol) &
-            (aggregated_df['closing_strategy'].str.contains('spread|iron', case=False, na=False)) &
+            aggregated_df['is_spread'] & ((aggregated_df['effect'] == 'close') | aggregated_df['is_roll']) &
             (aggregated_df['expiration_date'] == order['expiration_date']) &
             (aggregated_df['strike_price'] == order['strike_price'])
         ]
@@ -1,5 +1,11 @@
+import argparse
 import robin_stocks.robinhood as r
 import pandas as pd
+from request_scheduler import get_scheduler
+from api_replay import install_from_env
+from run_profiler import RunReport
+from scan_output import write_results
+from strategy_classifier import add_strategy
 
 def load_and_process_data(file_path):
     """Load the CSV file and process the data."""
@@ -34,6 +40,9 @@ def aggregate_and_calculate_cost(df):
         'processed_quantity': 'first'
     }).reset_index()
 
+    # Label the strategy of every order once, from its legs
+    aggregated_df = add_strategy(aggregated_df, df)
+
     # Sort the DataFrame
     aggregated_df = aggregated_df.sort_values(by=['chain_symbol', 'expiration_date', 'strike_price'])
 
@@ -53,9 +62,11 @@ def fetch_events_for_symbols(aggregated_df):
     unique_symbols = aggregated_df['chain_symbol'].unique()
     total_cash_amount = 0  # Initialize total cash amount
 
-    for symbol in unique_symbols:
-        events = r.get_events(symbol)  # Fetch events for the symbol
-        for event in events:
+    # Fetch events for all symbols concurrently through the request scheduler
+    all_events = get_scheduler().map(r.get_events, unique_symbols)
+
+    for events in all_events:
+        for event in events or []:
             if event['direction'] == 'credit':
                 total_cash_amount += float(event['total_cash_amount'])  # Add for exercise
             elif event['direction'] == 'debit':
@@ -63,24 +74,43 @@ def fetch_events_for_symbols(aggregated_df):
 
     return total_cash_amount  # Return the total cash amount
 
-def main():
+def main(profile=False, output_format='csv'):
     """Main function to orchestrate the workflow."""
+    report = RunReport('parse_option_orders', profile=profile)
+
+    # Use the recorded API responses when RH_RECORD / RH_REPLAY is set
+    install_from_env()
+
     email = input("Please enter your Robinhood email address: ")
-    login = r.login(email)  # Uncomment this line to perform login
+    with report.stage('login'):
+        login = r.login(email)  # Uncomment this line to perform login
 
     file_path = '../output/options_output.csv'
-    df = load_and_process_data(file_path)
+    with report.stage('load', hot=True) as stage:
+        df = load_and_process_data(file_path)
+        stage['rows'] = len(df)
     
-    aggregated_df = aggregate_and_calculate_cost(df)
+    with report.stage('aggregate', hot=True) as stage:
+        aggregated_df = aggregate_and_calculate_cost(df)
+        stage['rows'] = len(aggregated_df)
     
     # Fetch events for each unique chain symbol and calculate total cash amount
-    option_event_total = fetch_events_for_symbols(aggregated_df)
+    with report.stage('events', hot=True):
+        option_event_total = fetch_events_for_symbols(aggregated_df)
 
     total_option_cost = aggregated_df['cost'].sum() + option_event_total
     print(f"Total option cost: ${total_option_cost:.2f}")
 
     # Save the results
-    aggregated_df.to_csv('../output/options_orders_parsed.csv', index=False)
+    with report.stage('output'):
+        write_results(aggregated_df, 'options_orders_parsed', output_format, '../output/options_orders_parsed.csv')
+
+    report.write()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Parse exported option orders and total their cost')
+    parser.add_argument('--profile', action='store_true', help='capture a cProfile of the hot stages')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'both'], default='csv',
+                        help='write the parsed orders as CSV, to the Parquet dataset, or both')
+    args = parser.parse_args()
+    main(profile=args.profile, output_format=args.format)
\ No newline at end of file
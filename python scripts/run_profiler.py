@@ -0,0 +1,134 @@
+"""
+Per-stage timing and profiling for the scanner and order-analysis scripts.
+
+A RunReport records, for every stage of a run (login, fetch, cleanup, spreads, sort,
+to_csv, ...):
+- wall time and CPU time
+- the number of rows the stage produced (when the script sets it)
+- the number of HTTP requests sent by the stage, and their retries, throttles and failures,
+  counted by a RequestMeter of the request scheduler (every page and batch, including the
+  requests of the threads the stage starts)
+- peak memory: the process peak RSS, and the traced peak of the stage when profiling
+
+At the end of the run the report is written as JSON to ../output/reports/.
+
+With profile=True (the --profile switch of the scripts), the stages marked as hot are
+also run under cProfile. The profile is saved next to the JSON report as a .prof file
+(readable with pstats or snakeviz) and the top functions are included in the report.
+
+Usage:
+    report = RunReport('bull_put_scan', profile=True)
+    with report.stage('fetch', hot=True) as stage:
+        options = fetch()
+        stage['rows'] = len(options)
+    report.write()
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from request_scheduler import RequestMeter, get_scheduler
+
+REPORT_DIR = '../output/reports'
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    """Return the peak resident set size of the process in MB, if available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class RunReport:
+    """Collects per-stage metrics for one run and writes them as a JSON report."""
+
+    def __init__(self, name, profile=False, report_dir=REPORT_DIR):
+        self.name = name
+        self.profile = profile
+        self.report_dir = report_dir
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.profiler = cProfile.Profile() if profile else None
+        if profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, hot=False):
+        """Time a stage of the run. The yielded dict can be used to set 'rows' or other fields."""
+        stage = {'name': name}
+        # Send the robin_stocks requests through the scheduler before the stage starts, so the meter sees them
+        get_scheduler()
+        meter = RequestMeter()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        if hot and self.profiler:
+            self.profiler.enable()
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            with meter:
+                yield stage
+        finally:
+            stage['wall_s'] = round(time.perf_counter() - wall_started, 4)
+            stage['cpu_s'] = round(time.process_time() - cpu_started, 4)
+            if hot and self.profiler:
+                self.profiler.disable()
+
+            for counter, value in meter.stats().items():
+                stage[f'api_{counter}'] = value
+
+            if tracemalloc.is_tracing():
+                stage['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            stage['peak_rss_mb'] = _peak_rss_mb()
+            self.stages.append(stage)
+
+    def to_dict(self):
+        """Return the report as a JSON-serializable dict."""
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_wall_s': round(time.perf_counter() - self.started, 4),
+            'peak_rss_mb': _peak_rss_mb(),
+            'api': get_scheduler().stats(),
+            'stages': self.stages,
+        }
+
+    def write(self, print_summary=True):
+        """Write the JSON report (and the .prof file when profiling). Returns the report path."""
+        os.makedirs(self.report_dir, exist_ok=True)
+        base = os.path.join(self.report_dir, f"{self.name}_{self.started_at.strftime('%Y%m%d_%H%M%S')}")
+        report = self.to_dict()
+
+        if self.profiler:
+            self.profiler.dump_stats(base + '.prof')
+            report['profile_path'] = base + '.prof'
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+            report['profile_top'] = stream.getvalue().splitlines()
+
+        with open(base + '.json', 'w') as f:
+            json.dump(report, f, indent=2)
+
+        if print_summary:
+            for stage in self.stages:
+                rows = f", {stage['rows']} rows" if 'rows' in stage else ''
+                print(f"{stage['name']:>14}: {stage['wall_s']:.3f}s wall, {stage['cpu_s']:.3f}s cpu, "
+                      f"{stage['api_requests']} api requests{rows}")
+            print(f"Run report saved to {base}.json")
+        return base + '.json'
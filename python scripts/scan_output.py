@@ -0,0 +1,159 @@
+"""
+Partitioned columnar output for scan and order results.
+
+Instead of one CSV file per symbol or per scan, results are appended to a compressed
+Parquet dataset under ../output/datasets/<name>/, partitioned by scan date, symbol and
+expiration (hive layout: scan_date=2024-04-19/symbol=AMD/expiration=2024-04-26/).
+Numeric columns are stored as numbers, so readers do not re-parse text. Dates (the
+'exp date' column and the scan_date/expiration partitions) stay ISO 'YYYY-MM-DD'
+strings, which sort and compare like dates and match the values the scripts filter on.
+
+Readers only load the partitions and columns they ask for:
+
+    from scan_output import read_dataset
+    df = read_dataset('put_credit_spreads', symbols=['AMD'], expirations=['2024-04-26'],
+                      columns=['strike', 'credit', 'PoP sell'])
+
+CSV stays available as an optional export (write_results(..., csv_path=...)).
+
+pyarrow is required for the Parquet output (pip install pyarrow).
+"""
+
+import glob
+import os
+import uuid
+from datetime import date
+
+import pandas as pd
+
+DATASET_ROOT = '../output/datasets'
+PARTITION_COLUMNS = ['scan_date', 'symbol', 'expiration']
+
+# Scanner and order column names that hold the symbol and the expiration date
+SYMBOL_COLUMNS = ['symbol', 'chain_symbol']
+EXPIRATION_COLUMNS = ['exp date', 'expiration_date']
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.dataset  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+
+
+def dataset_path(name, root=DATASET_ROOT):
+    return os.path.join(root, name)
+
+
+def prepare_frame(df, scan_date=None):
+    """Return a copy of df with numeric columns and the scan_date/symbol/expiration partition columns.
+
+    Dates are kept as ISO strings.
+    """
+    df = df.copy()
+
+    df['scan_date'] = str(scan_date or date.today())
+    if 'symbol' not in df.columns:
+        df['symbol'] = df[next(column for column in SYMBOL_COLUMNS if column in df.columns)]
+    expiration_column = next((column for column in EXPIRATION_COLUMNS if column in df.columns), None)
+    df['expiration'] = df[expiration_column].astype(str) if expiration_column else 'none'
+
+    # Store numbers as numbers: object columns that are fully numeric are converted
+    for column in df.columns:
+        if column in PARTITION_COLUMNS or not pd.api.types.is_string_dtype(df[column]):
+            continue
+        converted = pd.to_numeric(df[column], errors='coerce')
+        if converted.notna().sum() == df[column].notna().sum():
+            df[column] = converted
+
+    return df
+
+
+def write_dataset(df, name, scan_date=None, root=DATASET_ROOT, run_id=None):
+    """Append df to the partitioned Parquet dataset `name`. Returns the dataset path.
+
+    The files of a write tagged with a run_id can be read back on their own (read_dataset).
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = dataset_path(name, root)
+    if df.empty:
+        return path
+
+    table = pa.Table.from_pandas(prepare_frame(df, scan_date), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=path,
+        partition_cols=PARTITION_COLUMNS,
+        compression='zstd',
+        # A unique file name per write, so later runs append instead of overwriting
+        basename_template=f"part-{run_id + '-' if run_id else ''}{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    return path
+
+
+def write_results(df, name, output_format='parquet', csv_path=None, scan_date=None, root=DATASET_ROOT, run_id=None):
+    """Write results as a Parquet dataset, a CSV file, or both ('parquet', 'csv' or 'both')."""
+    written = []
+    if output_format in ('parquet', 'both'):
+        written.append(write_dataset(df, name, scan_date, root, run_id))
+    if output_format in ('csv', 'both') and csv_path:
+        df.to_csv(csv_path, index=False)
+        written.append(csv_path)
+    return written
+
+
+def _in_range(scan_date, dates=None, start=None, end=None):
+    """Return True when the scan date is one of the dates and between start and end (inclusive)."""
+    return ((not dates or scan_date in {str(value) for value in dates})
+            and (not start or scan_date >= str(start)) and (not end or scan_date <= str(end)))
+
+
+def read_dataset(name, columns=None, symbols=None, expirations=None, dates=None, root=DATASET_ROOT, run_id=None,
+                 write_order=False, start=None, end=None):
+    """Read only the requested partitions and columns of a dataset into a DataFrame.
+
+    dates selects scan dates one by one, start and end a range of them (inclusive). With
+    run_id, only the files written by that run are read. With write_order, the files are
+    read in the order they were written, so the rows of a later write come after the rows
+    of an earlier one.
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Keep the partition values as strings instead of letting pyarrow infer dates
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor='hive')
+    source = dataset_path(name, root)
+    if run_id or write_order:
+        pattern = f'part-{run_id}-*.parquet' if run_id else '*.parquet'
+        # Only list the files of the requested scan date partitions
+        directories = [directory for directory in glob.glob(os.path.join(source, 'scan_date=*'))
+                       if _in_range(os.path.basename(directory).split('=', 1)[1], dates, start, end)]
+        source = sorted(path for directory in directories
+                        for path in glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+        if not source:
+            return pd.DataFrame(columns=columns)
+        if write_order:
+            source.sort(key=os.path.getmtime)
+    dataset = ds.dataset(source, format='parquet', partitioning=partitioning, partition_base_dir=dataset_path(name, root))
+
+    filters = []
+    for column, values in [('symbol', symbols), ('expiration', expirations), ('scan_date', dates)]:
+        if values:
+            filters.append(ds.field(column).isin([str(value) for value in values]))
+    if start:
+        filters.append(ds.field('scan_date') >= str(start))
+    if end:
+        filters.append(ds.field('scan_date') <= str(end))
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
@@ -0,0 +1,179 @@
+"""
+Sharded put credit spread scan for large symbol universes.
+
+Building spreads for every optionable name of an index is CPU-bound pandas work, so
+one process only uses one core. This script partitions the symbol universe into shards
+and runs each shard in its own worker process. The parent logs in first, where the
+password and MFA prompts can be answered; every worker reuses the stored robin_stocks
+session, fetches the chains of its shard, builds the spreads symbol by
+symbol and appends them to the partitioned Parquet dataset
+(../output/datasets/put_credit_spreads), in files tagged with the id of the run. Workers
+only return file-free summaries, so no DataFrame is ever pickled between processes; the
+parent reads the files of its run back from the dataset, so the spreads of earlier runs
+of the same day are not mixed in.
+
+The API rate limit is split between the workers, so the total request rate stays the
+same as a single process.
+
+Usage:
+    python sharded_scan.py symbols.txt 2024-04-26,2024-05-03 --workers 8
+    python sharded_scan.py AMD,META,NFLX,NVDA 2024-04-26 --workers 2
+
+The symbols can be given as a comma separated list or as a file with one symbol per line.
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+from chain_filters import add_filter_arguments, filter_settings
+
+DEFAULT_SETTINGS = {
+    'kind': 'spreads',
+    'option_type': 'put',
+    'type_profit': 'chance_of_profit_short',
+    'pop_floor': 0.65,
+    'pop_ceiling': 0.85,
+    'widths': [2.5, 5, 10],
+    'min_volume': 1,
+    'min_open_interest': 0,
+    'max_bid_ask_width': None,
+    'max_strike_distance': None,
+    'fill_iv': False,
+    'rate': 5.0,
+}
+
+
+def read_symbols(value):
+    """Return the symbols from a file (one per line) or a comma separated list."""
+    if os.path.exists(value):
+        with open(value) as f:
+            symbols = [line.strip() for line in f]
+    else:
+        symbols = value.split(',')
+    return sorted({symbol.strip().upper() for symbol in symbols if symbol.strip()})
+
+
+def make_shards(symbols, shard_count):
+    """Split the symbols into shard_count round-robin shards of similar size."""
+    shards = [symbols[number::shard_count] for number in range(shard_count)]
+    return [shard for shard in shards if shard]
+
+
+def scan_shard(shard_number, symbols, expirations, settings, scan_date, run_id):
+    """Worker: fetch, filter and build the spreads of one shard and append them to the dataset.
+
+    Returns a small summary dict instead of the data itself.
+    """
+    started = time.perf_counter()
+
+    import robin_stocks.robinhood as r
+
+    import batch_scan
+    from api_replay import install_from_env
+    from chain_cache import ChainCache
+    from request_scheduler import TokenBucket, get_scheduler
+
+    install_from_env()
+    try:
+        r.login()
+    except EOFError:
+        # The stored session expired between the parent's login and this one
+        raise RuntimeError("The stored robin_stocks session is not valid and a worker cannot prompt for "
+                           "the password or MFA code, log in first and run sharded_scan.py again") from None
+
+    # Each worker gets its share of the overall request rate
+    scheduler = get_scheduler()
+    scheduler.bucket = TokenBucket(settings['rate'], max(1, settings['rate']))
+
+    cache = ChainCache()
+    cache.prefetch([(symbol, expiration, settings['option_type'])
+                    for symbol in symbols for expiration in expirations])
+
+    files = 0
+    for symbol in symbols:
+        # One job per symbol: spreads never pair legs of different symbols
+        job = dict(settings, name=symbol, symbols=[symbol], expirations=expirations)
+        files += len(batch_scan.run_spreads_job(job, cache, '.', 'parquet', scan_date, run_id))
+
+    return {
+        'shard': shard_number,
+        'symbols': len(symbols),
+        'files': files,
+        'seconds': round(time.perf_counter() - started, 2),
+        'api': scheduler.stats(),
+        'scan_date': scan_date,
+        'run_id': run_id,
+    }
+
+
+def run_sharded_scan(symbols, expirations, workers, settings=None):
+    """Scan the symbols across a pool of worker processes and return the merged spreads (None when there are none)."""
+    import robin_stocks.robinhood as r
+
+    from api_replay import install_from_env
+    from scan_output import read_dataset
+
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    shards = make_shards(symbols, workers)
+    # Split the request rate between the workers
+    settings['rate'] = settings['rate'] / len(shards)
+    scan_date = str(date.today())
+    run_id = uuid.uuid4().hex
+
+    # Log in here, where the password and MFA prompts can be answered; the workers reuse the stored session
+    install_from_env()
+    r.login()
+
+    # spawn gives every worker a clean interpreter instead of a fork of a threaded parent
+    context = multiprocessing.get_context('spawn')
+    summaries = []
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+        futures = [executor.submit(scan_shard, number, shard, expirations, settings, scan_date, run_id)
+                   for number, shard in enumerate(shards)]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print(f"shard {summary['shard']}: {summary['symbols']} symbols in {summary['seconds']}s, "
+                  f"{summary['api']['calls']} api calls")
+
+    # Earlier runs may have written the dataset, only the files of this run count
+    if not sum(summary['files'] for summary in summaries):
+        return None, summaries
+    spreads_df = read_dataset('put_credit_spreads', symbols=symbols, expirations=expirations, dates=[scan_date],
+                              run_id=run_id)
+    return spreads_df, summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded put credit spread scan')
+    parser.add_argument('symbols', help='comma separated symbols, or a file with one symbol per line')
+    parser.add_argument('expirations', help='expiration dates (YYYY-MM-DD), separated by commas')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--pop-floor', type=float, default=DEFAULT_SETTINGS['pop_floor'])
+    parser.add_argument('--pop-ceiling', type=float, default=DEFAULT_SETTINGS['pop_ceiling'])
+    parser.add_argument('--rate', type=float, default=DEFAULT_SETTINGS['rate'],
+                        help='total API requests per second across all workers')
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+
+    symbols = read_symbols(args.symbols)
+    expirations = [expiration.strip() for expiration in args.expirations.split(',')]
+    settings = dict(filter_settings(args), pop_floor=args.pop_floor, pop_ceiling=args.pop_ceiling, rate=args.rate)
+
+    started = time.perf_counter()
+    spreads_df, summaries = run_sharded_scan(symbols, expirations, args.workers, settings)
+    if spreads_df is None:
+        print("No spreads found")
+        return
+    print(spreads_df)
+    print(f"{len(spreads_df)} spreads for {len(symbols)} symbols in {time.perf_counter() - started:.1f}s "
+          f"with {len(summaries)} workers")
+
+
+if __name__ == "__main__":
+    main()
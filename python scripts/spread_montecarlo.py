@@ -0,0 +1,179 @@
+"""
+Monte Carlo probability of profit, expected value and tail loss for put credit spreads.
+
+The 'PoP sell' column of the spread scanner is the average of the two legs'
+chance_of_profit_short, which is not the probability that the spread itself makes money,
+and says nothing about the expected value or the chance of a max loss. This module
+simulates terminal prices of the underlying and evaluates the spreads against them.
+
+For every (symbol, expiration) one set of terminal prices is simulated (geometric
+Brownian motion from the spot price, with the chain's implied volatility, antithetic
+draws) and shared by all the spreads of that chain. A bull put spread's P&L per contract is
+
+    100 * (credit - clip(short strike - S_T, 0, width))
+
+which is monotone and piecewise linear in S_T. So instead of building a spreads x paths
+payoff matrix, the paths are sorted once and every spread is evaluated with binary
+searches and prefix sums over the sorted paths. That gives exactly the averages of the
+full payoff matrix, for all spreads of a chain at once, in O(paths + spreads * log paths)
+time and memory: tens of thousands of spreads against 100k paths take milliseconds.
+
+Columns added by add_montecarlo_columns():
+- 'MC PoP': probability that the spread expires with a profit
+- 'MC EV': expected P&L per contract in dollars
+- 'MC P(max loss)': probability that the price ends at or below the long strike
+- 'MC CVaR': average P&L per contract over the worst `tail` fraction of paths (5% by default)
+
+Usage:
+    python spread_montecarlo.py AMD_2024_04_26_put_credit_spreads.csv --spot AMD=152.3 --paths 100000
+Without --spot, the latest prices are fetched from Robinhood.
+"""
+
+import argparse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from chain_filters import parse_spot_arguments
+
+DEFAULT_PATHS = 100_000
+DEFAULT_TAIL = 0.05
+MC_COLUMNS = ['MC PoP', 'MC EV', 'MC P(max loss)', 'MC CVaR']
+
+
+def years_to_expiration(expiration, today=None):
+    """Return the time to the expiration date in years, at least one day."""
+    today = today or date.today()
+    days = (date.fromisoformat(str(expiration)[:10]) - today).days
+    return max(days, 1) / 365.0
+
+
+def simulate_terminal_prices(spot, iv, years, paths=DEFAULT_PATHS, rate=0.0, rng=None):
+    """Simulate `paths` terminal prices with geometric Brownian motion and return them sorted."""
+    rng = rng if rng is not None else np.random.default_rng()
+    half = rng.standard_normal((paths + 1) // 2)
+    # Antithetic draws: every z comes with -z, which halves the variance of the mean drift
+    z = np.concatenate([half, -half])[:paths]
+    drift = (rate - 0.5 * iv * iv) * years
+    prices = spot * np.exp(drift + iv * np.sqrt(years) * z)
+    prices.sort()
+    return prices
+
+
+def parse_strikes(strikes):
+    """Split the scanner's '-short / +long' strike column into short and long strike arrays."""
+    parts = pd.Series(strikes).astype(str).str.extract(r'^-?\s*([\d.]+)\s*/\s*\+?\s*([\d.]+)$')
+    return parts[0].astype(float).to_numpy(), parts[1].astype(float).to_numpy()
+
+
+def _mean_put_value(prices, prefix, strikes, count):
+    """Return mean(max(strike - S, 0)) over the `count` lowest sorted prices, for every strike."""
+    below = np.minimum(np.searchsorted(prices, strikes), count)
+    return (strikes * below - prefix[below]) / count
+
+
+def evaluate_spreads(short_strikes, long_strikes, credits, prices, tail=DEFAULT_TAIL):
+    """Evaluate bull put spreads against sorted terminal prices.
+
+    short_strikes, long_strikes and credits are arrays (credit per share); prices must be
+    sorted. Returns a dict of arrays with 'pop', 'ev', 'max_loss_prob' and 'cvar', the
+    dollar values per contract.
+    """
+    short_strikes = np.asarray(short_strikes, dtype=float)
+    long_strikes = np.asarray(long_strikes, dtype=float)
+    credits = np.asarray(credits, dtype=float)
+    widths = short_strikes - long_strikes
+    n = len(prices)
+    prefix = np.concatenate([[0.0], np.cumsum(prices)])
+
+    # Expected loss of the spread = short put value - long put value
+    expected_loss = _mean_put_value(prices, prefix, short_strikes, n) - _mean_put_value(prices, prefix, long_strikes, n)
+
+    # Profit when S_T is above the break even; a credit above the width can not lose
+    breakeven = short_strikes - credits
+    pop = 1.0 - np.searchsorted(prices, breakeven, side='right') / n
+    pop = np.where(credits > widths, 1.0, pop)
+
+    max_loss_prob = np.searchsorted(prices, long_strikes, side='right') / n
+
+    # The P&L only rises with S_T, so the worst paths of every spread are the lowest prices
+    worst = max(1, int(np.ceil(tail * n)))
+    tail_loss = _mean_put_value(prices, prefix, short_strikes, worst) - _mean_put_value(prices, prefix, long_strikes, worst)
+
+    return {
+        'pop': pop,
+        'ev': 100 * (credits - expected_loss),
+        'max_loss_prob': max_loss_prob,
+        'cvar': 100 * (credits - tail_loss),
+    }
+
+
+def add_montecarlo_columns(spreads_df, spot_prices, ivs=None, paths=DEFAULT_PATHS, rate=0.0,
+                           tail=DEFAULT_TAIL, seed=None, today=None):
+    """Return a copy of spreads_df (as built by buildSpreadsFrame) with the MC columns.
+
+    spot_prices is {symbol: price}. ivs is an optional {(symbol, exp date): iv}; by default
+    the median 'impl vol' of the chain's spreads is used. Spreads of symbols without a spot
+    price or a volatility get NaN.
+    """
+    df = spreads_df.copy()
+    for column in MC_COLUMNS:
+        df[column] = np.nan
+    if df.empty:
+        return df
+
+    rng = np.random.default_rng(seed)
+    short_strikes, long_strikes = parse_strikes(df['strike'])
+    credits = df['credit'].astype(float).to_numpy()
+
+    for (symbol, expiration), index in df.groupby(['symbol', 'exp date']).indices.items():
+        spot = spot_prices.get(symbol)
+        iv = (ivs or {}).get((symbol, expiration))
+        if iv is None:
+            iv = df['impl vol'].iloc[index].astype(float).median()
+        if not spot or not iv or np.isnan(iv):
+            continue
+
+        # One set of paths per chain, shared by all of its spreads
+        prices = simulate_terminal_prices(spot, iv, years_to_expiration(expiration, today), paths, rate, rng)
+        results = evaluate_spreads(short_strikes[index], long_strikes[index], credits[index], prices, tail)
+
+        positions = df.index[index]
+        df.loc[positions, 'MC PoP'] = results['pop'].round(4)
+        df.loc[positions, 'MC EV'] = results['ev'].round(2)
+        df.loc[positions, 'MC P(max loss)'] = results['max_loss_prob'].round(4)
+        df.loc[positions, 'MC CVaR'] = results['cvar'].round(2)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo PoP, EV and tail loss for put credit spreads')
+    parser.add_argument('spreads', help='CSV file written by get_high_prob_bull_put_spreads.py')
+    parser.add_argument('--spot', nargs='*', help='spot prices as SYMBOL=PRICE (fetched when omitted)')
+    parser.add_argument('--paths', type=int, default=DEFAULT_PATHS, help='simulated paths per chain')
+    parser.add_argument('--rate', type=float, default=0.0, help='annual risk-free rate used as drift')
+    parser.add_argument('--tail', type=float, default=DEFAULT_TAIL, help='tail fraction for the CVaR')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='output CSV (default: <spreads>_mc.csv)')
+    args = parser.parse_args()
+
+    spreads_df = pd.read_csv(args.spreads)
+    spot_prices = parse_spot_arguments(args.spot)
+    if not spot_prices:
+        from chain_filters import fetch_spot_prices
+        from get_high_prob_bull_put_spreads import try_login
+
+        try_login()
+        spot_prices = fetch_spot_prices(spreads_df['symbol'].unique())
+
+    df = add_montecarlo_columns(spreads_df, spot_prices, paths=args.paths, rate=args.rate,
+                                tail=args.tail, seed=args.seed)
+    output = args.output or args.spreads.replace('.csv', '') + '_mc.csv'
+    df.to_csv(output, index=False)
+    print(df.sort_values('MC EV', ascending=False))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Strategy classifier for multi-leg option orders.
+
+The order scripts used to find spreads with str.contains('spread|iron') scans over
+opening_strategy and closing_strategy, repeated inside their loops. classify_orders()
+labels every order once, from its leg structure, and the scripts filter on the result:
+
+- 'strategy': categorical, one of STRATEGIES. The leg structure decides (number of legs,
+  calls and puts, distinct strikes and expirations), so a 'custom' vertical is still a
+  vertical and a calendar is not taken for a vertical. A roll is classified by the legs
+  it opens (a rolled put is a single, not a diagonal), or by its strategy strings when
+  its legs have no position_effect. Orders whose legs match no known structure fall
+  back to the strategy strings.
+- 'effect': categorical, 'open' or 'close', from the position_effect of the legs when
+  present, otherwise from the strategy strings; 'open' wins for an order that does both,
+  as the opening_strategy did in the scripts.
+- 'is_roll': True for the orders that close and open legs at once (or have both strategy
+  strings). They keep their strategy and effect, so the scripts still pair them as the
+  opening and as the closing order of a spread.
+- 'is_spread': True for the multi-leg defined-risk strategies in SPREAD_STRATEGIES,
+  what the 'spread|iron' scans were looking for.
+
+Usage:
+    aggregated_df = add_strategy(aggregated_df, legs_df)   # both keyed by order_created_at
+    spreads = aggregated_df[aggregated_df['is_spread'] & (aggregated_df['effect'] == 'open')]
+    closes = aggregated_df[aggregated_df['is_spread'] & ((aggregated_df['effect'] == 'close') | aggregated_df['is_roll'])]
+"""
+
+import numpy as np
+import pandas as pd
+
+STRATEGIES = ['single', 'vertical', 'iron_condor', 'iron_butterfly', 'condor', 'butterfly',
+              'straddle', 'strangle', 'calendar', 'diagonal', 'other']
+SPREAD_STRATEGIES = ['vertical', 'iron_condor', 'iron_butterfly', 'condor', 'butterfly', 'calendar', 'diagonal']
+EFFECTS = ['open', 'close']
+STRATEGY_DTYPE = pd.CategoricalDtype(STRATEGIES)
+EFFECT_DTYPE = pd.CategoricalDtype(EFFECTS)
+
+# Strategy strings -> label; the leftmost match wins, so 'iron_condor' is not a 'condor'
+# and 'short_call_calendar_spread' is not a vertical
+STRING_PATTERN = r'(iron_condor|iron_butterfly|calendar|diagonal|condor|butterfly|straddle|strangle|spread)'
+STRING_LABELS = {'spread': 'vertical'}
+
+
+def strategy_from_strings(opening, closing):
+    """Label orders from their opening/closing strategy strings (NaN when they name no strategy)."""
+    strings = opening.fillna(closing).astype('string').str.lower()
+    return strings.str.extract(STRING_PATTERN, expand=False).replace(STRING_LABELS)
+
+
+def leg_statistics(legs, order_key='order_created_at'):
+    """Return the per order leg counts the classification is based on."""
+    legs = legs.assign(
+        _strike=pd.to_numeric(legs['strike_price'], errors='coerce').abs(),
+        _call=legs['option_type'].eq('call'),
+        _open=legs['position_effect'].eq('open') if 'position_effect' in legs else False,
+        _close=legs['position_effect'].eq('close') if 'position_effect' in legs else False,
+    )
+    return legs.groupby(order_key, sort=False).agg(
+        legs=('_strike', 'size'),
+        strikes=('_strike', 'nunique'),
+        expirations=('expiration_date', 'nunique'),
+        calls=('_call', 'sum'),
+        opens=('_open', 'sum'),
+        closes=('_close', 'sum'),
+        opening_strategy=('opening_strategy', 'first'),
+        closing_strategy=('closing_strategy', 'first'),
+    )
+
+
+def leg_structure(stats):
+    """Label orders from their leg statistics ('other' when the legs match no known structure)."""
+    n, strikes, expirations = stats['legs'], stats['strikes'], stats['expirations']
+    calls = stats['calls']
+    puts = n - calls
+    one_type = (calls == 0) | (puts == 0)
+    same_expiration = expirations == 1
+
+    conditions = [
+        n == 1,
+        (n == 2) & same_expiration & one_type & (strikes == 2),
+        (n == 2) & same_expiration & (calls == 1) & (strikes == 1),
+        (n == 2) & same_expiration & (calls == 1) & (strikes == 2),
+        (n == 2) & (expirations == 2) & one_type & (strikes == 1),
+        (n == 2) & (expirations == 2) & one_type & (strikes == 2),
+        (n == 3) & same_expiration & one_type & (strikes == 3),
+        (n == 4) & same_expiration & one_type & (strikes == 3),
+        (n == 4) & same_expiration & one_type & (strikes == 4),
+        (n == 4) & same_expiration & (calls == 2) & (strikes == 3),
+        (n == 4) & same_expiration & (calls == 2) & (strikes == 4),
+    ]
+    choices = ['single', 'vertical', 'straddle', 'strangle', 'calendar', 'diagonal',
+               'butterfly', 'butterfly', 'condor', 'iron_butterfly', 'iron_condor']
+    return pd.Series(np.select(conditions, choices, default='other'), index=stats.index)
+
+
+def classify_orders(legs, order_key='order_created_at'):
+    """Classify every order of a leg table. Returns 'strategy', 'effect', 'is_roll' and 'is_spread' per order key."""
+    stats = leg_statistics(legs, order_key)
+    opening, closing = stats['opening_strategy'].notna(), stats['closing_strategy'].notna()
+    opens, closes = stats['opens'] > 0, stats['closes'] > 0
+    leg_roll = opens & closes
+    roll = leg_roll | (opening & closing)
+
+    strategy = leg_structure(stats)
+    # A roll is the structure of the legs it opens
+    if leg_roll.any():
+        opened = legs[legs[order_key].isin(stats.index[leg_roll]) & legs['position_effect'].eq('open')]
+        strategy.update(leg_structure(leg_statistics(opened, order_key)))
+    from_strings = strategy_from_strings(stats['opening_strategy'], stats['closing_strategy'])
+    strategy = strategy.mask(strategy.eq('other') & from_strings.notna(), from_strings)
+    # Without position effects only the strings tell what a roll opens
+    strategy = strategy.mask(roll & ~leg_roll, from_strings.fillna('other'))
+
+    effect = np.select([opening | opens, closing | closes], ['open', 'close'], default=None)
+
+    result = pd.DataFrame({
+        'strategy': pd.Categorical(strategy, dtype=STRATEGY_DTYPE),
+        'effect': pd.Categorical(effect, dtype=EFFECT_DTYPE),
+        'is_roll': roll.to_numpy(),
+    }, index=stats.index)
+    result['is_spread'] = result['strategy'].isin(SPREAD_STRATEGIES)
+    return result
+
+
+def add_strategy(orders, legs, order_key='order_created_at'):
+    """Return the order table with the 'strategy', 'effect', 'is_roll' and 'is_spread' columns of classify_orders()."""
+    orders = orders.drop(columns=['strategy', 'effect', 'is_roll', 'is_spread'], errors='ignore')
+    return orders.join(classify_orders(legs, order_key), on=order_key)
@@ -0,0 +1,235 @@
+"""
+Stress scenarios for the open option positions.
+
+Revalues every open leg under a grid of underlying moves, implied volatility shifts and
+days of time decay, and reports the P&L by symbol, by strategy and for the portfolio.
+
+- the legs are the open option positions (get_open_option_positions), with the strike,
+  type and expiration joined from the instrument cache (instrument_cache.py), the IV and
+  mark from the option market data (one request per batch of instruments) and the spot
+  prices of their underlyings; a CSV of legs can be used instead (--legs)
+- legs without an IV get the IV solved from their mark (iv_solver.py)
+- every scenario of every leg is priced in one Black-Scholes computation on an array of
+  shape (days, moves, IV shifts, legs); legs that expire within the decay are worth their
+  intrinsic value
+- the P&L of a scenario is its value minus the model value today, so the no-change
+  scenario is 0; it is aggregated per group with one matrix product
+- the strategy of a leg is the structure of the legs of its symbol and expiration
+  (strategy_classifier.py): a short put and a long put of the same expiration are a vertical,
+  several spreads on the same expiration are 'other'
+
+The moves and IV shifts are symmetric grids with an odd number of points, so the
+no-change move and IV shift are always on the grid (an even count is rounded up); the
+default 41 x 21 grid steps by 1% and 1 volatility point. It takes a few tens of
+milliseconds over a few hundred legs.
+
+The P&L tables are written as CSV to ../output/stress/ and the portfolio P&L of the first
+day is printed as a moves x IV shifts table.
+
+Usage:
+    python stress_scenarios.py --move-range 0.2 --moves 41 --iv-range 0.1 --iv-steps 21 --days 0,7
+    python stress_scenarios.py --legs legs.csv --spot AMD=160 --spot META=480
+
+A legs CSV has the columns chain_symbol, strike_price, option_type, expiration_date,
+quantity (negative for short legs) and optionally implied_volatility, mark_price and spot.
+"""
+
+import argparse
+import os
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from chain_filters import parse_spot_arguments
+from iv_solver import MIN_VOL, bs_price, implied_volatility
+from option_market_data import fetch_market_data
+from request_scheduler import get_scheduler
+from strategy_classifier import classify_orders
+
+STRESS_DIR = '../output/stress'
+CONTRACT_MULTIPLIER = 100
+LEG_COLUMNS = ['chain_symbol', 'strike_price', 'option_type', 'expiration_date', 'quantity',
+               'implied_volatility', 'mark_price', 'spot']
+
+
+def load_open_legs():
+    """Return the open option positions as a legs table (see LEG_COLUMNS)."""
+    import robin_stocks.robinhood as r
+    from chain_filters import fetch_spot_prices
+    from instrument_cache import InstrumentCache
+
+    positions = pd.DataFrame(get_scheduler().call(r.get_open_option_positions) or [])
+    if positions.empty:
+        return pd.DataFrame(columns=LEG_COLUMNS)
+
+    # The position 'type' is long/short, the instrument's call/put becomes 'option_type'
+    positions = InstrumentCache().join(positions, 'option', fields=['strike_price', 'type', 'expiration_date'], prefix='option_')
+    market_data = fetch_market_data(positions['option'])
+    spot = fetch_spot_prices(positions['chain_symbol'])
+
+    side = np.where(positions['type'] == 'short', -1.0, 1.0)
+    legs = pd.DataFrame({
+        'chain_symbol': positions['chain_symbol'],
+        'strike_price': positions['option_strike_price'],
+        'option_type': positions['option_type'],
+        'expiration_date': positions['option_expiration_date'],
+        'quantity': side * positions['quantity'].astype(float),
+        'implied_volatility': positions['option'].map(lambda url: market_data.get(url, {}).get('implied_volatility')),
+        'mark_price': positions['option'].map(lambda url: market_data.get(url, {}).get('adjusted_mark_price')),
+        'spot': positions['chain_symbol'].map(spot),
+    })
+    return legs
+
+
+def prepare_legs(legs, spot_prices=None, rate=0.0, today=None):
+    """Return the legs with numeric columns, 'years', a solved IV where it is missing and a 'strategy'."""
+    legs = legs.reindex(columns=LEG_COLUMNS).copy()
+    legs['chain_symbol'] = legs['chain_symbol'].str.upper()
+    for column in ['strike_price', 'quantity', 'implied_volatility', 'mark_price', 'spot']:
+        legs[column] = pd.to_numeric(legs[column], errors='coerce')
+    if spot_prices:
+        legs['spot'] = legs['chain_symbol'].map(spot_prices).fillna(legs['spot'])
+
+    today = today or date.today()
+    expirations = pd.to_datetime(legs['expiration_date'])
+    legs['years'] = np.maximum((expirations - pd.Timestamp(today)).dt.days.to_numpy(), 1) / 365.0
+
+    missing = ~(legs['implied_volatility'] > 0) & (legs['mark_price'] > 0) & (legs['spot'] > 0)
+    if missing.any():
+        solved = legs[missing]
+        legs.loc[missing, 'implied_volatility'] = implied_volatility(
+            solved['mark_price'], solved['spot'], solved['strike_price'], solved['years'], rate,
+            solved['option_type'].eq('call').to_numpy())
+
+    # Classify the legs of each symbol and expiration like the legs of one order
+    groups = legs.assign(group=legs['chain_symbol'] + ' ' + legs['expiration_date'].astype(str),
+                         opening_strategy=None, closing_strategy=None)
+    strategies = classify_orders(groups, 'group')['strategy']
+    legs['strategy'] = groups['group'].map(strategies).astype(strategies.dtype)
+
+    usable = (legs['spot'] > 0) & (legs['implied_volatility'] > 0) & (legs['strike_price'] > 0)
+    dropped = legs[~usable]
+    if len(dropped):
+        print(f"Skipping {len(dropped)} legs without a spot price or IV: {', '.join(dropped['chain_symbol'].unique())}")
+    return legs[usable].reset_index(drop=True)
+
+
+def revalue(legs, moves, iv_shifts, days=(0,), rate=0.0):
+    """Return the P&L of every leg in every scenario, an array of shape (days, moves, IV shifts, legs).
+
+    moves are relative underlying moves (-0.05 is a 5% drop), iv_shifts absolute IV changes
+    (0.10 is +10 points) and days the days of time decay.
+    """
+    spot = legs['spot'].to_numpy(float)
+    strike = legs['strike_price'].to_numpy(float)
+    years = legs['years'].to_numpy(float)
+    iv = legs['implied_volatility'].to_numpy(float)
+    is_call = legs['option_type'].eq('call').to_numpy()
+    quantity = legs['quantity'].to_numpy(float) * CONTRACT_MULTIPLIER
+
+    base = bs_price(spot, strike, years, rate, iv, is_call)
+
+    days = np.asarray(days, dtype=float)[:, None, None, None]
+    moves = np.asarray(moves, dtype=float)[None, :, None, None]
+    iv_shifts = np.asarray(iv_shifts, dtype=float)[None, None, :, None]
+
+    scenario_spot = spot * (1.0 + moves)
+    scenario_vol = np.maximum(iv + iv_shifts, MIN_VOL)
+    scenario_years = years - days / 365.0
+    expired = scenario_years <= 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = bs_price(scenario_spot, strike, np.maximum(scenario_years, 1e-12), rate, scenario_vol, is_call)
+    intrinsic = np.where(is_call, np.maximum(scenario_spot - strike, 0.0), np.maximum(strike - scenario_spot, 0.0))
+    value = np.where(expired, intrinsic, value)
+    return (value - base) * quantity
+
+
+def aggregate(pnl, groups):
+    """Sum the leg P&L of every scenario per group. Returns (group labels, array (..., groups))."""
+    codes, labels = pd.factorize(pd.Series(groups), sort=True)
+    onehot = np.zeros((len(codes), len(labels)))
+    onehot[np.arange(len(codes)), codes] = 1.0
+    return list(labels), pnl @ onehot
+
+
+def scenario_frame(totals, labels, moves, iv_shifts, days, name):
+    """Turn an array (days, moves, IV shifts, groups) into a long table."""
+    index = pd.MultiIndex.from_product([days, moves, iv_shifts, labels], names=['days', 'move', 'iv_shift', name])
+    return pd.DataFrame({'pnl': totals.reshape(-1).round(2)}, index=index).reset_index()
+
+
+def run_scenarios(legs, moves, iv_shifts, days=(0,), rate=0.0):
+    """Return {'portfolio', 'symbol', 'strategy'} scenario P&L tables of the prepared legs."""
+    days = list(days)
+    pnl = revalue(legs, moves, iv_shifts, days, rate)
+    results = {
+        'portfolio': scenario_frame(pnl.sum(axis=-1)[..., None], ['portfolio'], moves, iv_shifts, days, 'group'),
+    }
+    for name, column in [('symbol', 'chain_symbol'), ('strategy', 'strategy')]:
+        labels, totals = aggregate(pnl, legs[column].astype(str))
+        results[name] = scenario_frame(totals, labels, moves, iv_shifts, days, name)
+    return results
+
+
+def scenario_matrix(portfolio, day):
+    """The portfolio P&L of one day as a moves x IV shifts table."""
+    table = portfolio[portfolio['days'] == day].pivot(index='move', columns='iv_shift', values='pnl')
+    table.index = [f"{move:+.1%}" for move in table.index]
+    table.columns = [f"{shift * 100:+.1f}" for shift in table.columns]
+    return table
+
+
+def scenario_grid(limit, count):
+    """count evenly spaced values from -limit to limit, with 0 among them (an even count is rounded up)."""
+    return np.linspace(-limit, limit, max(count, 1) | 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress the open option positions over moves, IV shifts and time decay')
+    parser.add_argument('--legs', help='CSV of legs to stress instead of the open positions')
+    parser.add_argument('--spot', action='append', help='SYMBOL=PRICE, overrides the spot price (repeatable)')
+    parser.add_argument('--move-range', type=float, default=0.2, help='largest underlying move, as a fraction')
+    parser.add_argument('--moves', type=int, default=41, help='number of underlying moves (odd, to include 0)')
+    parser.add_argument('--iv-range', type=float, default=0.1, help='largest IV shift, in volatility units')
+    parser.add_argument('--iv-steps', type=int, default=21, help='number of IV shifts (odd, to include 0)')
+    parser.add_argument('--days', default='0', help='comma separated days of time decay')
+    parser.add_argument('--rate', type=float, default=0.0, help='risk free rate')
+    parser.add_argument('--output-dir', default=STRESS_DIR)
+    args = parser.parse_args()
+
+    if args.legs:
+        legs = pd.read_csv(args.legs)
+    else:
+        import robin_stocks.robinhood as r
+        from api_replay import install_from_env
+
+        install_from_env()
+        r.login()
+        legs = load_open_legs()
+
+    legs = prepare_legs(legs, parse_spot_arguments(args.spot), args.rate)
+    if legs.empty:
+        print("No open legs to stress")
+        return
+
+    moves = scenario_grid(args.move_range, args.moves)
+    iv_shifts = scenario_grid(args.iv_range, args.iv_steps)
+    days = [int(day) for day in args.days.split(',')]
+    results = run_scenarios(legs, moves, iv_shifts, days, args.rate)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    for name, frame in results.items():
+        frame.to_csv(os.path.join(args.output_dir, f"stress_{name}_{stamp}.csv"), index=False)
+
+    print(f"{len(legs)} legs, {len(days) * len(moves) * len(iv_shifts)} scenarios")
+    with pd.option_context('display.width', 250, 'display.max_columns', 30):
+        print(f"Portfolio P&L after {days[0]} days (rows: underlying move, columns: IV shift in points)")
+        print(scenario_matrix(results['portfolio'], days[0]).round(0))
+    print(f"Results saved to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
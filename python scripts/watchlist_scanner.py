@@ -0,0 +1,227 @@
+"""
+Streaming watchlist scanner for put credit spreads.
+
+Instead of rebuilding every spread on each run, this scanner keeps the option chains
+for a watchlist in memory and polls their quotes on an interval. On every tick it finds
+the contracts whose option row actually changed (any field that goes into a spread row:
+quotes, PoP, IV, greeks or volume), or that were listed or delisted, and re-evaluates
+only the spreads that contain those legs. The spread table, including the
+createSpreads-style fields ('credit', 'max_cost', 'max_profit'), is maintained
+incrementally, so the work per tick is proportional to quote churn, not chain size.
+
+The spreads follow the same rules as get_high_prob_bull_put_spreads.py: the short leg
+has the higher strike, the width must be one of the given spread widths, and the 'PoP sell'
+of both legs must be inside the profitability band for the spread to be a candidate.
+
+With --history, every poll is also appended to the intraday quote history
+(quote_history.py), and its active segment is sealed when the scanner stops.
+
+Usage:
+    python watchlist_scanner.py AMD,META,NFLX 2024-04-26 --interval 30 [--history]
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from get_high_prob_bull_put_spreads import combineOptions, try_login
+from option_market_data import fetch_options
+
+# Raw payload fields and the column names used by the scanners
+OPTION_COLUMNS = {
+    'strike_price': 'strike',
+    'expiration_date': 'exp date',
+    'ask_price': 'ask',
+    'bid_price': 'bid',
+    'adjusted_mark_price': 'mark',
+    'volume': 'volume',
+    'chance_of_profit_long': 'PoP buy',
+    'chance_of_profit_short': 'PoP sell',
+    'implied_volatility': 'impl vol',
+    'delta': 'delta',
+    'rho': 'rho',
+    'theta': 'theta',
+    'vega': 'vega',
+}
+SPREAD_COLUMNS = ['symbol', 'strike', 'exp date', 'credit', 'max_cost', 'max_profit', 'width', 'ask', 'bid',
+                  'volume', 'PoP buy', 'PoP sell', 'impl vol', 'delta', 'rho', 'theta', 'vega']
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_option_row(item):
+    """Convert one raw chain payload item into a scanner option row."""
+    row = {'symbol': item.get('symbol') or item.get('chain_symbol')}
+    for field, column in OPTION_COLUMNS.items():
+        value = item.get(field)
+        row[column] = value if column == 'exp date' else _to_float(value)
+    row['strike'] = round(row['strike'], 2)
+    for column in ['ask', 'bid', 'mark']:
+        row[column] = round(row[column], 2)
+    for column in ['PoP buy', 'PoP sell', 'impl vol']:
+        row[column] = round(row[column], 4)
+    return row
+
+
+class WatchlistScanner:
+    """Incrementally maintained put credit spread table for a watchlist."""
+
+    def __init__(self, symbols, expirationDate, spread_widths=(2.5, 5, 10),
+                 profitFloor=0.65, profitCeiling=0.85, optionType='put', fetcher=None, history=None):
+        self.symbols = [symbol.strip().upper() for symbol in symbols]
+        self.expirationDate = expirationDate
+        self.spread_widths = list(spread_widths)
+        self.profitFloor = profitFloor
+        self.profitCeiling = profitCeiling
+        self.optionType = optionType
+        self.fetcher = fetcher or self._fetch_chain
+        self.history = history    # QuoteHistory that records every poll, optional
+
+        self.options = {}         # contract id -> option row
+        self.strikes = {}         # (symbol, exp date) -> {strike: contract id}
+        self.spreads = {}         # (short id, long id) -> spread row, for every structural pair
+        self.spreads_by_leg = {}  # contract id -> set of spread keys containing it
+        self.candidates = set()   # spread keys whose legs are inside the PoP band
+
+    def _fetch_chain(self):
+        # Every contract with its market data, without a PoP band (find_options_by_expiration)
+        return fetch_options(self.symbols, expirationDate=self.expirationDate, optionType=self.optionType, typeProfit=None)
+
+    def poll(self):
+        """Fetch the chain once and apply the changes. Returns the update statistics."""
+        items = self.fetcher()
+        if self.history is not None:
+            self.history.append(items)
+        return self.apply(items)
+
+    def apply(self, items):
+        """Apply a fresh chain snapshot and re-evaluate only the spreads with changed legs."""
+        fresh = {}
+        for item in items:
+            if item and item.get('id') and _to_float(item.get('volume')) != 0:
+                fresh[item['id']] = to_option_row(item)
+
+        removed = set(self.options) - set(fresh)
+        added = set(fresh) - set(self.options)
+        # Every field of the option row goes into its spread rows (combineOptions), so any change counts
+        changed = {
+            contract_id for contract_id in set(fresh) & set(self.options)
+            if fresh[contract_id] != self.options[contract_id]
+        }
+
+        for contract_id in removed:
+            self._remove_contract(contract_id)
+
+        for contract_id in added | changed:
+            self.options[contract_id] = fresh[contract_id]
+
+        dirty = set()
+        for contract_id in added:
+            dirty |= self._add_contract(contract_id)
+        for contract_id in changed:
+            dirty |= self.spreads_by_leg.get(contract_id, set())
+
+        for key in dirty:
+            self._evaluate(key)
+
+        return {'added': len(added), 'removed': len(removed), 'changed': len(changed),
+                'recomputed': len(dirty), 'candidates': len(self.candidates)}
+
+    def _add_contract(self, contract_id):
+        """Register a new contract and create the structural pairs it forms. Returns their keys."""
+        option = self.options[contract_id]
+        group = self.strikes.setdefault((option['symbol'], option['exp date']), {})
+        group[option['strike']] = contract_id
+
+        keys = set()
+        for width in self.spread_widths:
+            # The new contract as the short (higher strike) leg, and as the long leg
+            for short_strike, long_strike in [(option['strike'], option['strike'] - width),
+                                              (option['strike'] + width, option['strike'])]:
+                short_id = group.get(round(short_strike, 2))
+                long_id = group.get(round(long_strike, 2))
+                if short_id and long_id:
+                    key = (short_id, long_id)
+                    keys.add(key)
+                    self.spreads_by_leg.setdefault(short_id, set()).add(key)
+                    self.spreads_by_leg.setdefault(long_id, set()).add(key)
+        return keys
+
+    def _remove_contract(self, contract_id):
+        """Drop a delisted contract and every spread that contains it."""
+        option = self.options.pop(contract_id)
+        group = self.strikes.get((option['symbol'], option['exp date']), {})
+        if group.get(option['strike']) == contract_id:
+            del group[option['strike']]
+
+        for key in self.spreads_by_leg.pop(contract_id, set()):
+            self.spreads.pop(key, None)
+            self.candidates.discard(key)
+            other = key[1] if key[0] == contract_id else key[0]
+            self.spreads_by_leg.get(other, set()).discard(key)
+
+    def _evaluate(self, key):
+        """Recompute one spread row and its candidate status."""
+        short_option, long_option = self.options[key[0]], self.options[key[1]]
+        width = round(short_option['strike'] - long_option['strike'], 2)
+
+        spread = combineOptions(short_option, long_option, list(short_option), width)
+        spread['credit'] = round(spread.pop('mark'), 2)
+        spread['max_cost'] = round((spread['width'] - spread['credit']) * 100, 2)
+        spread['max_profit'] = round(spread['credit'] * 100, 2)
+        self.spreads[key] = spread
+
+        if all(self.profitFloor <= option['PoP sell'] <= self.profitCeiling for option in (short_option, long_option)):
+            self.candidates.add(key)
+        else:
+            self.candidates.discard(key)
+
+    def to_frame(self):
+        """Return the current candidate spreads as a DataFrame in the scanner column order."""
+        rows = [self.spreads[key] for key in self.candidates]
+        return pd.DataFrame(rows, columns=SPREAD_COLUMNS).sort_values(['symbol', 'credit'], ascending=False)
+
+    def run(self, interval=30, iterations=None):
+        """Poll the chain every interval seconds and print the candidates after each tick."""
+        tick = 0
+        try:
+            while iterations is None or tick < iterations:
+                started = time.perf_counter()
+                stats = self.poll()
+                elapsed = time.perf_counter() - started
+                print(f"tick {tick}: {stats} in {elapsed:.2f}s")
+                if stats['recomputed']:
+                    print(self.to_frame())
+                tick += 1
+                time.sleep(max(0, interval - elapsed))
+        finally:
+            # End of the session: index the recorded quotes for the readers
+            if self.history is not None:
+                self.history.seal()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental put credit spread watchlist scanner')
+    parser.add_argument('symbols', help='stock symbols, separated by commas')
+    parser.add_argument('expiration', help='option expiration date (YYYY-MM-DD)')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls')
+    parser.add_argument('--history', action='store_true', help='record every poll in the quote history (quote_history.py)')
+    args = parser.parse_args()
+
+    try_login()
+    history = None
+    if args.history:
+        from quote_history import QuoteHistory
+        history = QuoteHistory()
+    scanner = WatchlistScanner(args.symbols.split(','), args.expiration, history=history)
+    scanner.run(interval=args.interval)
+
+
+if __name__ == "__main__":
+    main()